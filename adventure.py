@@ -1,9 +1,19 @@
 from __future__ import annotations
-import cmd2, os, shlex, sys, yaml
-from entities import Room, Door, HiddenDoor, Item, Entity, World
+import cmd2, copy, functools, os, shlex, sys, threading, yaml
+import snapshot, world_cache
+from entities import Room, Door, HiddenDoor, Item, Entity, World, NoEntityLinkException
 from items import Money, Wearable, Useable, Eatable, Computer, Phone, Weapon
-from characters import Character, AICharacter, WalkerCharacter, NonPlayerCharacter
+from characters import Character, AICharacter, WalkerCharacter, NonPlayerCharacter, provision_assistants
 from news import News
+from pathfinding import RoomGraph
+from regions import RegionLoader
+
+SAVE_FILE = os.getenv("SAVE_FILE", "adventure.save")
+
+@functools.lru_cache(maxsize=None)
+def compile_script(source, filename="world.yaml", mode='exec'):
+    """Compile a world-file script once; every world loaded from the same file shares the code object"""
+    return compile(source, f"<{filename}>", mode)
 
 class Adventure(cmd2.Cmd):
     def __init__(self, player=None, world=None, file="world.yaml", output=print):
@@ -12,6 +22,14 @@ class Adventure(cmd2.Cmd):
             self.file = file
         elif len(sys.argv) > 1:
             self.file = sys.argv[1]
+        self.output = output
+        # SessionJournal that state changes are recorded to, see journal.py
+        self.journal = None
+        self.new_game(player, world)
+        super().__init__()
+
+    def new_game(self, player=None, world=None):
+        """Set up a fresh world, player and news, loading the world from self.file"""
         if world is None:
             self.world = World(game=self, warn=False)
         else:
@@ -26,7 +44,7 @@ class Adventure(cmd2.Cmd):
         self.player.set_world(self.world)
         self.player.set_game(self)
         self.news = News()
-        self.output = output
+        self.graph = None
 
         if self.file is not None:
             # If self.file exists:
@@ -37,81 +55,117 @@ class Adventure(cmd2.Cmd):
 
         # Go to first room
         self.player.go(list(Room.get_all(world=self.world).values())[0])
-        super().__init__()
+        if self.world.digest is not None and self.world.regions is None:
+            # Snapshots are taken against the world as it is now
+            snapshot.baseline(self)
+
+    def spawn(self, output=print):
+        """
+        Start another game on the same world file, sharing this one as a template.
+
+        The parsed world is shared; the world, player and news, which every game mutates, are
+        built fresh, and so is the command interpreter's state (history, settings, macros, parser,
+        output redirection). Only the terminal prompt session is the template's, see
+        _create_main_session.
+        """
+        game = copy.copy(self)
+        game.output = output
+        game.journal = None
+        game.new_game()
+        cmd2.Cmd.__init__(game)
+        return game
+
+    def _create_main_session(self, **kwargs):
+        # A spawned game keeps its template's terminal prompt session: web sessions never read
+        # from a terminal, and building one costs more memory than the rest of a game
+        if getattr(self, "main_session", None) is not None:
+            return self.main_session
+        return super()._create_main_session(**kwargs)
 
     @staticmethod
     def load_world(filename="world.yaml", game=None, player=None, news=None, output=print):
         world_obj = World(game=game, player=player)
+
+        def script(source, mode='exec', **names):
+            """Wrap a world-file script in a function that runs its precompiled code"""
+            code = compile_script(source, filename, mode)
+            run = exec if mode == 'exec' else eval
+            namespace = {'game': game, 'player': player, 'world': world_obj, 'news': news, **names}
+            def call(var=None):
+                try:
+                    # Each run gets its own globals, so nothing a script defines outlives it
+                    return run(code, dict(namespace, var=var))
+                finally:
+                    if mode == 'exec':
+                        # Scripts can change any state, so invalidate memoized conditions
+                        world_obj.touch()
+                        world_obj.record('script')
+            return call
+
+        def populate(world, pending=None):
+            """
+            Build the rooms, items, doors and characters of a world (or region) into world_obj.
+            Doors between rooms that don't exist yet are added to pending, if given.
+            """
+            for room in world['rooms']:
+                Room(**room, game=game, player=player, world=world_obj)
+                for item in room['items']:
+                    # Return the item class based on the item type
+                    item_class = globals()[item['type']]
+                    item = dict(item)
+                    if 'func' in item:
+                        item['func'] = script(item['func'])
+                    item_class(**item, game=game, player=player, world=world_obj)
+                    Room.get(room['name'], world=world_obj).add_item(item_class.get(item['name'], world=world_obj))
+            for door in world['doors']:
+                spec = door
+                door = dict(door)
+                try:
+                    door['room1'] = Room.get(door['room1'], world=world_obj)
+                    door['room2'] = Room.get(door['room2'], world=world_obj)
+                except NoEntityLinkException:
+                    if pending is None:
+                        raise
+                    pending.append(spec)
+                    continue
+                try:
+                    door['key'] = Item.get(door['key'], world=world_obj)
+                except:
+                    pass
+                if door.get('hidden', False):
+                    if 'condition' in door:
+                        door['condition'] = script(door['condition'], mode='eval', door=door)
+                    HiddenDoor(**door, game=game, player=player, world=world_obj)
+                else:
+                    Door(**door, game=game, player=player, world=world_obj)
+            for character in world['characters']:
+                character_class = globals()[character['type']]
+                character = dict(character)
+                if 'func' in character:
+                    character['func'] = script(character['func'])
+                character['news'] = news
+                character_obj = character_class(**character, game=game, player=player, world=world_obj)
+                character_obj.go(Room.get(character['current_room'], world=world_obj))
+                try:
+                    if character_class == AICharacter and character['news'] == True:
+                        news.subscribe(character_obj)
+                except:
+                    pass
+
         # Load the world from a file
         if os.path.exists(filename):
-            with open(filename, 'r', encoding="utf-8") as stream:
-                try:
-                    world = yaml.safe_load(stream)
-                    for room in world['rooms']:
-                        Room(**room, game=game, player=player, world=world_obj)
-                        for item in room['items']:
-                            # Return the item class based on the item type
-                            item_class = globals()[item['type']]
-                            if 'func' in item:
-                                def closure(func):
-                                    return lambda var=None: exec(func, {
-                                        'game': game,
-                                        'player': player,
-                                        'world': world_obj,
-                                        'news': news,
-                                        'var': var
-                                    })
-                                item['func'] = closure(item['func']) or True
-                            item_class(**item, game=game, player=player, world=world_obj)
-                            Room.get(room['name'], world=world_obj).add_item(item_class.get(item['name'], world=world_obj))
-                    for door in world['doors']:
-                        door['room1'] = Room.get(door['room1'], world=world_obj)
-                        door['room2'] = Room.get(door['room2'], world=world_obj)
-                        try:
-                            door['key'] = Item.get(door['key'], world=world_obj)
-                        except:
-                            pass
-                        if door.get('hidden', False):
-                            if 'condition' in door:
-                                def closure(condition):
-                                    return lambda var=None: eval(condition, {
-                                        'game': game,
-                                        'player': player,
-                                        'world': world_obj,
-                                        'news': news,
-                                        'door': door,
-                                        'var': var
-                                    })
-                                door['condition'] = closure(door['condition']) or True
-                            HiddenDoor(**door, game=game, player=player, world=world_obj)
-                        else:
-                            Door(**door, game=game, player=player, world=world_obj)
-                    for character in world['characters']:
-                        character_class = globals()[character['type']]
-                        if 'func' in character:
-                            def closure(func):
-                                return lambda var=None: exec(func, {
-                                    'game': game,
-                                    'player': player,
-                                    'world': world_obj,
-                                    'news': news,
-                                    'var': var
-                                })
-                            character['func'] = closure(character['func']) or True
-                        character['news'] = news
-                        character_obj = character_class(**character, game=game, player=player, world=world_obj)
-                        character_obj.go(Room.get(character['current_room'], world=world_obj))
-                        try:
-                            if character_class == AICharacter and character['news'] == True:
-                                news.subscribe(character_obj)
-                        except:
-                            pass
-                    for help in world['help']:
-                        text = world['help'][help]
-                        if game:
-                            setattr(game, f"help_{help}", lambda text=text: output(text))
-                except yaml.YAMLError as exc:
-                    output(exc)
+            try:
+                world = world_cache.load(filename)
+                world_obj.digest = world.digest
+                populate(world)
+                if world.get('regions'):
+                    world_obj.regions = RegionLoader(filename, world, populate, world_obj, player=player, news=news)
+                for help in world['help']:
+                    text = world['help'][help]
+                    if game:
+                        setattr(game, f"help_{help}", lambda text=text: output(text))
+            except yaml.YAMLError as exc:
+                output(exc)
         else:
             output("No world file found.")
         return world_obj
@@ -131,6 +185,78 @@ class Adventure(cmd2.Cmd):
         self.world = World(game=game, player=player)
         game.cmdloop()
 
+    def do_save(self, arg=None):
+        """Save the game to a file"""
+        filename = str(arg or "").strip() or SAVE_FILE
+        try:
+            data = snapshot.save(self)
+            with open(filename, 'wb') as stream:
+                stream.write(data)
+        except (snapshot.SnapshotException, OSError) as exc:
+            self.output(f"Couldn't save the game: {exc}")
+            return
+        self.output(f"Game saved to {filename}")
+
+    def do_load(self, arg=None):
+        """Load a saved game from a file"""
+        filename = str(arg or "").strip() or SAVE_FILE
+        try:
+            with open(filename, 'rb') as stream:
+                data = stream.read()
+            delta = snapshot.read(self, data)
+            # Loading starts from a fresh game, so keep this one to go back to
+            current = snapshot.save(self)
+        except (snapshot.SnapshotException, OSError) as exc:
+            self.output(f"Couldn't load the game: {exc}")
+            return
+        self.new_game()
+        try:
+            snapshot.restore(self, delta)
+        except snapshot.SnapshotException as exc:
+            self.new_game()
+            snapshot.load(self, current)
+            self.output(f"Couldn't load the game: {exc}")
+            return
+        self.output(f"Game loaded from {filename}")
+        self.current_room_intro()
+
+    def do_travel(self, arg=None):
+        """Travel to a room by the shortest open route"""
+        self.travel(str(arg or "").strip().strip('"').strip("'").lower())
+
+    def complete_travel(self, text, line, begidx, endidx):
+        partial = line.partition(" ")[2].strip('"').strip("'").lower()
+        graph = self.get_graph()
+        graph.refresh()
+        return [room.name for room in graph.rooms if room.name.startswith(partial) and room.name != partial]
+
+    def get_graph(self):
+        if self.graph is None or self.graph.world is not self.world:
+            self.graph = RoomGraph(self.world)
+        return self.graph
+
+    def travel(self, room_name):
+        """
+        Move the player to the named room in one go, along the shortest route through open doors.
+        Characters watching the player react at every step, but the room is only described on arrival.
+        Returns the rooms passed through, or None if there is no way there.
+        """
+        try:
+            destination = Room.get(room_name, world=self.world)
+        except NoEntityLinkException:
+            self.output(f"There's no such place: {room_name}")
+            return None
+        path = self.get_graph().path(self.player.current_room, destination)
+        if path is None:
+            self.output(f"You can't get to {room_name} from here.")
+            return None
+        for room in path:
+            self.player.go(room, check_link=False)
+            for watcher in self.player.watchers.values():
+                watcher.loopit()
+        self.current_room_intro()
+        return path
+
     def postloop(self):
         return True
 
@@ -202,7 +328,7 @@ class Adventure(cmd2.Cmd):
         return completions
 
     def get_all_commands(self):
-        return list(self.player.current_room.get_actions().keys()) + ['exit', 'help', 'reset']
+        return list(self.player.current_room.get_actions().keys()) + ['exit', 'help', 'load', 'reset', 'save', 'travel']
 
     def default(self, line):
         command = shlex.split(line.raw)
@@ -258,4 +384,6 @@ class Adventure(cmd2.Cmd):
 
 if __name__ == '__main__':
     game = Adventure()
+    if os.getenv("OPENAI_API_KEY"):
+        threading.Thread(target=provision_assistants, args=(game.world,), name="provision", daemon=True).start()
     game.cmdloop()
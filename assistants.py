@@ -0,0 +1,121 @@
+"""
+OpenAI assistants by name, resolved in bulk and remembered on disk.
+
+AssistantRegistry keeps name -> assistant ID in a JSON file shared by every process on a host,
+each entry good for `ttl` seconds, so workers and CLI starts don't list the account's assistants
+again. provision() resolves all the assistants a world needs in one pass: whatever isn't
+registered is looked up in one paginated listing, and the ones that don't exist yet are created
+in parallel, at most `workers` at a time. The registry is held, across threads and processes,
+from the lookup to the update, so no two callers create the same assistant.
+"""
+from __future__ import annotations
+import json, os, sys, threading, time
+from concurrent import futures
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+ASSISTANT_REGISTRY = os.getenv("ASSISTANT_REGISTRY", os.path.join(os.path.expanduser("~"), ".cache", "adventure", "assistants.json"))
+ASSISTANT_TTL = float(os.getenv("ASSISTANT_TTL", 86400))
+PROVISION_WORKERS = int(os.getenv("PROVISION_WORKERS", 8))
+
+class AssistantRegistry:
+    """Assistant IDs by name, on disk"""
+    def __init__(self, path=ASSISTANT_REGISTRY, ttl=ASSISTANT_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.lock_file = None
+        self.depth = 0  # Holds of the registry by the thread that has it, see hold()
+
+    def read(self):
+        """Name -> [ID, time registered], for every entry on disk"""
+        try:
+            with open(self.path) as stream:
+                entries = json.load(stream)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def lookup(self, names):
+        """Name -> ID, for the given names with a registered ID that hasn't expired"""
+        deadline = self.clock() - self.ttl
+        entries = self.read()
+        return {name: entries[name][0] for name in names if name in entries and entries[name][1] > deadline}
+
+    @contextmanager
+    def hold(self):
+        """Hold the registry against other threads and processes. The holder can take it again"""
+        with self.lock:
+            if self.depth == 0:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self.lock_file = open(f"{self.path}.lock", "a")
+                if fcntl is not None:
+                    fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            self.depth += 1
+            try:
+                yield
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    # Closing the file releases the flock
+                    self.lock_file.close()
+                    self.lock_file = None
+
+    def update(self, ids):
+        """Register name -> ID, keeping what other processes registered meanwhile"""
+        if not ids:
+            return
+        with self.hold():
+            now = self.clock()
+            deadline = now - self.ttl
+            entries = {name: entry for name, entry in self.read().items() if entry[1] > deadline}
+            entries.update({name: [assistant_id, now] for name, assistant_id in ids.items()})
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "w") as stream:
+                json.dump(entries, stream)
+            os.replace(temporary, self.path)
+
+def provision(client, specs, registry, model="gpt-4o-mini", workers=PROVISION_WORKERS):
+    """
+    Resolve the assistants in specs (name -> instructions), creating the missing ones, and
+    return name -> ID. client is an openai.OpenAI.
+    """
+    ids = registry.lookup(specs)
+    if len(ids) == len(specs):
+        return ids
+    with registry.hold():
+        # Another thread or process may have created them while this one waited
+        ids = registry.lookup(specs)
+        missing = [name for name in specs if name not in ids]
+        if missing:
+            ids.update(create_missing(client, specs, missing, registry, model, workers))
+    return ids
+
+def create_missing(client, specs, missing, registry, model, workers):
+    """Find or create the missing assistants, register them and return name -> ID. The registry is held"""
+    found = {}
+    # Iterating the page fetches the pages after it as needed
+    for assistant in client.beta.assistants.list(limit=100):
+        if assistant.name in missing and assistant.name not in found:
+            found[assistant.name] = assistant.id
+    missing = [name for name in missing if name not in found]
+
+    if missing:
+        def create(name):
+            return client.beta.assistants.create(name=name, model=model, instructions=specs[name]).id
+        with futures.ThreadPoolExecutor(max_workers=max(min(workers, len(missing)), 1), thread_name_prefix="provision") as executor:
+            created = {name: executor.submit(create, name) for name in missing}
+        for name, future in created.items():
+            try:
+                found[name] = future.result()
+            except Exception as exc:
+                sys.stderr.write(f"Couldn't create assistant {name}: {exc}\n")
+
+    registry.update(found)
+    return found
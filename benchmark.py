@@ -0,0 +1,387 @@
+"""
+Micro-benchmarks for the adventure engine.
+
+Run them all with `python benchmark.py`, or pick some by name:
+`python benchmark.py purge`.
+"""
+import os, sys, time
+from entities import Entity, World, Room
+
+def timed(func, repeat=1):
+    """Return the mean wall time of func() in seconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def bench_purge(sizes=(1_000, 10_000, 100_000), purges=500):
+    """Purge cost as the world grows: it should stay flat"""
+    print("purge: entities in world -> mean purge time")
+    for size in sizes:
+        world = World(warn=False)
+        rooms = [Entity(f"room {i}", world=world, warn=False) for i in range(size // 10)]
+        items = []
+        for i in range(size - len(rooms)):
+            item = Entity(f"item {i}", world=world, warn=False)
+            rooms[i % len(rooms)].link(item)
+            items.append(item)
+
+        victims = iter(items)
+        elapsed = timed(lambda: world.purge(next(victims).name), repeat=purges)
+        print(f"  {size:>8,} {elapsed * 1e6:8.2f} us")
+
+def bench_scripts(calls=100_000):
+    """Per-call cost of a world-file condition and func: re-parsed every call vs precompiled"""
+    from adventure import compile_script
+    condition = "hasattr(player, 'mushroom_insight') or hasattr(player, 'potion_insight')"
+    func = "setattr(player, 'mushroom_insight', True)"
+    player = Entity("player", world=World(warn=False), warn=False)
+
+    print("scripts: per-call cost, source -> compiled")
+    for source, mode in [(condition, 'eval'), (func, 'exec')]:
+        run = exec if mode == 'exec' else eval
+        before = timed(lambda: run(source, {'player': player, 'var': None}), repeat=calls)
+
+        code = compile_script(source, mode=mode)
+        namespace = {'player': player}
+        def call(var=None):
+            namespace['var'] = var
+            return run(code, namespace)
+        after = timed(call, repeat=calls)
+        print(f"  {mode:>5} {before * 1e6:8.2f} us -> {after * 1e6:6.2f} us")
+
+def offline_ai(latency=0.0):
+    """Keep AICharacter from calling OpenAI, so only local work is measured, plus latency seconds per call"""
+    import characters
+    class OfflineClient(characters.OpenAIClient):
+        @staticmethod
+        def connect(api_key=None):
+            pass
+
+        @staticmethod
+        def get_or_create_assistant(name, instructions, model=None):
+            time.sleep(latency)
+            return None
+
+        @staticmethod
+        def create_thread():
+            time.sleep(latency)
+            return "offline"
+    characters.OpenAIClient = OfflineClient
+
+def bench_world_load(file="world.yaml", repeat=20):
+    """Building a session's world from the bundled file: parsing every time vs the compiled world cache"""
+    import tempfile, yaml, world_cache
+    from adventure import Adventure
+    offline_ai()
+    world_cache.CACHE_DIR = tempfile.mkdtemp()
+    game = Adventure(file=file, output=lambda *args, **kwargs: None)
+    load = lambda: Adventure.load_world(file, game=game, player=game.player, news=game.news)
+    loader = world_cache.SafeLoader
+
+    def parsed(with_loader):
+        def func():
+            world_cache.SafeLoader = with_loader
+            world_cache.templates.clear()
+            for name in os.listdir(world_cache.CACHE_DIR):
+                os.unlink(os.path.join(world_cache.CACHE_DIR, name))
+            load()
+        return func
+
+    def from_disk():
+        world_cache.templates.clear()
+        load()
+
+    print(f"world load: Adventure.load_world({file!r})")
+    for label, func in [("pure-Python YAML", parsed(yaml.SafeLoader)), ("libyaml", parsed(loader)),
+                        ("disk cache", from_disk), ("memory cache", load)]:
+        print(f"  {label:>16} {timed(func, repeat=repeat) * 1e3:8.2f} ms")
+    world_cache.SafeLoader = loader
+    print(f"  {'new Adventure':>16} {timed(lambda: Adventure(file=file, output=game.output), repeat=repeat) * 1e3:8.2f} ms")
+
+def bench_session_memory(file="world.yaml", sessions=20):
+    """Memory held by each idle game: a full Adventure per session vs spawning from a template"""
+    import gc, tracemalloc
+    from adventure import Adventure
+    offline_ai()
+    quiet = lambda *args, **kwargs: None
+    template = Adventure(file=file, output=quiet)
+
+    print(f"session memory: {sessions} idle games on {file!r}")
+    for label, build in [("Adventure()", lambda: Adventure(file=file, output=quiet)), ("spawn()", lambda: template.spawn(output=quiet))]:
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        games = [build() for _ in range(sessions)]
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+        print(f"  {label:>12} {size / sessions / 1024:8.1f} KiB per session")
+        del games
+
+def write_region_world(directory, rooms, per_region=100):
+    """Write a world of rooms in a line, split into regions of per_region rooms, and return its path"""
+    import yaml
+    count = rooms // per_region
+    os.makedirs(os.path.join(directory, "regions"), exist_ok=True)
+    total = count * per_region
+    for r in range(count):
+        numbers = range(r * per_region, (r + 1) * per_region)
+        spec = {
+            'neighbors': [f"region {n}" for n in (r - 1, r + 1) if 0 <= n < count],
+            # Each room lists the rooms on both sides, as world.yaml does, whichever region they are in
+            'rooms': [{'name': f"room {n}", 'description': f"Room room {n}", 'links': [f"room {m}" for m in (n - 1, n + 1) if 0 <= m < total],
+                       'items': [{'name': f"stone room {n}", 'type': 'Item', 'description': "A stone", 'takeable': True}]}
+                      for n in numbers],
+        }
+        with open(os.path.join(directory, "regions", f"{r}.yaml"), "w") as file:
+            yaml.dump(spec, file, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper), width=1000)
+    path = os.path.join(directory, "world.yaml")
+    with open(path, "w") as file:
+        yaml.safe_dump({'regions': {f"region {r}": f"regions/{r}.yaml" for r in range(count)}, 'start_region': "region 0"}, file)
+    return path
+
+def bench_regions(sizes=(1_000, 10_000, 100_000), repeat=5):
+    """Starting a game on a world streamed in by region: it should stay flat as the world grows"""
+    import gc, tempfile, world_cache
+    from adventure import Adventure
+    world_cache.CACHE_DIR = tempfile.mkdtemp()
+    quiet = lambda *args, **kwargs: None
+
+    print("regions: rooms in world -> new game, rooms built, walking 500 rooms")
+    for size in sizes:
+        file = write_region_world(tempfile.mkdtemp(), size)
+        game = Adventure(file=file, output=quiet)  # Warms the world cache
+        gc.collect()
+        start = timed(game.new_game, repeat=repeat)
+        built = len(game.world.by_type[Room])
+        walk = lambda: [Room.get(f"room {i}", world=game.world).go() for i in range(1, 501)]
+        print(f"  {size:>8,} {start * 1e3:8.2f} ms {built:>6} {timed(walk) * 1e3:8.2f} ms")
+
+def bench_snapshot(file="world.yaml", repeat=1_000):
+    """Saving and restoring a played game on the bundled world"""
+    import snapshot
+    from adventure import Adventure
+    offline_ai()
+    quiet = lambda *args, **kwargs: None
+    game = Adventure(file=file, output=quiet)
+    for item in list(game.player.current_room.get_items(takeable_only=True).values())[:3]:
+        item.take(look=False)
+    game.player.take_damage(1)
+    data = snapshot.save(game)
+
+    games = iter([game.spawn(output=quiet) for _ in range(repeat)])
+    print(f"snapshot: {file!r}, {len(data)} bytes")
+    print(f"  {'save':>8} {timed(lambda: snapshot.save(game), repeat=repeat) * 1e6:8.2f} us")
+    print(f"  {'load':>8} {timed(lambda: snapshot.load(next(games), data), repeat=repeat) * 1e6:8.2f} us")
+
+def bench_journal(file="world.yaml", moves=5_000):
+    """Cost of journaling on the request path, and how long the writer takes to catch up"""
+    import tempfile
+    from adventure import Adventure
+    from journal import Journal
+    offline_ai()
+    quiet = lambda *args, **kwargs: None
+    template = Adventure(file=file, output=quiet)
+
+    print(f"journal: {moves} moves back and forth")
+    for label in ("off", "on"):
+        game = template.spawn(output=quiet)
+        journal = Journal(tempfile.mkdtemp())
+        if label == "on":
+            journal.attach("bench", game)
+        rooms = [game.player.current_room, next(iter(game.player.current_room.get_rooms().values()))]
+        steps = iter(range(moves))
+        elapsed = timed(lambda: game.player.go(rooms[next(steps) % 2], check_link=False), repeat=moves)
+        start = time.perf_counter()
+        journal.flush()
+        print(f"  {label:>4} {elapsed * 1e6:8.2f} us per move, writer done {(time.perf_counter() - start) * 1e3:6.1f} ms later")
+
+def bench_pool(file="world.yaml", sessions=20, latency=0.02):
+    """Time to hand a new session its game: built on the spot vs taken from a warm pool"""
+    from adventure import Adventure
+    from pool import GamePool
+    offline_ai(latency)
+    quiet = lambda *args, **kwargs: None
+    template = Adventure(file=file, output=quiet)
+    pool = GamePool(lambda: template.spawn(output=quiet), size=sessions, workers=4)
+    pool.fill()
+    pool.wait()
+
+    print(f"pool: new session on {file!r}, {latency * 1e3:.0f} ms per OpenAI call")
+    print(f"  {'spawn()':>10} {timed(lambda: template.spawn(output=quiet), repeat=3) * 1e3:10.3f} ms")
+    print(f"  {'pool':>10} {timed(pool.take, repeat=sessions) * 1e3:10.3f} ms")
+
+def bench_state(file="world.yaml", repeat=10_000):
+    """Serving /state for an unchanged game: rebuilt every time vs versioned, and the bytes sent after a change"""
+    import json
+    from adventure import Adventure
+    from gamestate import GameState
+    os.environ.setdefault("POOL_SIZE", "0")
+    import server
+    offline_ai()
+    game = Adventure(file=file, output=lambda *args, **kwargs: None)
+    state = GameState(game, server.build_state)
+    version, full = state.current()
+    game.player.take_damage(1)
+    _, changed = state.since(version)
+
+    print(f"state: /state on {file!r}")
+    print(f"  {'rebuilt':>10} {timed(lambda: server.build_state(game), repeat) * 1e6:10.1f} us")
+    print(f"  {'versioned':>10} {timed(state.current, repeat) * 1e6:10.1f} us")
+    print(f"  {'full':>10} {len(json.dumps(full)):10d} bytes")
+    print(f"  {'since':>10} {len(json.dumps(changed)):10d} bytes")
+
+def bench_provision(assistants=20, latency=0.05):
+    """Resolving a world's assistants: created one at a time vs one parallel pass, then from the registry"""
+    import tempfile
+    from types import SimpleNamespace
+    from assistants import AssistantRegistry, provision
+
+    def create(name, model, instructions):
+        time.sleep(latency)
+        return SimpleNamespace(name=name, id=f"id_{name}")
+    def listing(limit=20):
+        time.sleep(latency)
+        return iter(())
+    client = SimpleNamespace(beta=SimpleNamespace(assistants=SimpleNamespace(list=listing, create=create)))
+    specs = {f"assistant_{i}": "" for i in range(assistants)}
+    registry = AssistantRegistry(os.path.join(tempfile.mkdtemp(), "assistants.json"))
+
+    print(f"provision: {assistants} assistants, {latency * 1e3:.0f} ms per OpenAI call")
+    print(f"  {'serial':>10} {timed(lambda: [create(name, None, '') for name in specs]) * 1e3:10.1f} ms")
+    print(f"  {'parallel':>10} {timed(lambda: provision(client, specs, registry)) * 1e3:10.1f} ms")
+    print(f"  {'registry':>10} {timed(lambda: provision(client, specs, registry)) * 1e3:10.1f} ms")
+
+def bench_threads(talks=20, latency=0.05):
+    """Getting a conversation thread for a first talk: created on the spot vs taken from a warm pool"""
+    from conversations import ConversationPool
+
+    def create():
+        time.sleep(latency)
+        return "thread"
+    cold = ConversationPool(create, lambda thread_id: None, size=0)
+    warm = ConversationPool(create, lambda thread_id: None, size=talks)
+    warm.fill()
+    warm.wait()
+
+    print(f"threads: {talks} first talks, {latency * 1e3:.0f} ms per OpenAI call")
+    print(f"  {'on the spot':>12} {timed(cold.take, talks) * 1e3:10.3f} ms per talk")
+    print(f"  {'pool':>12} {timed(warm.take, talks) * 1e3:10.3f} ms per talk")
+
+def bench_context(additions=1_000):
+    """Prompt additions resent with every run: appended forever vs kept within a budget"""
+    from context import PromptContext
+    entries = [f"NEWS BULLETIN: Bulletin {i % 20}" if i % 2 else f"You just got hit by the player, and you took 1 damage. Your health is now {i % 100}%." for i in range(additions)]
+    unbounded = ""
+    for entry in entries:
+        unbounded += f"\n{entry}"
+    context = PromptContext()
+    bounded = ""
+    start = time.perf_counter()
+    for entry in entries:
+        bounded = context.add(bounded, entry)[0]
+    seconds = time.perf_counter() - start
+    print(f"context: {additions} prompt additions -> characters resent with every run")
+    print(f"  {'unbounded':>10} {len(unbounded):10}")
+    print(f"  {'bounded':>10} {len(bounded):10}  ({seconds / additions * 1e6:.1f} us per addition)")
+
+def bench_news(subscribers=5, bulletins=10, latency=0.05):
+    """Publishing bulletins to AI characters that each take an OpenAI call to notify: in publish vs in the background"""
+    from types import SimpleNamespace
+    from news import News
+
+    calls = []
+    def notify_news(bulletin):
+        time.sleep(latency)
+        calls.append(bulletin)
+    print(f"news: {bulletins} bulletins, {subscribers} subscribers, {latency * 1e3:.0f} ms per notification")
+    for background in (False, True):
+        news = News(background=background)
+        for i in range(subscribers):
+            news.subscribe(SimpleNamespace(name=f"subscriber_{i}", notify_news=notify_news))
+        calls.clear()
+        publish = timed(lambda: news.publish("Spider just got hit"), bulletins)
+        delivered = timed(news.flush)
+        label = "background" if background else "inline"
+        print(f"  {label:>10} {publish * 1e3:10.3f} ms per publish, {len(calls):3} notifications, {delivered * 1e3:8.1f} ms more to deliver")
+
+def walk_requests(port, seconds, counts, index):
+    """Play one session against a server for some seconds: look at the state, move on, repeat"""
+    import http.client, json, random
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "application/json"}
+    done = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        connection.request("GET", "/state", headers=headers)
+        response = connection.getresponse()
+        state = json.loads(response.read())
+        cookie = response.getheader("Set-Cookie")
+        if cookie:
+            headers["Cookie"] = cookie.split(";")[0]
+        room = random.choice(list(state["adjacent_rooms"]))
+        connection.request("POST", "/move", body=json.dumps({"room": room}), headers=headers)
+        connection.getresponse().read()
+        done += 2
+    counts[index] = done
+
+def bench_workers(file="world.yaml", workers=(1, 2, 4), clients=8, seconds=5):
+    """Requests per second through gunicorn, with sessions in a shared SQLite store, as workers are added"""
+    import multiprocessing, socket, subprocess, tempfile
+    directory = tempfile.mkdtemp()
+    config = os.path.join(directory, "gunicorn.conf.py")
+    with open(config, "w") as stream:
+        stream.write("def post_fork(server, worker):\n    import benchmark\n    benchmark.offline_ai()\n")
+
+    print(f"workers: {clients} clients walking around {file!r} for {seconds} s, {os.cpu_count()} cores")
+    for kind, count in [("memory", 1)] + [("sqlite", count) for count in workers]:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        env = dict(os.environ, WORLD_FILE=file, SESSION_STORE=kind, SESSION_DB=os.path.join(directory, f"sessions-{count}.db"),
+                   JOURNAL_DIR="", POOL_SIZE="2")
+        server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", config, "--worker-class", "gevent", "-w", str(count),
+                                   "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "server:app"], env=env)
+        try:
+            # Wait until every worker has loaded the world and answers
+            import urllib.request
+            for _ in range(600):
+                try:
+                    for _ in range(count * 4):
+                        urllib.request.urlopen(f"http://127.0.0.1:{port}/state", timeout=30).read()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            counts = multiprocessing.Array("i", clients)
+            processes = [multiprocessing.Process(target=walk_requests, args=(port, seconds, counts, index)) for index in range(clients)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            print(f"  {kind:>6} {count:>2} workers {sum(counts) / seconds:10.0f} requests/s")
+        finally:
+            server.terminate()
+            server.wait()
+
+BENCHMARKS = {
+    "purge": bench_purge,
+    "scripts": bench_scripts,
+    "world_load": bench_world_load,
+    "session_memory": bench_session_memory,
+    "regions": bench_regions,
+    "snapshot": bench_snapshot,
+    "journal": bench_journal,
+    "pool": bench_pool,
+    "state": bench_state,
+    "workers": bench_workers,
+    "provision": bench_provision,
+    "threads": bench_threads,
+    "context": bench_context,
+    "news": bench_news,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
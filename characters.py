@@ -1,18 +1,56 @@
 from __future__ import annotations
-import random, re, os, time
+import random, re, os, sys, threading, time
 import openai
+import assistants
+import conversations
+from context import PromptContext, PROMPT_BUDGET, THREAD_MESSAGES
 from entities import Room, Item, Entity, EntityLinkException
 from news import News
 
+class Inventory(dict):
+    """
+    A character's items by name. Like an Entity, it keeps a generation counter and registers
+    itself in each item's linked_from, so item changes and purges reach it.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.generation = 0
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, name, item):
+        if name in self and self[name] is not item:
+            self[name].linked_from.pop(id(self), None)
+        super().__setitem__(name, item)
+        item.linked_from[id(self)] = self
+        self.generation += 1
+
+    def __delitem__(self, name):
+        self.pop(name)
+
+    def pop(self, name, *default):
+        if name not in self and default:
+            return default[0]
+        item = super().pop(name)
+        item.linked_from.pop(id(self), None)
+        self.generation += 1
+        return item
+
+    def update(self, *args, **kwargs):
+        for name, item in dict(*args, **kwargs).items():
+            self[name] = item
+
+    def clear(self):
+        for name in list(self):
+            self.pop(name)
+
 class Character(Item):
     def __init__(self, name="player", description="The main player", health=1, attack_strength=None, damage_msg="Ouch!", attack_msg="Have at you!", current_room=None, lookable=True, news=None, game=None, player=None, world=None, warn=True, **kwargs):
         Item.__init__(self, name=name, description=description, droppable=False, takeable=False, lookable=lookable, game=game, player=player, world=world, warn=warn)
 
         self.current_room = None
         self.max_items = 5
-        self.inv_items = {}
+        self.inv_items = Inventory()
         self.money = float(0)
-        self.inv_items = {}
         self.wearing = {}
         self.words = ""
         self.watchers = {}
@@ -44,6 +82,8 @@ class Character(Item):
     def spend(self, amount):
         if self.money >= amount:
             self.money = self.money - amount
+            self.touch()
+            self.record('spend', self)
             self.game.output(f'${'{:.2f}'.format(amount)} spent.')
 #FIXME            self.do_inv()
             return amount
@@ -61,6 +101,10 @@ class Character(Item):
                 self.current_room.pop(self.name)
             self.current_room = room
             self.current_room.add_item(self)
+            self.record('go', self)
+            regions = getattr(room.world, 'regions', None)
+            if regions is not None:
+                regions.entered(room, self)
         else:
             self.game.output("WALKER", self.name, "GO", room.name, "DIDN'T WORK")
 
@@ -76,6 +120,8 @@ class Character(Item):
         elif attacker == None:
             attacker = "player"
         self.health -= damage
+        self.touch()
+        self.record('damage', self)
         self.game.output(self.damage_msg)
         self.game.output(f"{self.name.title()} took {damage} damage. Health: {self.health} ({self.health / self.first_health * 100:.2f}%)")
         if self.news != None:
@@ -140,7 +186,10 @@ class WalkerCharacter(NonPlayerCharacter):
 
 class OpenAIClient():
     client = None
-    assistants_cache = {}
+    assistants_cache = {}  # Assistant name -> ID
+    registry = None  # Shared AssistantRegistry, see assistants.py
+    threads = None  # Conversation threads made ahead of time, see conversations.py
+    setup_lock = threading.Lock()  # Guards making the shared registry and pool
 
     @staticmethod
     def connect(api_key=os.getenv("OPENAI_API_KEY")):
@@ -149,31 +198,50 @@ class OpenAIClient():
 
     @staticmethod
     def get_or_create_assistant(name, instructions, model="gpt-4o-mini"):
-        OpenAIClient.connect()
+        """The ID of the assistant with this name, created if there isn't one"""
+        return OpenAIClient.provision_assistants({name: instructions}, model)[name]
 
-        if name in OpenAIClient.assistants_cache:
-            return OpenAIClient.assistants_cache[name]
+    @staticmethod
+    def provision_assistants(specs, model="gpt-4o-mini"):
+        """Resolve the assistants in specs (name -> instructions) in one pass, creating the missing ones, and return name -> ID"""
+        missing = {name: instructions for name, instructions in specs.items() if name not in OpenAIClient.assistants_cache}
+        if missing:
+            OpenAIClient.connect()
+            with OpenAIClient.setup_lock:
+                if OpenAIClient.registry is None:
+                    OpenAIClient.registry = assistants.AssistantRegistry()
+            OpenAIClient.assistants_cache.update(assistants.provision(OpenAIClient.client, missing, OpenAIClient.registry, model))
+        return {name: OpenAIClient.assistants_cache.get(name) for name in specs}
 
-        if not OpenAIClient.assistants_cache:
-            assistants = OpenAIClient.client.beta.assistants.list().data
-            OpenAIClient.assistants_cache = {a.name: a for a in assistants}
+    @staticmethod
+    def thread_pool():
+        """The process's ConversationPool, made on first use"""
+        if OpenAIClient.threads is None:
+            with OpenAIClient.setup_lock:
+                if OpenAIClient.threads is None:
+                    OpenAIClient.threads = conversations.ConversationPool(OpenAIClient.new_thread, OpenAIClient.delete_thread)
+        return OpenAIClient.threads
 
-        assistant = OpenAIClient.assistants_cache.get(name)
-        if assistant is None:
-            assistant = OpenAIClient.client.beta.assistants.create(
-                name=name,
-                model=model,
-                instructions=instructions,
-            )
-            OpenAIClient.assistants_cache[name] = assistant
+    @staticmethod
+    def create_thread():
+        """A thread for a new conversation, from the pool"""
+        return OpenAIClient.thread_pool().take()
 
-        return assistant
+    @staticmethod
+    def release_threads(thread_ids):
+        """Hand back the threads of conversations that are over, to be deleted"""
+        OpenAIClient.thread_pool().release(thread_ids)
 
     @staticmethod
-    def create_thread():
+    def new_thread():
         OpenAIClient.connect()
         return OpenAIClient.client.beta.threads.create().id
 
+    @staticmethod
+    def delete_thread(thread_id):
+        OpenAIClient.connect()
+        OpenAIClient.client.beta.threads.delete(thread_id)
+
     @staticmethod
     def add_message(thread_id, content, role="user"):
         OpenAIClient.connect()
@@ -186,13 +254,13 @@ class OpenAIClient():
     def stream_assistant_response(thread_id, assistant_name, additional_instructions=""):
         OpenAIClient.connect()
 
-        assistant = OpenAIClient.assistants_cache[assistant_name]
+        assistant_id = OpenAIClient.assistants_cache[assistant_name]
         retries = 5
         while True:
             try:
                 run_stream = OpenAIClient.client.beta.threads.runs.create(
                     thread_id=thread_id,
-                    assistant_id=assistant.id,
+                    assistant_id=assistant_id,
                     additional_instructions=additional_instructions,
                     stream=True
                 )
@@ -259,23 +327,113 @@ class AICharacter(Character):
                  prompt="You are a less-than helpful, yet amusing, assistant.",
                  phone_prompt=("The user is calling you on the phone, and you answer in an amusing way. "
                                "Don't worry about sounds or actions, just generate the words."),
-                 func=lambda json: print(f"Character returned: {json}"), news=None, game=None, player=None, world=None, **kwargs):
+                 func=lambda json: print(f"Character returned: {json}"), prompt_budget=PROMPT_BUDGET, thread_messages=THREAD_MESSAGES,
+                 news=None, game=None, player=None, world=None, **kwargs):
         super().__init__(name=name, description=description, health=health, attack_strength=attack_strength, current_room=current_room, news=news, game=game, player=player, world=world, **kwargs)
         self.phoneable = phone_prompt is not None
         self.func = func
         self.add_action("talk", self.talk)
+        # Prompt additions, resent with every run, and a recap of the conversation for a new thread, both bounded (see context.py)
+        self.context = PromptContext(prompt_budget)
+        self.recaps = PromptContext(prompt_budget // 2, window=4)
         self.additional_instructions = ""
-
-        OpenAIClient.connect()
+        self.recap = ""
+        self.thread_messages = thread_messages  # Messages in a thread before it is replaced
+        self.prompt = prompt
+        self.phone_prompt = phone_prompt
         self.assistant_name = name
         self.phone_assistant_name = f"{name}_phone"
 
-        OpenAIClient.get_or_create_assistant(name, prompt)
-        self.thread_id = OpenAIClient.create_thread()
-
+        # Assistants and threads are set up on first use (see provision), so loading a world makes no OpenAI calls
+        self.thread = None
+        self.phone_thread = None
+        self.thread_length = 0
+        self.phone_thread_length = 0
+        # Prompt additions waiting to be sent before the next reply, one per line like
+        # additional_instructions, so they are saved with the character too
+        self.queued_prompts = ""
+        # News arrives on a background thread (see news.py), so prompt and thread changes are made under this lock
+        self.prompt_lock = threading.RLock()
+
+    def assistants(self):
+        """The assistants this character talks through, name -> instructions"""
+        specs = {self.assistant_name: self.prompt}
         if self.phoneable:
-            OpenAIClient.get_or_create_assistant(self.phone_assistant_name, f"{prompt} {phone_prompt}")
-            self.phone_thread_id = OpenAIClient.create_thread()
+            specs[self.phone_assistant_name] = f"{self.prompt} {self.phone_prompt}"
+        return specs
+
+    @property
+    def thread_id(self):
+        return self.provision()
+
+    @property
+    def phone_thread_id(self):
+        return self.provision(phone=True) if self.phoneable else None
+
+    def provision(self, phone=False):
+        """
+        Resolve the assistant for talking (or phoning) and create its thread if there isn't one
+        yet, sending it the prompt additions queued meanwhile. A thread that reached
+        thread_messages is handed back for a new one, which starts with the recap. Returns the
+        thread ID.
+        """
+        OpenAIClient.connect()
+        if phone:
+            OpenAIClient.get_or_create_assistant(self.phone_assistant_name, f"{self.prompt} {self.phone_prompt}")
+        else:
+            OpenAIClient.get_or_create_assistant(self.assistant_name, self.prompt)
+        with self.prompt_lock:
+            if phone:
+                if self.phone_thread is not None and self.phone_thread_length >= self.thread_messages:
+                    OpenAIClient.release_threads([self.phone_thread])
+                    self.phone_thread = None
+                if self.phone_thread is None:
+                    self.phone_thread = OpenAIClient.create_thread()
+                    self.phone_thread_length = self.start_thread(self.phone_thread)
+                    self.record('thread', self)
+                return self.phone_thread
+
+            if self.thread is not None and self.thread_length >= self.thread_messages:
+                OpenAIClient.release_threads([self.thread])
+                self.thread = None
+            if self.thread is None:
+                self.thread = OpenAIClient.create_thread()
+                self.thread_length = self.start_thread(self.thread)
+                self.record('thread', self)
+            return self.thread
+
+    def send_queued(self, thread_id):
+        """Send the thread the prompt additions queued for it"""
+        with self.prompt_lock:
+            queued, self.queued_prompts = self.queued_prompts, ""
+        sent = 0
+        for new_instructions in queued.split("\n") if queued else ():
+            try:
+                OpenAIClient.add_message(thread_id, new_instructions, role="assistant")
+                sent += 1
+            except Exception as e:
+                pass
+        with self.prompt_lock:
+            self.thread_length += sent
+
+    def start_thread(self, thread_id):
+        """Send a new thread the recap of the conversation so far, if there is one. Returns the messages sent"""
+        if not self.recap:
+            return 0
+        try:
+            OpenAIClient.add_message(thread_id, f"The conversation so far, in short:\n{self.recap}", role="assistant")
+            return 1
+        except Exception as e:
+            return 0
+
+    def release(self):
+        """Forget this character's threads, returning their IDs. A later talk starts new ones"""
+        threads = [thread for thread in (self.thread, self.phone_thread) if thread is not None]
+        self.thread = None
+        self.phone_thread = None
+        self.thread_length = 0
+        self.phone_thread_length = 0
+        return threads
 
     def take_damage(self, damage=1, attacker=None):
         super().take_damage(damage, attacker)
@@ -306,65 +464,124 @@ class AICharacter(Character):
             self.game.output("You can't call that character.")
             return
 
-        thread_id = self.phone_thread_id if phone and self.phoneable else self.thread_id
-        assistant_name = self.phone_assistant_name if phone and self.phoneable else self.assistant_name
-
         if msg != "":
             user_message = "phone rings" if phone else (msg or input("(input): "))
-            OpenAIClient.add_message(thread_id, user_message)
         else:
             user_message = ""
 
-        hangups = r"bye|\*hangs up\*|\*click\*"
-        full_message = ""
         bye = False
 
         self.game.output(f"{self.name.capitalize()}: ", end="", flush=True)
 
+        for kind, value in self.reply(user_message, phone=phone):
+            if kind == "text":
+                self.game.output(value, end="", flush=True)
+            elif kind == "error":
+                self.game.output("Error:", value)
+            elif kind == "end":
+                bye = value
+
+        self.game.output()
+
+        if not bye:
+            if once:
+                return True
+            else:
+                return self.talk(phone=phone)
+
+        if bye:
+            self.game.current_room_intro()
+            return True
+
+    def reply(self, user_message="", phone=False):
+        """
+        Send user_message (unless it's empty) and stream the answer as (kind, value) events, as
+        they arrive: ("text", chunk) for words, ("json", obj) for each fenced JSON object, after it
+        has been passed to func, and ("error", message). The last event is ("end", bye), where bye
+        tells whether the conversation is over.
+        """
+        phone = phone and self.phoneable
+        assistant_name = self.phone_assistant_name if phone else self.assistant_name
+
+        hangups = r"bye|\*hangs up\*|\*click\*"
+        full_message = ""
+        bye = False
+
         try:
+            thread_id = self.provision(phone=phone)
+            if not phone:
+                # What the character was told since its last reply, before there's a run on the thread
+                self.send_queued(thread_id)
+            # The message, if any, and the reply
+            with self.prompt_lock:
+                if phone:
+                    self.phone_thread_length += 2 if user_message else 1
+                else:
+                    self.thread_length += 2 if user_message else 1
+            if user_message:
+                OpenAIClient.add_message(thread_id, user_message)
             for chunk in OpenAIClient.stream_assistant_response(thread_id, assistant_name, additional_instructions=self.additional_instructions):
                 if isinstance(chunk, str):
-                    self.game.output(chunk, end="", flush=True)
                     full_message += chunk
+                    yield "text", chunk
                 elif isinstance(chunk, dict):
                     self.func(chunk)
                     bye = True
+                    yield "json", chunk
                 elif isinstance(chunk, list):
                     for obj in chunk:
                         self.func(obj)
+                        yield "json", obj
                     bye = True
+            exchange = " ".join(part for part in (user_message and f"They said: {user_message[:200]}", full_message and f"You said: {full_message[:200]}") if part)
+            self.recap, _ = self.recaps.add(self.recap, exchange)
+            self.record('reply', self)
         except Exception as e:
-            self.game.output("Error:", e)
+            yield "error", str(e)
             bye = True
 
-        self.game.output()
-
         if re.search(hangups, full_message.lower(), re.IGNORECASE) or re.search(hangups, user_message.lower(), re.IGNORECASE):
             bye = True
-        elif not bye:
-            if once:
-                return True
-            else:
-                return self.talk(phone=phone)
-
-        if bye:
-            self.game.current_room_intro()
-            return True
+        yield "end", bye
 
     def add_to_prompt(self, new_instructions: str):
         """
-        Insert a 'system' message into the existing thread,
-        effectively updating the context for subsequent calls.
+        Tell the character something, as an 'assistant' message in its thread.
+        The message is queued and sent before the character's next reply, so
+        hits, news and scripts never wait on OpenAI, nor interrupt a run.
+        Additions already among the recent ones are dropped, and the
+        older ones summarized, to keep within the prompt budget.
         """
-        if not hasattr(self, 'thread_id') or self.thread_id is None:
-            self.game.output("No active thread to update.")
-            return
-
-        self.additional_instructions += f"\n{new_instructions}"
+        with self.prompt_lock:
+            self.additional_instructions, added = self.context.add(self.additional_instructions, new_instructions)
+            if not added:
+                return
+            # The older ones are in the summary already
+            queued = self.queued_prompts.split("\n") if self.queued_prompts else []
+            self.queued_prompts = "\n".join((queued + [" ".join(new_instructions.split())])[-self.context.window:])
+            self.record('prompt', self)
+
+def provision_assistants(world):
+    """Resolve the assistants of every AI character in a world in one pass, so no first talk waits for it"""
+    specs = {}
+    for character in AICharacter.get_all(world=world).values():
+        specs.update(character.assistants())
+    if specs:
         try:
-            OpenAIClient.add_message(self.thread_id, new_instructions, role="assistant")
+            OpenAIClient.provision_assistants(specs)
         except Exception as e:
-            pass
+            sys.stderr.write(f"Couldn't provision assistants: {e}\n")
+
+def release_threads(game):
+    """Hand back the threads of every AI character in a game whose session ended"""
+    threads = []
+    for character in AICharacter.get_all(world=game.world).values():
+        threads += character.release()
+    if threads:
+        try:
+            OpenAIClient.release_threads(threads)
+        except Exception as e:
+            sys.stderr.write(f"Couldn't release conversation threads: {e}\n")
 
 def find_json_objects(text: str):
     """
@@ -0,0 +1,56 @@
+"""
+Bounded prompt context for AI characters.
+
+What an AI character is told along the way (news bulletins, hits, attacks, scripted states) is
+resent as additional instructions with every run, so left alone it grows with the session and
+every turn costs more. PromptContext keeps such text within a budget of characters, about four
+to a token: an entry already among the recent ones isn't added again, the latest `window`
+entries are kept as they are, and older ones are folded into a summary line that keeps the gist
+of each, losing the oldest once it outgrows a quarter of the budget. The text is one entry per
+line after the summary, so it is saved with the character like any other string attribute.
+"""
+from __future__ import annotations
+import os, re
+
+PROMPT_BUDGET = int(os.getenv("PROMPT_BUDGET", 2000))
+PROMPT_WINDOW = int(os.getenv("PROMPT_WINDOW", 8))
+# Messages in a conversation thread before the character moves on to a new one
+THREAD_MESSAGES = int(os.getenv("THREAD_MESSAGES", 100))
+
+SUMMARY = "Earlier: "
+SEPARATOR = " | "
+GIST = 80  # Characters kept of an entry folded into the summary
+
+class PromptContext:
+    def __init__(self, budget=PROMPT_BUDGET, window=PROMPT_WINDOW):
+        self.budget = budget
+        self.window = window
+
+    def split(self, text):
+        """The gists in the summary line and the entries after it"""
+        lines = text.split("\n") if text else []
+        summary = []
+        if lines and lines[0].startswith(SUMMARY):
+            summary = lines.pop(0)[len(SUMMARY):].split(SEPARATOR)
+        return summary, lines
+
+    def join(self, summary, entries):
+        return "\n".join(([SUMMARY + SEPARATOR.join(summary)] if summary else []) + entries)
+
+    def add(self, text, entry):
+        """Add an entry to the context in text, returning the new text and whether the entry is new"""
+        entry = " ".join(entry.split())[:self.budget]
+        summary, entries = self.split(text)
+        if not entry or entry in entries:
+            return text, False
+        entries.append(entry)
+        while len(entries) > 1 and (len(entries) > self.window or len(self.join(summary, entries)) > self.budget):
+            summary.append(gist(entries.pop(0)))
+        while summary and (len(SUMMARY + SEPARATOR.join(summary)) > self.budget // 4 or len(self.join(summary, entries)) > self.budget):
+            summary.pop(0)
+        return self.join(summary, entries), True
+
+def gist(entry):
+    """The first sentence of an entry, cut short if it is long"""
+    sentence = re.split(r"(?<=[.!?])\s", entry, maxsplit=1)[0]
+    return sentence if len(sentence) <= GIST else sentence[:GIST - 3] + "..."
@@ -0,0 +1,122 @@
+"""
+OpenAI conversation threads, created ahead of time and cleaned up after.
+
+Every AI character a player talks to needs a thread, and a phoneable one a second thread for
+calls. ConversationPool keeps `size` empty threads ready, created in the background by up to
+`workers` threads, so a first talk doesn't wait for one. Threads of sessions that end are
+handed back and deleted in the background, which makes room for fresh ones. A thread is never
+reused by another session, since it holds the conversation. At most `cap` threads are ready,
+being created or in use at once in a process; past that, taking one raises
+ConversationLimitException.
+"""
+from __future__ import annotations
+import os, sys, threading
+from collections import deque
+from concurrent import futures
+
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", 8))
+MAX_THREADS = int(os.getenv("MAX_THREADS", 2000))
+THREAD_WORKERS = int(os.getenv("THREAD_WORKERS", 4))
+
+class ConversationLimitException(Exception):
+    pass
+
+class ConversationPool:
+    def __init__(self, create, delete, size=THREAD_POOL_SIZE, cap=MAX_THREADS, workers=THREAD_WORKERS):
+        self.create = create  # () -> new thread ID
+        self.delete = delete  # thread ID -> None
+        self.size = size
+        self.cap = cap
+        self.ready = deque()
+        self.creating = 0
+        self.in_use = 0
+        self.futures = []
+        self.lock = threading.Condition(threading.Lock())  # Notified when a thread is created
+        self.executor = futures.ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="conversations")
+        self.hits = 0
+        self.misses = 0
+        self.deleted = 0
+
+    def live(self):
+        """Threads ready, being created or in use"""
+        return len(self.ready) + self.creating + self.in_use
+
+    def take(self):
+        """A ready thread if there is one, otherwise one created now; either way the pool is topped up"""
+        with self.lock:
+            # At the cap, a thread on its way is the only one to be had
+            self.lock.wait_for(lambda: self.ready or not self.creating or self.live() < self.cap)
+            if self.ready:
+                thread_id = self.ready.popleft()
+                self.hits += 1
+            elif self.live() >= self.cap:
+                raise ConversationLimitException(f"All {self.cap} conversations are in use, try again later")
+            else:
+                thread_id = None
+                self.misses += 1
+            self.in_use += 1
+        if thread_id is None:
+            try:
+                thread_id = self.create()
+            except BaseException:
+                with self.lock:
+                    self.in_use -= 1
+                raise
+        self.fill()
+        return thread_id
+
+    def release(self, thread_ids):
+        """Hand back the threads of a session that ended, to be deleted in the background"""
+        thread_ids = list(thread_ids)
+        if not thread_ids:
+            return
+        with self.lock:
+            # Threads of a session from before a restart were never counted here
+            self.in_use = max(self.in_use - len(thread_ids), 0)
+            self.futures.extend(self.executor.submit(self.remove, thread_id) for thread_id in thread_ids)
+        self.fill()
+
+    def fill(self):
+        """Start creating threads until the ready and the coming ones make up the pool size, within the cap"""
+        with self.lock:
+            self.futures = [future for future in self.futures if not future.done()]
+            for _ in range(min(self.size - len(self.ready) - self.creating, self.cap - self.live())):
+                self.creating += 1
+                self.futures.append(self.executor.submit(self.add))
+
+    def add(self):
+        thread_id = None
+        try:
+            thread_id = self.create()
+        except Exception as exc:
+            sys.stderr.write(f"Couldn't create a conversation thread for the pool: {exc}\n")
+        finally:
+            with self.lock:
+                if thread_id is not None:
+                    self.ready.append(thread_id)
+                self.creating -= 1
+                self.lock.notify_all()
+
+    def remove(self, thread_id):
+        try:
+            self.delete(thread_id)
+            with self.lock:
+                self.deleted += 1
+        except Exception as exc:
+            sys.stderr.write(f"Couldn't delete conversation thread {thread_id}: {exc}\n")
+
+    def close(self):
+        """Delete the threads still ready, when the process is done with them"""
+        with self.lock:
+            self.size = 0
+        self.wait()
+        with self.lock:
+            ready, self.ready = list(self.ready), deque()
+        for thread_id in ready:
+            self.remove(thread_id)
+
+    def wait(self, timeout=None):
+        """Wait until the threads being created or deleted are done"""
+        with self.lock:
+            pending = list(self.futures)
+        futures.wait(pending, timeout)
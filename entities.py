@@ -1,4 +1,5 @@
 from __future__ import annotations
+from collections import deque
 
 class EntityLinkException(Exception):
     "Thrown when there is already an Entity with this name"
@@ -11,7 +12,9 @@ class Entity:
         self.name = name
         self.description = description
         self.linked = {}
+        self.linked_from = {}  # id(entity) -> entity, for every entity linking to this one
         self.actions = {}
+        self.generation = 0  # Bumped whenever links or actions change, see touch()
         self.game = game
         self.player = player
         self.world = world
@@ -35,7 +38,12 @@ class Entity:
     
     def link(self, linked: Entity, override = False):
         if linked.name not in self.linked.keys() or override == True:
+            previous = self.linked.get(f"{linked.name}")
+            if previous is not None and previous is not linked:
+                previous.linked_from.pop(id(self), None)
             self.linked.update({ f"{linked.name}": linked })
+            linked.linked_from[id(self)] = self
+            self.touch()
         else:
             raise EntityLinkException
 
@@ -46,15 +54,31 @@ class Entity:
         if name in self.linked.keys():
             popped = self.linked[name]
             del self.linked[name]
+            popped.linked_from.pop(id(self), None)
+            self.touch()
             return popped
         else:
             raise NoEntityLinkException
 
     def add_action(self, name="doink", function = lambda: True):
         self.actions[name] = function
+        self.touch()
 
     def remove_action(self, name="doink"):
         del self.actions[name]
+        self.touch()
+
+    def record(self, event, *entities, removed=()):
+        """Append the new state of entities, and the names of removed ones, to the game's journal if it keeps one"""
+        journal = getattr(self.game, 'journal', None)
+        if journal is not None:
+            journal.record(event, entities, removed)
+
+    def touch(self):
+        """Bump the generation of this entity and of everything that links to it"""
+        self.generation += 1
+        for container in self.linked_from.values():
+            container.generation += 1
 
     def do(self, action):
         try:
@@ -64,21 +88,27 @@ class Entity:
         except Exception as e:
             self.game.output("Something went wrong during action:", action, e)
 
+    def walk(self, max_levels=-1, first_level=0, skip=()):
+        """Breadth-first walk of linked entities, yielding (name, entity, depth) once per name"""
+        if 0 <= max_levels <= first_level:
+            return
+        visited = set(skip)
+        queue = deque([(self, first_level)])
+        while queue:
+            entity, level = queue.popleft()
+            for name, linked in entity.linked.items():
+                if name in visited:
+                    continue
+                visited.add(name)
+                yield name, linked, level + 1
+                if level + 1 < max_levels or max_levels < 0:
+                    queue.append((linked, level + 1))
+
     def traverse(self, max_levels=-1, first_level=0, entities=None):
         if entities == None:
             entities = {}
-        for name in self.linked:
-            level = first_level
-            if (level < max_levels or max_levels < 0):
-                if name not in entities.keys():
-                    entities[name] = self.linked[name]                    
-                    level = level + 1
-                    if (level < max_levels or max_levels < 0):
-                        children = self.linked[name].traverse(max_levels, level, entities)
-                        for child in children:
-                            for key in children.keys():
-                                if not key in entities.keys():
-                                    entities[name] = child
+        for name, entity, level in self.walk(max_levels, first_level, skip=entities.keys()):
+            entities[name] = entity
         return entities
 
     def is_linked(self, name):
@@ -98,35 +128,60 @@ class Entity:
 
     @classmethod
     def get_all(cls, world):
-        return dict(filter(lambda pair : isinstance(pair[1], cls) or issubclass(pair[1].__class__, cls), world.linked.items()))
+        return dict(world.by_type.get(cls, {}))
 
     @classmethod
     def get(cls, name, world):
         try:
-            return cls.get_all(world)[name]
+            return world.by_type[cls][name]
         except KeyError:
             raise NoEntityLinkException
 
     def purge(self, name):
-        popped = 0
-        for entity in self.world.traverse():
-            try:
-                self.get(entity, world=self.world).pop(name)
-                popped = popped + 1
-            except NoEntityLinkException:
-                pass
+        """Unlink the named world entity from every entity that links to it"""
         try:
-            self.world.pop(name)
-            popped = popped + 1
-        except NoEntityLinkException:
-            pass
-
-        return popped > 0
+            entity = self.world.get_linked(name)
+        except KeyError:
+            return False
+        for container in list(entity.linked_from.values()):
+            container.pop(name)
+        self.record('purge', removed=(name,))
+        return True
 
 class World(Entity):
     def __init__(self, name = 'world', description = 'The world as we know it', game=None, player=None, warn=True):
+        # Class -> name -> entity, kept in world.linked order, so lookups by type don't scan the world
+        self.by_type = {}
+        # RegionLoader, when the world is streamed in by region
+        self.regions = None
+        # Content hash of the world file this world was built from
+        self.digest = None
+        # Bumped whenever a room is added, removed, or linked to or unlinked from another, see RoomGraph
+        self.layout = 0
         super().__init__(name, description, game, player, world=self, warn=warn)
 
+    def link(self, linked: Entity, override = False):
+        name = f"{linked.name}"
+        previous = self.linked.get(name)
+        super().link(linked, override)
+        if previous is not None and previous is not linked:
+            classes = type(linked).__mro__
+            for cls in type(previous).__mro__:
+                if cls not in classes:
+                    del self.by_type[cls][name]
+        for cls in type(linked).__mro__:
+            self.by_type.setdefault(cls, {})[name] = linked
+        if isinstance(linked, Room) or isinstance(previous, Room):
+            self.layout += 1
+
+    def pop(self, name):
+        popped = super().pop(name)
+        for cls in type(popped).__mro__:
+            self.by_type[cls].pop(name, None)
+        if isinstance(popped, Room):
+            self.layout += 1
+        return popped
+
 class Item(Entity):
     def __init__(self, name = 'item', description = "No description", droppable=True, takeable=True, lookable=True, game=None, player=None, world=None, warn=True, **kwargs):
         super().__init__(name, description, game, player, world, warn=warn)
@@ -155,6 +210,7 @@ class Item(Entity):
                 self.remove_action("take")
                 if self.droppable:
                     self.add_action("drop", self.drop)
+                self.record('take', self, self.player)
                 if look:
                     self.look()
         else:
@@ -170,6 +226,7 @@ class Item(Entity):
                 self.remove_action("drop")
                 if self.takeable:
                     self.add_action("take", self.take)
+                self.record('drop', self, self.player)
                 self.game.current_room_intro()
             else:
                 self.game.output("That item is not droppable, guess you're stuck with it.")
@@ -179,6 +236,7 @@ class Item(Entity):
 
 class Room(Entity):
     def __init__(self, name='room', description = "An empty room", game=None, player=None, world=None, **kwargs):
+        self.actions_cache = (None, None)
         super().__init__(name, description, game, player, world)
         self.add_action("go", self.go)
         if 'links' in kwargs:
@@ -189,9 +247,7 @@ class Room(Entity):
                     pass
 
     def go(self):
-        self.player.current_room.pop(self.player.name)
-        self.player.current_room = self
-        self.player.current_room.add_item(self.player)
+        self.player.go(self, check_link=False)
 
         for watcher in self.player.watchers.values():
             watcher.loopit()
@@ -199,13 +255,24 @@ class Room(Entity):
         self.game.current_room_intro()
         return True
 
+    def link(self, linked: Entity, override = False):
+        super().link(linked, override)
+        if isinstance(linked, Room) and self.world is not None:
+            self.world.layout += 1
+
     def link_room(self, room: Room):
         try:
-            super().link(room)
+            self.link(room)
             room.link_room(self)
         except EntityLinkException:
             pass
 
+    def pop(self, name):
+        popped = super().pop(name)
+        if isinstance(popped, Room) and self.world is not None:
+            self.world.layout += 1
+        return popped
+
     def add_item(self, item: Item):
         super().link(item)
 
@@ -226,6 +293,16 @@ class Room(Entity):
         return dict(filter(lambda pair : (isinstance(pair[1], Door) and not isinstance(pair[1], HiddenDoor)) or (isinstance(pair[1], HiddenDoor) and pair[1].condition()), self.linked.items()))
 
     def get_actions(self):
+        """
+        Map each action to the entities in this room and the player's inventory that support it.
+        The result is cached until the room, anything in it, or the inventory changes generation,
+        so treat it as read-only.
+        """
+        inventory = self.player.inv_items
+        key = (self.generation, id(inventory), getattr(inventory, 'generation', None))
+        if key[2] is not None and self.actions_cache[0] == key:
+            return self.actions_cache[1]
+
         actions = {}
         for item in list(self.linked.values()) + list(self.player.inv_items.values()):
             for action in item.actions:
@@ -236,6 +313,7 @@ class Room(Entity):
                     actions[action] = []
                 actions[action].append(item)
 
+        self.actions_cache = (key, actions)
         return actions
 
 class Door(Room):
@@ -270,9 +348,7 @@ class Door(Room):
     
     def go(self):
         if self.locked == False:
-            self.player.current_room.pop(self.player.name)
-            self.player.current_room = self.get_other(self.player.current_room)
-            self.player.current_room.add_item(self.player)
+            self.player.go(self.get_other(self.player.current_room), check_link=False)
 
             for watcher in self.player.watchers.values():
                 watcher.loopit()
@@ -292,6 +368,7 @@ class Door(Room):
                 self.game.output("Door unlocked")
                 self.remove_action("unlock")
                 self.add_action("lock", self.lock)
+                self.record('unlock', self)
             else:
                 self.game.output("You don't have the key to unlock this door")
         else:
@@ -307,6 +384,7 @@ class Door(Room):
                 self.game.output("Door locked")
                 self.remove_action("lock")
                 self.add_action("unlock", self.unlock)
+                self.record('lock', self)
             else:
                 self.game.output("You don't have the key to lock this door")
         else:
@@ -314,14 +392,35 @@ class Door(Room):
         return True
 
 class HiddenDoor(Door):
-    """A door that is hidden and will only show when a certain condition is met"""
-    def __init__(self, name: str, room1: Room, room2: Room, condition: lambda var=None: bool, game=None, player=None, world=None, **kwargs):
+    """
+    A door that is hidden and will only show when a certain condition is met.
+    The condition's result is memoized until the door, the world, the player, their inventory or
+    the news change; pass volatile=True for conditions that must be re-evaluated on every check.
+    """
+    def __init__(self, name: str, room1: Room, room2: Room, condition: lambda var=None: bool, volatile=False, game=None, player=None, world=None, **kwargs):
         super().__init__(name, room1, room2, game=game, player=player, world=world, **kwargs)
-        self.condition = condition
+        self.check = condition
+        self.volatile = volatile
+        self.memo = (None, None)
+
+    def stamp(self):
+        """Generation counters of everything a condition may read"""
+        inventory = getattr(self.player, 'inv_items', None)
+        news = getattr(self.game, 'news', None)
+        return (self.generation, self.world.generation, getattr(self.player, 'generation', None),
+                getattr(inventory, 'generation', None), getattr(news, 'version', None))
+
+    def condition(self):
+        if self.volatile:
+            return self.check()
+        stamp = self.stamp()
+        if self.memo[0] != stamp:
+            self.memo = (stamp, self.check())
+        return self.memo[1]
 
     def go(self):
         if self.condition():
             super().go()
         else:
             self.game.output("The door is hidden and cannot be accessed yet.")
-        return True
\ No newline at end of file
+        return True
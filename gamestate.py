@@ -0,0 +1,83 @@
+"""
+Versioned game state for the web client.
+
+GameState keeps the last state built for a game and a version that goes up whenever the state
+actually changes. The state is only rebuilt when something it is built from changes generation
+(see Entity.touch), so polling an unchanged game costs a tuple comparison. A version is
+"<number>-<process>": the number comes from one counter seeded with the clock, so it goes up
+across games, revivals and restarts. The process tag is there because with a shared store (see
+store.py) every worker builds its own state of a session, and their counters can meet, so versions
+are never compared across processes. Versions can be used as ETags.
+"""
+from __future__ import annotations
+import itertools, os, threading, time
+from collections import deque
+from entities import HiddenDoor
+
+STATE_HISTORY = int(os.getenv("STATE_HISTORY", 32))
+
+numbers = itertools.count(time.time_ns() // 1000)
+
+def tag_process():
+    global process
+    process = f"{os.getpid():x}{os.urandom(4).hex()}"
+
+tag_process()
+# Workers forked from a process that imported this module get tags of their own
+os.register_at_fork(after_in_child=tag_process)
+
+def number(version):
+    """The number of a version handed out by this process, or None for other versions"""
+    number, _, tag = str(version).partition("-")
+    return int(number) if tag == process and number.isdigit() else None
+
+class GameState:
+    def __init__(self, game, build, history=STATE_HISTORY):
+        self.game = game
+        self.build = build  # game -> state dict
+        self.stamp = None
+        self.state = {}
+        self.version = None
+        self.changes = deque(maxlen=history)  # (version number, names of the fields that changed), oldest first
+        self.lock = threading.RLock()
+
+    def stamp_of(self):
+        """Everything the state is built from: generation counters, and the values that change without one"""
+        player = self.game.player
+        room = player.current_room
+        inventory = player.inv_items
+        # Volatile hidden doors aren't memoized, so their conditions are part of the stamp
+        doors = tuple(door.condition() for door in room.linked.values() if isinstance(door, HiddenDoor) and door.volatile)
+        return (id(room), room.generation, room.description, player.generation, getattr(inventory, 'generation', None),
+                self.game.world.generation, self.game.news.version, player.money, player.health, player.first_health, doors)
+
+    def current(self):
+        """The version and the state of the game now. The state is shared, so treat it as read-only"""
+        stamp = self.stamp_of()
+        with self.lock:
+            if stamp != self.stamp:
+                state = self.build(self.game)
+                changed = frozenset(name for name, value in state.items() if name not in self.state or self.state[name] != value)
+                if changed or self.version is None:
+                    version = next(numbers)
+                    self.version = f"{version}-{process}"
+                    self.changes.append((version, changed))
+                    self.state = state
+                self.stamp = stamp
+            return self.version, self.state
+
+    def since(self, version):
+        """
+        The version now and the fields that changed after the given version, or None for the
+        fields if that version isn't one of the last few of this game.
+        """
+        with self.lock:
+            current, state = self.current()
+            since = number(version)
+            if not any(known == since for known, _ in self.changes):
+                return current, None
+            changed = set()
+            for known, fields in self.changes:
+                if known > since:
+                    changed |= fields
+            return current, {name: state[name] for name in changed}
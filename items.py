@@ -15,6 +15,8 @@ class Money(Item):
     def take(self, **kwargs):
         self.player.current_room.pop(self.name)
         self.player.money = self.player.money + self.amount
+        self.player.touch()
+        self.record('take', self, self.player)
         self.game.current_room_intro()
         return True
 
@@ -36,6 +38,7 @@ class Wearable(Item):
             self.droppable = False
             self.remove_action("drop")
             self.remove_action("wear")
+            self.record('wear', self, self.player)
         else:
             self.game.output(f"Something wrong: couldn't wear {self.name}")
         return True
@@ -47,6 +50,7 @@ class Wearable(Item):
         self.droppable = True
         self.add_action("drop", self.drop)
         self.add_action("wear", self.wear)
+        self.record('remove', self, self.player)
         return True
 
 class Useable(Item):
@@ -0,0 +1,231 @@
+"""
+Write-behind journals that let sessions survive a server restart.
+
+Every state change a game records (see Entity.record) is appended to its session's journal as
+the new state of the entities it touched, so replaying a journal is just setting those states
+again. Appends go through a queue to one background writer, which writes whatever has piled
+up in one batch and fsyncs each file once per batch, so requests never wait on the disk. The
+writer is an OS thread even under gevent, so its fsyncs don't stall the greenlets.
+
+Every `compact_every` records, and after every script, the session is compacted into a snapshot
+(see snapshot.py) stamped with the last record it covers, and the journal starts over. The
+snapshot is taken by the writer too. It may already hold some of the records queued after it,
+which is fine, since a record is the whole new state of its entities and replays the same.
+"""
+from __future__ import annotations
+import _queue, marshal, os, struct, sys, threading, time
+import snapshot
+try:
+    from gevent.monkey import get_original
+    start_thread = get_original('_thread', 'start_new_thread')
+except ImportError:
+    from _thread import start_new_thread as start_thread
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", os.path.join(os.path.expanduser("~"), ".cache", "adventure", "journal"))
+COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", 200))
+
+# Records are length-prefixed, so a torn write at the end of a journal is easy to spot
+LENGTH = struct.Struct("<I")
+# Snapshots start with the sequence number of the last record they cover
+SEQUENCE = struct.Struct("<Q")
+# Seconds between checks for the writer to catch up, in flush
+FLUSH_POLL = 0.001
+
+class Journal:
+    """The journals of every session, in one directory"""
+    def __init__(self, directory=JOURNAL_DIR, compact_every=COMPACT_EVERY):
+        self.directory = directory
+        self.compact_every = compact_every
+        # Not gevent's queue, which the writer's OS thread couldn't wait on
+        self.queue = _queue.SimpleQueue()
+        self.writer = False
+        self.queued = 0  # Work put so far
+        self.written = 0  # Work the writer is done with
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, session_id, kind):
+        return os.path.join(self.directory, f"{session_id}.{kind}")
+
+    def put(self, session_id, kind, payload=None):
+        """Queue work for the writer, starting it if it isn't running"""
+        with self.lock:
+            if not self.writer:
+                start_thread(self.write_loop, ())
+                self.writer = True
+            self.queued += 1
+            self.queue.put((session_id, kind, payload))
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is on disk. Returns False on timeout"""
+        target = self.queued
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Polled, since the writer can't wake a greenlet from its OS thread
+        while self.written < target:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(FLUSH_POLL)
+        return True
+
+    def has(self, session_id):
+        return os.path.exists(self.path(session_id, 'journal')) or os.path.exists(self.path(session_id, 'snapshot'))
+
+    def sessions(self):
+        """IDs of the sessions with something on disk"""
+        return sorted({name.rpartition('.')[0] for name in os.listdir(self.directory) if name.endswith(('.journal', '.snapshot'))})
+
+    def discard(self, session_id):
+        """Forget a session, once everything queued for it before is written"""
+        self.put(session_id, 'discard')
+
+    def attach(self, session_id, game, sequence=0):
+        """Start recording a game's changes to the session's journal"""
+        game.journal = SessionJournal(self, session_id, game, sequence)
+        return game.journal
+
+    def replay(self, session_id, game):
+        """
+        Bring a freshly started game to the last state journaled for the session, and keep
+        journaling it. If the journal can't be replayed, say because the world file changed, it
+        is discarded and False returned; the game may be half-replayed then, so start another.
+        """
+        sequence = 0
+        try:
+            try:
+                with open(self.path(session_id, 'snapshot'), 'rb') as stream:
+                    data = stream.read()
+                sequence, = SEQUENCE.unpack_from(data)
+                snapshot.load(game, data[SEQUENCE.size:])
+            except FileNotFoundError:
+                pass
+            for record in self.read(session_id):
+                if record[0] > sequence:
+                    sequence, event, changed, removed = record
+                    snapshot.apply(game, changed, removed)
+        except (snapshot.SnapshotException, KeyError, struct.error) as exc:
+            sys.stderr.write(f"Journal for session {session_id} can't be replayed: {exc}\n")
+            self.discard(session_id)
+            return False
+        # Compact right away, so a torn record at the end of the journal is gone before anything is appended
+        self.attach(session_id, game, sequence).compact()
+        return True
+
+    def read(self, session_id):
+        """The records in a session's journal, up to the first torn one"""
+        try:
+            with open(self.path(session_id, 'journal'), 'rb') as stream:
+                data = stream.read()
+        except FileNotFoundError:
+            return
+        offset = 0
+        while offset + LENGTH.size <= len(data):
+            length, = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            if offset + length > len(data):
+                return
+            try:
+                yield marshal.loads(data[offset:offset + length])
+            except (EOFError, ValueError, TypeError):
+                return
+            offset += length
+
+    def write_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except _queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as exc:
+                sys.stderr.write(f"Journal write failed: {exc}\n")
+            self.written += len(batch)
+
+    def write(self, batch):
+        """Write a batch of queued work, fsyncing each file once"""
+        streams = {}
+        def close(session_id):
+            stream = streams.pop(session_id, None)
+            if stream is not None:
+                stream.flush()
+                os.fsync(stream.fileno())
+                stream.close()
+
+        for session_id, kind, payload in batch:
+            if kind == 'record':
+                if session_id not in streams:
+                    streams[session_id] = open(self.path(session_id, 'journal'), 'ab')
+                streams[session_id].write(payload)
+            elif kind == 'snapshot':
+                session_journal, sequence = payload
+                try:
+                    data = SEQUENCE.pack(sequence) + session_journal.capture()
+                except Exception as exc:
+                    sys.stderr.write(f"Session {session_id} can't be compacted: {exc}\n")
+                    continue
+                # Everything journaled before the snapshot is in it, so the journal starts over
+                close(session_id)
+                replace(self.path(session_id, 'snapshot'), data)
+                streams[session_id] = open(self.path(session_id, 'journal'), 'wb')
+            elif kind == 'discard':
+                close(session_id)
+                for path in (self.path(session_id, 'journal'), self.path(session_id, 'snapshot')):
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+
+        for session_id in list(streams):
+            close(session_id)
+
+class SessionJournal:
+    """Records one game's changes to its session's journal"""
+    def __init__(self, journal, session_id, game, sequence=0):
+        self.journal = journal
+        self.session_id = session_id
+        self.game = game
+        self.sequence = sequence
+        self.since_snapshot = 0
+        # AI characters record what news tells them from the news threads, alongside the request's records
+        self.lock = threading.RLock()
+
+    def record(self, event, entities, removed=()):
+        """Queue the new state of entities, and the names of removed ones, as the next record"""
+        if event == 'script':
+            # Scripts can change anything, so journal everything
+            return self.compact()
+        with self.lock:
+            self.sequence += 1
+            changed = {entity.name: snapshot.state(entity) for entity in entities}
+            data = marshal.dumps((self.sequence, event, changed, tuple(removed)))
+            self.journal.put(self.session_id, 'record', LENGTH.pack(len(data)) + data)
+            self.since_snapshot += 1
+            if self.since_snapshot >= self.journal.compact_every:
+                self.compact()
+
+    def compact(self):
+        """Queue a snapshot of the game, replacing everything journaled so far"""
+        with self.lock:
+            self.since_snapshot = 0
+            self.journal.put(self.session_id, 'snapshot', (self, self.sequence))
+
+    def capture(self, attempts=3):
+        """Snapshot the game, on the writer's thread while requests may be changing it"""
+        for _ in range(attempts - 1):
+            try:
+                return snapshot.save(self.game)
+            except RuntimeError:
+                # Something the snapshot was reading changed size under it
+                pass
+        return snapshot.save(self.game)
+
+def replace(path, data):
+    """Write a file so that it is either all old or all new, even after a crash"""
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as stream:
+        stream.write(data)
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(temporary, path)
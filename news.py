@@ -1,12 +1,80 @@
+"""
+News bulletins, and the characters subscribed to them.
+
+Telling an AI character about a bulletin can mean an OpenAI call, so publish only queues the
+bulletin for each subscriber and returns. A small pool of background threads, shared by the
+games in the process, delivers the queued bulletins: each game's in the order they were
+published, one delivery at a time, so a slow subscriber in one game only holds up that game. A
+subscriber that got several bulletins meanwhile hears them in one notify_news call. Only the
+last `history` bulletins are kept, published or waiting for a subscriber. flush() waits for the
+deliveries, for tests and anything else that needs them done.
+"""
+import os, sys, threading
+from collections import deque
+from concurrent import futures
+
+NEWS_HISTORY = int(os.getenv("NEWS_HISTORY", 100))
+NEWS_WORKERS = int(os.getenv("NEWS_WORKERS", 4))
+
+# Delivers the news of every game in the process, at most NEWS_WORKERS games at once
+dispatcher = futures.ThreadPoolExecutor(max_workers=max(NEWS_WORKERS, 1), thread_name_prefix="news")
+
 class News():
-    def __init__(self):
-        self.bulletins = []
+    def __init__(self, history=NEWS_HISTORY, background=True):
+        self.bulletins = deque(maxlen=history)
         self.subscribers = {}
+        self.version = 0
+        self.background = background  # Deliver on the dispatcher's thread, or in publish
+        self.outbox = {}  # Subscriber name -> (subscriber, bulletins waiting for it)
+        self.scheduled = False  # Whether a background delivery is queued or running
+        self.delivering = 0
+        self.lock = threading.Condition()  # Notified when a delivery is done
 
     def publish(self, bulletin):
-        self.bulletins.append(bulletin)
-        for subscriber in self.subscribers.values():
-            subscriber.notify_news(bulletin)
+        with self.lock:
+            self.bulletins.append(bulletin)
+            self.version += 1
+            for name, subscriber in self.subscribers.items():
+                waiting = self.outbox.setdefault(name, (subscriber, []))[1]
+                waiting.append(bulletin)
+                del waiting[:-self.bulletins.maxlen]
+            schedule = self.background and not self.scheduled
+            self.scheduled = self.scheduled or schedule
+        if not self.background:
+            self.deliver()
+        elif schedule:
+            dispatcher.submit(self.deliver_all)
+
+    def deliver_all(self):
+        """Deliver until nothing is waiting, on a dispatcher thread"""
+        while True:
+            self.deliver()
+            with self.lock:
+                if not self.outbox:
+                    self.scheduled = False
+                    self.lock.notify_all()
+                    return
+
+    def deliver(self):
+        """Tell each subscriber the bulletins waiting for it, all in one"""
+        with self.lock:
+            outbox, self.outbox = self.outbox, {}
+            self.delivering += 1
+        try:
+            for subscriber, bulletins in outbox.values():
+                try:
+                    subscriber.notify_news("\n".join(bulletins))
+                except Exception as exc:
+                    sys.stderr.write(f"Couldn't deliver the news to {subscriber.name}: {exc}\n")
+        finally:
+            with self.lock:
+                self.delivering -= 1
+                self.lock.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until every bulletin published so far has been delivered. Returns False on timeout"""
+        with self.lock:
+            return self.lock.wait_for(lambda: not self.outbox and not self.delivering and not self.scheduled, timeout)
 
     def subscribe(self, character):
         self.subscribers[character.name] = character
@@ -14,3 +82,5 @@ class News():
     def unsubscribe(self, character):
         if character.name in self.subscribers:
             del self.subscribers[character.name]
+            with self.lock:
+                self.outbox.pop(character.name, None)
@@ -0,0 +1,88 @@
+from __future__ import annotations
+from collections import deque
+from entities import Room, Door, HiddenDoor
+
+class RoomGraph:
+    """
+    A compact adjacency view of a world's rooms for shortest-path queries.
+
+    Rooms are numbered, and each room keeps a tuple of (neighbour, door) edges, where door is the
+    index of the door the edge passes through, or -1 for a plain link. Doors are only passable while
+    unlocked and, for hidden doors, while their condition holds. Breadth-first search results are
+    cached per set of passable doors, so the static part of the map is only searched once per source.
+    """
+    def __init__(self, world):
+        self.world = world
+        self.layout = None  # World layout the graph was built for
+
+    def build(self):
+        """(Re)build the adjacency lists from the rooms and doors in the world"""
+        rooms = [room for room in Room.get_all(world=self.world).values() if not isinstance(room, Door)]
+        self.rooms = rooms
+        self.index = {room.name: i for i, room in enumerate(rooms)}
+        self.doors = list(Door.get_all(world=self.world).values())
+
+        edges = [[] for _ in rooms]
+        for i, room in enumerate(rooms):
+            for linked in room.linked.values():
+                if not isinstance(linked, Door) and linked.name in self.index:
+                    edges[i].append((self.index[linked.name], -1))
+        for d, door in enumerate(self.doors):
+            ends = [self.index[linked.name] for linked in door.linked.values() if linked.name in self.index]
+            if len(ends) == 2:
+                edges[ends[0]].append((ends[1], d))
+                edges[ends[1]].append((ends[0], d))
+        self.edges = tuple(tuple(room_edges) for room_edges in edges)
+
+        # Passable-door bitmask -> source room -> previous room on the shortest path to each room
+        self.searches = {}
+        self.layout = self.world.layout
+
+    def refresh(self):
+        """Rebuild the graph if rooms were added, removed or relinked since it was built"""
+        if self.layout != self.world.layout:
+            self.build()
+
+    def passable(self):
+        """Bitmask of the doors that can currently be walked through"""
+        mask = 0
+        for d, door in enumerate(self.doors):
+            if not door.locked and (not isinstance(door, HiddenDoor) or door.condition()):
+                mask |= 1 << d
+        return mask
+
+    def search(self, source: int, mask: int):
+        """Breadth-first search from source through the doors in mask, cached per (mask, source)"""
+        by_source = self.searches.setdefault(mask, {})
+        if source not in by_source:
+            previous = [-1] * len(self.rooms)
+            previous[source] = source
+            queue = deque([source])
+            while queue:
+                room = queue.popleft()
+                for neighbour, door in self.edges[room]:
+                    if previous[neighbour] < 0 and (door < 0 or mask >> door & 1):
+                        previous[neighbour] = room
+                        queue.append(neighbour)
+            by_source[source] = previous
+        return by_source[source]
+
+    def path(self, start: Room, end: Room):
+        """Rooms to walk through, in order, from start to end (excluding start), or None if there's no way"""
+        self.refresh()
+        if start.name not in self.index or end.name not in self.index:
+            return None
+        source, target = self.index[start.name], self.index[end.name]
+        previous = self.search(source, self.passable())
+        if previous[target] < 0:
+            return None
+        path = []
+        while target != source:
+            path.append(self.rooms[target])
+            target = previous[target]
+        return path[::-1]
+
+    def distance(self, start: Room, end: Room):
+        """Number of moves from start to end, or None if there's no way"""
+        path = self.path(start, end)
+        return None if path is None else len(path)
@@ -0,0 +1,65 @@
+"""
+A pool of games built ahead of time, so new sessions don't wait for one.
+
+Building a game loads the world and, for AI characters, sets up OpenAI assistants and threads.
+GamePool keeps `size` games ready and builds replacements in the background, at most
+`workers` at a time. A game taken from the pool is fresh: give it its output and journal.
+"""
+from __future__ import annotations
+import os, sys, threading
+from collections import deque
+from concurrent import futures
+
+POOL_SIZE = int(os.getenv("POOL_SIZE", 4))
+POOL_WORKERS = int(os.getenv("POOL_WORKERS", 2))
+
+class GamePool:
+    def __init__(self, build, size=POOL_SIZE, workers=POOL_WORKERS):
+        self.build = build  # () -> fresh game
+        self.size = size
+        self.ready = deque()
+        self.building = 0
+        self.futures = []
+        self.lock = threading.Lock()
+        self.executor = futures.ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="game-pool") if size > 0 else None
+        self.hits = 0
+        self.misses = 0
+
+    def take(self):
+        """A ready game if there is one, otherwise one built now; either way the pool is topped up"""
+        try:
+            game = self.ready.popleft()
+            self.hits += 1
+        except IndexError:
+            game = self.build()
+            self.misses += 1
+        self.fill()
+        return game
+
+    def fill(self):
+        """Start building games until the ready and the building ones make up the pool size"""
+        if self.executor is None:
+            return
+        with self.lock:
+            self.futures = [future for future in self.futures if not future.done()]
+            for _ in range(self.size - len(self.ready) - self.building):
+                self.building += 1
+                self.futures.append(self.executor.submit(self.add))
+
+    def add(self):
+        game = None
+        try:
+            game = self.build()
+        except Exception as exc:
+            sys.stderr.write(f"Couldn't build a game for the pool: {exc}\n")
+        finally:
+            with self.lock:
+                if game is not None:
+                    self.ready.append(game)
+                self.building -= 1
+
+    def wait(self, timeout=None):
+        """Wait until the games being built are ready"""
+        with self.lock:
+            building = list(self.futures)
+        futures.wait(building, timeout)
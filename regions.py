@@ -0,0 +1,145 @@
+"""
+Streaming a world in by region.
+
+A world file can split its map into region files, relative to itself:
+
+    regions:
+      village: regions/village.yaml
+      forest: regions/forest.yaml
+    start_region: village
+
+Each region file has the usual rooms, doors and characters, plus `neighbors`: the regions its
+rooms link to. A room link or door into another region only needs declaring on one side: it is made
+once both rooms are built, and made again when either is rebuilt. Only the region the player is in and the regions within `keep` hops of it are
+built; regions further away are evicted back to plain specs, along with their current state.
+"""
+from __future__ import annotations
+import os
+import world_cache
+from entities import Room, Door
+from characters import Character
+
+# Attribute types that are saved when an entity is evicted, and restored when it is rebuilt
+PRIMITIVES = (str, int, float, bool, type(None))
+
+class RegionLoader:
+    def __init__(self, filename, world, populate, world_obj, player=None, news=None, keep=int(os.getenv("REGION_KEEP", 1))):
+        base = os.path.dirname(filename)
+        self.paths = {name: os.path.join(base, path) for name, path in world['regions'].items()}
+        self.populate = populate
+        self.world = world_obj
+        self.player = player
+        self.news = news
+        self.keep = keep
+        self.loaded = {}     # region -> names of its rooms
+        self.neighbors = {}  # region -> neighbouring regions
+        self.region_of = {}  # room name -> region
+        self.specs = {}      # entity name -> spec it was last built from
+        self.evicted = {}    # region -> spec it was evicted to
+        self.states = {}     # entity name -> attributes to restore when it is rebuilt
+        self.pending = []    # door specs waiting for both of their rooms to be built
+        self.links = []      # [room, room] links waiting for both rooms to be built, whichever declared it
+        self.load(world.get('start_region') or next(iter(self.paths)))
+
+    def entered(self, room: Room, character: Character):
+        """Build the regions around the room the player just entered, and evict the ones far away"""
+        if character is not self.player or room.name not in self.region_of:
+            return
+        near = {self.region_of[room.name]}
+        frontier = list(near)
+        for _ in range(self.keep):
+            reached = []
+            for region in frontier:
+                self.load(region)
+                reached.extend(neighbor for neighbor in self.neighbors[region] if neighbor not in near)
+            near.update(reached)
+            frontier = reached
+        for region in frontier:
+            self.load(region)
+        for region in list(self.loaded):
+            if region not in near:
+                self.evict(region)
+
+    def load(self, region):
+        if region in self.loaded:
+            return
+        spec = self.evicted.pop(region, None) or world_cache.load(self.paths[region])
+        self.neighbors[region] = list(spec.get('neighbors') or [])
+        self.loaded[region] = [room['name'] for room in spec['rooms']]
+        for room in spec['rooms']:
+            self.region_of[room['name']] = region
+            self.specs[room['name']] = room
+            for item in room['items']:
+                self.specs[item['name']] = item
+        for entity in list(spec['doors']) + list(spec['characters']):
+            self.specs[entity['name']] = entity
+
+        self.populate(spec, self.pending)
+        for room in spec['rooms']:
+            for link in room.get('links') or ():
+                if link not in self.world.linked and [room['name'], link] not in self.links:
+                    self.links.append([room['name'], link])
+        self.place_pending()
+        for name in list(self.states):
+            if name in self.world.linked:
+                for attribute, value in self.states.pop(name).items():
+                    setattr(self.world.linked[name], attribute, value)
+
+    def place_pending(self):
+        """Build the waiting doors and room links whose rooms both exist now"""
+        ready = [door for door in self.pending if door['room1'] in self.world.linked and door['room2'] in self.world.linked]
+        if ready:
+            self.pending = [door for door in self.pending if door not in ready]
+            self.populate({'rooms': (), 'doors': ready, 'characters': ()})
+        ready = [link for link in self.links if link[0] in self.world.linked and link[1] in self.world.linked]
+        if ready:
+            self.links = [link for link in self.links if link not in ready]
+            for room, other in ready:
+                Room.get(room, world=self.world).link_room(Room.get(other, world=self.world))
+
+    def evict(self, region):
+        """Replace a region's entities with specs of their current state, unless the player or a watcher is there"""
+        rooms = [self.world.linked[name] for name in self.loaded[region] if name in self.world.linked]
+        watchers = list(self.player.watchers.values()) if self.player is not None else []
+        for room in rooms:
+            if any(entity is self.player or entity in watchers for entity in room.linked.values()):
+                return
+
+        spec = {'rooms': [], 'doors': [], 'characters': [], 'neighbors': self.neighbors[region]}
+        for room in rooms:
+            items = []
+            for entity in list(room.linked.values()):
+                if isinstance(entity, Door):
+                    door = self.save(entity, exclude=('locked',))
+                    door['locked'] = entity.locked
+                    self.pending.append(door)
+                elif isinstance(entity, Character):
+                    character = self.save(entity)
+                    character['current_room'] = room.name
+                    spec['characters'].append(character)
+                    if self.news is not None:
+                        self.news.unsubscribe(entity)
+                elif isinstance(entity, Room):
+                    # Linked back when this room is built again, even if only the other room declared it
+                    if entity.name not in self.loaded[region] and [entity.name, room.name] not in self.links:
+                        self.links.append([entity.name, room.name])
+                    continue
+                else:
+                    items.append(self.save(entity))
+                self.world.purge(entity.name)
+            spec['rooms'].append(dict(self.save(room), items=items))
+        for room in rooms:
+            self.world.purge(room.name)
+
+        self.evicted[region] = spec
+        del self.loaded[region]
+
+    def save(self, entity, exclude=()):
+        """A spec to rebuild entity from, remembering its current attributes for after the rebuild"""
+        spec = dict(self.specs.get(entity.name) or {'name': entity.name, 'description': entity.description})
+        spec.setdefault('type', type(entity).__name__)
+        self.states[entity.name] = {
+            attribute: value for attribute, value in vars(entity).items()
+            if isinstance(value, PRIMITIVES) and attribute != 'generation' and attribute not in exclude
+        }
+        return spec
@@ -1,32 +1,84 @@
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, Response, g, request, jsonify, send_from_directory, session, stream_with_context
 from flask_cors import CORS
-from characters import Character, AICharacter
+from characters import Character, AICharacter, OpenAIClient, provision_assistants, release_threads
 from entities import Entity, Room, HiddenDoor
 from items import Weapon
 from adventure import Adventure
-import os, uuid
+from journal import Journal
+from sessions import SessionManager, SESSION_TTL
+from store import open_store
+from pool import GamePool
+from gamestate import GameState
+import atexit, functools, json, os, threading, time, uuid
 
 app = Flask(__name__, static_url_path='', static_folder='static')
 CORS(app)  # Enable CORS for all routes
 
 app.secret_key = "supersecretkey"  # Replace with a secure key
 
+WORLD_FILE = os.getenv("WORLD_FILE", "world.yaml")
+# Log lines kept per session between two /logs calls
+LOG_LIMIT = int(os.getenv("LOG_LIMIT", 1000))
+# Seconds between keepalive comments on an idle /events stream
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", 15))
+# Milliseconds a client waits before reconnecting to /events
+EVENTS_RETRY = int(os.getenv("EVENTS_RETRY", 3000))
+# Seconds between checks of the session store for log lines written by other workers, for /events
+EVENTS_POLL = float(os.getenv("EVENTS_POLL", 0.5))
+# Token for the /admin endpoints, which are off without one
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Operations allowed in one /batch request
+BATCH_LIMIT = int(os.getenv("BATCH_LIMIT", 50))
+
 # Global log buffer
 log_buffers = {}
-games = {}
-
-def create_new_game(file=os.getenv("WORLD_FILE", "world.yaml")
-):
-    """Creates a new game instance for a session."""
-    session['game_id'] = str(uuid.uuid4())  # Assign a unique game ID
-
-    if not games.get(session['game_id']):
-        games[session['game_id']] = Adventure(file=file, output=lambda x="", end="\n\n", flush=None: log_buffers[session['game_id']].append(str(x)+str(end)))
-    
-    game = games[session['game_id']]
-
-    player = game.player
-    world = game.world
+# Session ID -> condition notified when its log buffer grows or the session goes away, for /events
+log_conditions = {}
+# World file -> game that new sessions are spawned from
+templates = {}
+# Sessions live in this process, or with SESSION_STORE=sqlite in a database shared by every worker
+store = open_store(ttl=SESSION_TTL)
+# Sessions are journaled to disk so they survive a restart, unless JOURNAL_DIR is set empty or the store already keeps them
+journal = Journal() if os.getenv("JOURNAL_DIR") != "" and not store.shared else None
+
+templates_lock = threading.Lock()
+
+def spawn_game(file, output):
+    """Spawns a new game from the shared template game for this world file."""
+    if file not in templates:
+        with templates_lock:
+            if file not in templates:
+                templates[file] = Adventure(file=file, output=lambda *args, **kwargs: None)
+                if os.getenv("OPENAI_API_KEY"):
+                    # Every session of this world talks through the same assistants, so resolve them all now
+                    threading.Thread(target=provision_assistants, args=(templates[file].world,), name="provision", daemon=True).start()
+                    # And have conversation threads ready for their first talks
+                    if OpenAIClient.threads is None:
+                        OpenAIClient.thread_pool().fill()
+                        atexit.register(OpenAIClient.threads.close)
+    return templates[file].spawn(output=output)
+
+# Games for WORLD_FILE built ahead of time, POOL_SIZE of them, by up to POOL_WORKERS threads
+pool = GamePool(lambda: spawn_game(WORLD_FILE, output=lambda *args, **kwargs: None))
+pool.fill()
+
+def session_game(game_id, file=WORLD_FILE):
+    """Spawns a game that writes to the log buffer of a session."""
+    def output(x="", end="\n\n", flush=None):
+        condition = log_condition(game_id)
+        with condition:
+            buffer = log_buffers.setdefault(game_id, [])
+            buffer.append(str(x)+str(end))
+            if len(buffer) > LOG_LIMIT:
+                del buffer[:-LOG_LIMIT]
+            condition.notify_all()
+
+    if file == WORLD_FILE:
+        game = pool.take()
+        game.output = output
+    else:
+        game = spawn_game(file, output=output)
+    game.client_state = GameState(game, build_state)
 
     def current_room_intro():
         for char in dict(filter(lambda pair : game.player.in_room_items(pair[1]), Character.get_all(world=game.world).items())).values():
@@ -37,19 +89,98 @@ def create_new_game(file=os.getenv("WORLD_FILE", "world.yaml")
         game.output("You have died.")
         game.output("Please refresh the page to start a new game.")
         del games[session['game_id']]
+        if journal is not None:
+            journal.discard(session['game_id'])
         session.clear()
         create_new_game()
 
     game.current_room_intro = current_room_intro
     game.game_over = game_over
+    return game
+
+def log_condition(game_id):
+    """The condition for a session's log buffer. Under gevent it waits on greenlets, not threads."""
+    condition = log_conditions.get(game_id)
+    if condition is None:
+        condition = log_conditions.setdefault(game_id, threading.Condition())
+    return condition
+
+def take_logs(game_id):
+    """Empty a session's log buffer, returning what was in it"""
+    condition = log_conditions.get(game_id)
+    logs = []
+    if condition is not None:
+        with condition:
+            logs = log_buffers.get(game_id) or []
+            log_buffers[game_id] = []
+    if store.shared:
+        # Lines in the store were written before the ones still here
+        logs = store.take_logs(game_id) + logs
+    return logs
+
+def flush_logs(game_id):
+    """With a shared store, move a session's log buffer to it, for whichever worker the client polls"""
+    condition = log_conditions.get(game_id)
+    if not store.shared or condition is None:
+        return
+    with condition:
+        logs = log_buffers.get(game_id)
+        log_buffers[game_id] = []
+    if logs:
+        store.append_logs(game_id, logs, LOG_LIMIT)
+
+def drop_logs(game_id):
+    """Forget a session's logs, ending its /events streams"""
+    log_buffers.pop(game_id, None)
+    condition = log_conditions.pop(game_id, None)
+    if condition is not None:
+        with condition:
+            condition.notify_all()
+
+# Sessions idle for SESSION_TTL seconds, or beyond MAX_SESSIONS, are evicted; with a journal they come back on their next request.
+# The conversation threads of a session that ends in this process are deleted, and a revived session starts new ones
+games = SessionManager(session_game, journal=journal, on_evict=drop_logs, store=store, release=release_threads)
+
+def create_new_game(file=WORLD_FILE):
+    """Creates a new game instance for a session."""
+    session['game_id'] = str(uuid.uuid4())  # Assign a unique game ID
+    log_buffers.setdefault(session['game_id'], [])
 
+    game = session_game(session['game_id'], file)
+    if journal is not None and game.world.regions is None:
+        journal.attach(session['game_id'], game)
+    games[session['game_id']] = game
 
 @app.before_request
 def ensure_game_session():
     """Ensures each session has its own game state."""
-    if 'game_id' not in session:
+    if 'game_id' not in session and not request.path.startswith('/admin/'):
         create_new_game()
 
+@app.after_request
+def share_logs(response):
+    """Moves the log lines a request wrote to the shared store, if there is one."""
+    if 'game_id' in session:
+        flush_logs(session['game_id'])
+    return response
+
+def locked(endpoint):
+    """
+    Runs an endpoint with the session's game, creating it if needed, in g.game and the session
+    checked out (see SessionManager.checkout), so the requests of a session run one at a time,
+    in the order they came in. Under gevent they would otherwise interleave at every wait.
+    """
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        try:
+            games[session['game_id']]
+        except KeyError:
+            create_new_game()
+        with games.checkout(session['game_id']) as game:
+            g.game = game
+            return endpoint(*args, **kwargs)
+    return wrapper
+
 # class StdoutBuffer(io.StringIO):
 #     """ Redirects stdout to capture printed messages in a buffer. """
 #     def write(self, message):
@@ -61,21 +192,16 @@ def ensure_game_session():
 
 # sys.stdout = StdoutBuffer()  # Redirect stdout to custom buffer
 
-def get_game_state():
-    """Fetches the current game state for the player."""
-    try:
-        current_room = games[session['game_id']].player.current_room
-    except KeyError:
-        create_new_game()
-
-        current_room = games[session['game_id']].player.current_room
+def build_state(game):
+    """Builds what the web client shows of a game."""
+    current_room = game.player.current_room
     actions_dict = current_room.get_actions()
 
     # Create mappings of valid actions per item and valid items per action
     item_to_actions = {}
     action_to_items = {}
     inventory_items = {
-        item_name: [] for item_name, item in games[session['game_id']].player.inv_items.items()
+        item_name: [] for item_name, item in game.player.inv_items.items()
     }
 
     for action, objects in actions_dict.items():
@@ -109,11 +235,21 @@ def get_game_state():
         "items": item_to_actions,  # Maps items to valid actions
         "inventory": inventory_items,
         "adjacent_rooms": adjacent_rooms,
-        "money": round(games[session['game_id']].player.money, 2),
-        "health": games[session['game_id']].player.health,
-        "first_health": games[session['game_id']].player.first_health,
+        "money": round(game.player.money, 2),
+        "health": game.player.health,
+        "first_health": game.player.first_health,
     }
 
+def get_game_state():
+    """Fetches the current game state for the player, with its version."""
+    try:
+        game = games[session['game_id']]
+    except KeyError:
+        create_new_game()
+        game = games[session['game_id']]
+    version, state = game.client_state.current()
+    return {"version": version, **state}
+
 @app.route('/')
 def serve_index():
     """Serve the main index.html file."""
@@ -135,88 +271,212 @@ def serve_images(filename):
     return send_from_directory('images', filename)
 
 @app.route('/state', methods=['GET'])
+@locked
 def game_state():
-    """API to get the current game state."""
-    try:
-        games[session['game_id']]
-    except KeyError:
-        create_new_game()
-
-    return jsonify(get_game_state())
-
-@app.route('/action', methods=['POST'])
-def perform_action():
-    """API to perform an action in the game."""
-    try:
-        games[session['game_id']]
-    except KeyError:
-        create_new_game()
+    """
+    API to get the current game state. It is tagged with its version, so a conditional request
+    gets a 304 while nothing changed, and ?since=<version> returns only the fields changed since.
+    """
+    state = g.game.client_state
+    since = request.args.get('since')
+    changed = None
+    if since is not None:
+        version, changed = state.since(since)
+    if changed is None:
+        version, changed = state.current()
+        response = jsonify({"version": version, **changed})
+    else:
+        response = jsonify({"version": version, "since": since, **changed})
+    response.set_etag(str(version))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
-    data = request.json
+def run_action(game, data):
+    """Performs an action in a game, returning the response body and status."""
     action = data.get("action")
     item_name = data.get("item")
 
     if not action:
-        return jsonify({"error": "Action is required"}), 400
+        return {"error": "Action is required"}, 400
 
-    current_room = games[session['game_id']].player.current_room
+    current_room = game.player.current_room
     actions_dict = current_room.get_actions()
 
     if action not in actions_dict:
-        return jsonify({"error": f"Invalid action: {action}"}), 400
+        return {"error": f"Invalid action: {action}"}, 400
 
     item = next((obj for obj in actions_dict[action] if obj.name == item_name), None)
 
+    if item is None:
+        return {"error": f"Can't {action} {item_name} here"}, 400
+
     if isinstance(item, AICharacter) and action.lower() == "talk":
         request.talking_to = item.name
-        return jsonify({"message": f"You are now talking to {item.name}.", "talking": True})
+        return {"message": f"You are now talking to {item.name}.", "talking": True}, 200
 
     elif isinstance(item, Weapon) and action.lower() == "use":
         if data.get("target") is None:
             # If the item is a weapon and no target is specified, prompt for a target
-            return jsonify({"action": "use", "item": item.name, "message": "Choose a target.", "targets": [e.name for e in current_room.get_items().values() if isinstance(e, Character) and e != games[session['game_id']].player]})
+            return {"action": "use", "item": item.name, "message": "Choose a target.", "targets": [e.name for e in current_room.get_items().values() if isinstance(e, Character) and e != game.player]}, 200
         else:
             item.use(data.get("target"))
-            return jsonify({"message": f"Used {item.name} on {data.get('target')}."})
+            return {"message": f"Used {item.name} on {data.get('target')}."}, 200
 
     elif action.lower() == "look":
-        games[session['game_id']].output(item)
-        return jsonify({"message": str(item)})
+        game.output(item)
+        return {"message": str(item)}, 200
 
     elif action.lower() == "take":
         item.take(look=False)
-        games[session['game_id']].output(f"You took {item.name}.")
-        return jsonify({"message": f"You took {item.name}."})
+        game.output(f"You took {item.name}.")
+        return {"message": f"You took {item.name}."}, 200
 
     else:
         item.do(action)
-        return jsonify({"message": f"Performed {action} on {item_name}."})
-
-@app.route('/move', methods=['POST'])
-def move_to_room():
-    """API to move to a different room."""
-    try:
-        games[session['game_id']]
-    except KeyError:
-        create_new_game()
+        return {"message": f"Performed {action} on {item_name}."}, 200
 
-    data = request.json
+def run_move(game, data):
+    """Moves to a different room, returning the response body and status."""
     room_name = data.get("room")
 
     if not room_name:
-        return jsonify({"error": "Room name is required"}), 400
+        return {"error": "Room name is required"}, 400
 
-    current_room = games[session['game_id']].player.current_room.get_rooms().get(room_name)
+    current_room = game.player.current_room.get_rooms().get(room_name)
 
     if not current_room:
-        return jsonify({"error": f"No such room: {room_name}"}), 400
+        return {"error": f"No such room: {room_name}"}, 400
 
     current_room.go()
-    return jsonify({"message": f"Moved to {room_name}.", "new_state": get_game_state()})
+    return {"message": f"Moved to {room_name}."}, 200
+
+def run_travel(game, data):
+    """Travels to any reachable room in one go, returning the response body and status."""
+    room_name = data.get("room")
+
+    if not room_name:
+        return {"error": "Room name is required"}, 400
+
+    path = game.travel(room_name)
+
+    if path is None:
+        return {"error": f"No route to room: {room_name}"}, 400
+
+    return {"message": f"Traveled to {room_name}.", "path": [room.name for room in path]}, 200
+
+def run_talk(game, data):
+    """Talks to an AI character, returning the response body and status."""
+    message = data.get("message")
+    character_name = data.get("talking_to", None)
+
+    if not character_name:
+        return {"error": "No conversation is in progress."}, 400
+
+    ai_character = next((char for char in Character.get_all(world=game.world).values() if char.name == character_name), None)
+
+    if not ai_character:
+        return {"error": "Character not found"}, 404
+
+    response = ai_character.talk(message, once=True)
+    return {"response": response}, 200
+
+# The operations /batch can run, by name
+OPERATIONS = {
+    "action": run_action,
+    "move": run_move,
+    "travel": run_travel,
+    "talk": run_talk,
+}
+
+@app.route('/action', methods=['POST'])
+@locked
+def perform_action():
+    """API to perform an action in the game."""
+    body, status = run_action(g.game, request.json)
+    return jsonify(body), status
+
+@app.route('/move', methods=['POST'])
+@locked
+def move_to_room():
+    """API to move to a different room."""
+    body, status = run_move(g.game, request.json)
+    if status == 200:
+        body["new_state"] = get_game_state()
+    return jsonify(body), status
+
+@app.route('/travel', methods=['POST'])
+@locked
+def travel_to_room():
+    """API to travel to any reachable room in one go."""
+    body, status = run_travel(g.game, request.json)
+    if status == 200:
+        body["new_state"] = get_game_state()
+    return jsonify(body), status
 
 @app.route('/talk', methods=['POST'])
+@locked
 def talk_to_character():
     """API to talk to AI characters."""
+    body, status = run_talk(g.game, request.json)
+    return jsonify(body), status
+
+@app.route('/batch', methods=['POST'])
+@locked
+def run_batch():
+    """
+    API to run a list of operations in one request: {"operations": [{"op": "action" | "move" |
+    "travel" | "talk", ...the fields of that endpoint}], "stop_on_error": false}. They run in
+    order, with no other request of the session in between, and the response has each one's
+    result, the log lines written meanwhile (taken, as /logs does) and the state at the end.
+    """
+    game = g.game
+    data = request.json or {}
+    operations = data.get("operations")
+    stop_on_error = bool(data.get("stop_on_error", False))
+
+    if not isinstance(operations, list) or not all(isinstance(operation, dict) for operation in operations):
+        return jsonify({"error": "Operations must be a list of objects"}), 400
+    if len(operations) > BATCH_LIMIT:
+        return jsonify({"error": f"At most {BATCH_LIMIT} operations per batch"}), 400
+
+    game_id = session['game_id']
+    results = []
+    for operation in operations:
+        run = OPERATIONS.get(operation.get("op"))
+        if run is None:
+            body, status = {"error": f"Invalid operation: {operation.get('op')}"}, 400
+        else:
+            try:
+                body, status = run(game, operation)
+            except Exception as e:
+                body, status = {"error": str(e)}, 500
+        results.append({"op": operation.get("op"), "status": status, **body})
+        if status >= 400 and stop_on_error:
+            break
+        if session.get('game_id') != game_id:
+            break  # The game ended, and the session has a new one
+    state = get_game_state()
+
+    return jsonify({"results": results, "logs": take_logs(session['game_id']), "state": state})
+
+def reply_events(game, ai_character, message):
+    """The events of a streamed reply, as newline-delimited JSON."""
+    for kind, value in ai_character.reply(message):
+        if kind == "text":
+            event = {"type": "text", "text": value}
+        elif kind == "json":
+            event = {"type": "json", "data": value}
+        elif kind == "error":
+            event = {"type": "error", "message": value}
+        else:
+            if value:
+                game.current_room_intro()
+            event = {"type": "end", "bye": value}
+        yield json.dumps(event) + "\n"
+
+@app.route('/talk/stream', methods=['POST'])
+def stream_talk():
+    """API to talk to AI characters, streaming the reply as newline-delimited JSON events."""
     try:
         games[session['game_id']]
     except KeyError:
@@ -229,13 +489,18 @@ def talk_to_character():
     if not character_name:
         return jsonify({"error": "No conversation is in progress."}), 400
 
-    ai_character = next((char for char in Character.get_all(world=games[session['game_id']].world).values() if char.name == character_name), None)
-
-    if not ai_character:
+    game_id = session['game_id']
+    if character_name not in AICharacter.get_all(world=games[game_id].world):
         return jsonify({"error": "Character not found"}), 404
 
-    response = ai_character.talk(message, once=True)
-    return jsonify({"response": response})
+    def events():
+        with games.checkout(game_id) as game:
+            ai_character = AICharacter.get_all(world=game.world)[character_name]
+            yield from reply_events(game, ai_character, message or "")
+        flush_logs(game_id)
+
+    return Response(stream_with_context(events()), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route('/end_talk', methods=['POST'])
 def end_talk():
@@ -252,14 +517,53 @@ def end_talk():
 @app.route('/logs', methods=['GET'])
 def get_logs():
     """API to retrieve stdout logs."""
+    return jsonify({"logs": take_logs(session['game_id'])})
+
+@app.route('/events', methods=['GET'])
+def stream_logs():
+    """API to stream stdout logs as Server-Sent Events, as they are written."""
     try:
-        log_buffers[session['game_id']]
+        games[session['game_id']]
     except KeyError:
-        log_buffers[session['game_id']] = []
+        create_new_game()
 
-    logs = log_buffers[session['game_id']][:]  # Copy the buffer
-    log_buffers[session['game_id']] = []  # Clear the buffer after sending logs
-    return jsonify({"logs": logs})
+    game_id = session['game_id']
+    condition = log_condition(game_id)
+
+    # Lines written by other workers only show up in the store, so look there every so often
+    timeout = min(EVENTS_POLL, EVENTS_KEEPALIVE) if store.shared else EVENTS_KEEPALIVE
+
+    def events():
+        # Something to send right away, so the client sees the stream open
+        yield f"retry: {EVENTS_RETRY}\n\n"
+        sent = time.monotonic()
+        while True:
+            with condition:
+                condition.wait_for(lambda: log_buffers.get(game_id) or log_conditions.get(game_id) is not condition, timeout=timeout)
+            if log_conditions.get(game_id) is not condition:
+                return  # The session was evicted or ended
+            logs = take_logs(game_id)
+            if logs:
+                yield "".join(f"data: {json.dumps(log)}\n\n" for log in logs)
+                sent = time.monotonic()
+            elif time.monotonic() - sent >= EVENTS_KEEPALIVE:
+                yield ": keepalive\n\n"
+                sent = time.monotonic()
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/admin/sessions', methods=['GET'])
+def session_stats():
+    """API to report the sessions in memory and roughly how many bytes each holds."""
+    # Closed unless a token is configured
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"error": "Forbidden"}), 403
+
+    stats = games.stats(extra=lambda game_id: [log_buffers.get(game_id, [])])
+    # Session IDs are shortened, so the report can't be used to take sessions over
+    stats["per_session"] = {game_id[:8]: value for game_id, value in stats["per_session"].items()}
+    return jsonify(stats)
 
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
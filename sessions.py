@@ -0,0 +1,296 @@
+"""
+Bounded storage for the server's games.
+
+SessionManager is a dict of session ID -> game that forgets sessions idle for longer than
+`ttl` seconds, and the least recently used ones beyond `max_sessions`. With a journal (see
+journal.py), evicted sessions are compacted to disk first and revived, transparently, the
+next time they are looked up. With a shared store (see store.py), every change is stored and
+a game changed by another process is reloaded when it is looked up. Games whose session ends
+in this process are passed to `release`, to let go of what they hold outside it.
+"""
+from __future__ import annotations
+import os, sys, threading, time, weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from entities import Entity
+from snapshot import SnapshotException
+from store import MemoryStore
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", 3600))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 1000))
+
+class SessionManager:
+    def __init__(self, spawn, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, journal=None, on_evict=None, clock=time.monotonic, store=None, release=None):
+        self.spawn = spawn  # session ID -> fresh game, for revivals
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.journal = journal
+        self.on_evict = on_evict  # Called with the session ID of every evicted or deleted session
+        self.clock = clock
+        # Called with the game of every deleted session, and every evicted one unless the store keeps it for other workers
+        self.release = release
+        self.games = OrderedDict()  # Session ID -> game, least recently used first
+        self.last_used = {}
+        self.evictions = 0
+        self.revivals = 0
+        self.store = store if store is not None else MemoryStore()
+        self.lock = threading.RLock()
+        self.session_locks = weakref.WeakValueDictionary()  # Session ID -> FairLock, while anyone holds or waits for it
+
+    def __getitem__(self, session_id):
+        with self.lock:
+            self.expire()
+            game = self.refresh(session_id, self.games.get(session_id))
+            if game is not None:
+                return self.used(session_id, game)
+        # Revived without the manager's lock, so other sessions don't wait on the disk meanwhile
+        with self.session_lock(session_id):
+            with self.lock:
+                game = self.games.get(session_id)
+                if game is not None:
+                    return self.used(session_id, game)
+            return self.revive(session_id)
+
+    def used(self, session_id, game):
+        self.games.move_to_end(session_id)
+        self.last_used[session_id] = self.clock()
+        return game
+
+    def __setitem__(self, session_id, game):
+        with self.lock:
+            self.games[session_id] = game
+            self.games.move_to_end(session_id)
+            self.last_used[session_id] = self.clock()
+            self.expire()
+            self.shrink()
+            self.store.save(session_id, game)
+
+    def __delitem__(self, session_id):
+        with self.lock:
+            game = self.games.pop(session_id)
+            del self.last_used[session_id]
+            self.store.delete(session_id)
+            if self.release is not None:
+                self.release(game)
+            if self.on_evict is not None:
+                self.on_evict(session_id)
+
+    def __contains__(self, session_id):
+        return session_id in self.games
+
+    def __len__(self):
+        return len(self.games)
+
+    def __iter__(self):
+        return iter(list(self.games))
+
+    def get(self, session_id, default=None):
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def session_lock(self, session_id):
+        """The lock that orders the requests of a session"""
+        with self.lock:
+            lock = self.session_locks.get(session_id)
+            if lock is None:
+                lock = self.session_locks[session_id] = FairLock()
+            return lock
+
+    @contextmanager
+    def checkout(self, session_id):
+        """
+        Hold a session for a request: take its lock, in this process and in the store, and yield
+        its game, up to date with the store. Changes are stored when the request is done.
+        """
+        with self.session_lock(session_id), self.store.lock(session_id):
+            game = self[session_id]
+            yield game
+            with self.lock:
+                # Unless the game ended meanwhile
+                if self.games.get(session_id) is game:
+                    self.store.save(session_id, game)
+
+    def refresh(self, session_id, game):
+        """The game of a session, reloaded from the store if it was changed elsewhere since"""
+        version = self.store.version(session_id)
+        if version is None and hasattr(game, 'stored'):
+            # It was stored once, so it ended elsewhere
+            del self.games[session_id]
+            del self.last_used[session_id]
+            return None
+        if version is None or (game is not None and getattr(game, 'stored', (None,))[0] == version):
+            return game
+        fresh = self.spawn(session_id)
+        try:
+            self.store.load(session_id, fresh)
+        except (SnapshotException, KeyError) as exc:
+            sys.stderr.write(f"Session {session_id} can't be loaded from the store: {exc}\n")
+            self.store.delete(session_id)
+            return game
+        self.games[session_id] = fresh
+        return fresh
+
+    def in_use(self, session_id):
+        """Whether another request holds or waits for a session, so it mustn't be evicted from under it"""
+        lock = self.session_locks.get(session_id)
+        return lock is not None and lock.busy()
+
+    def expire(self):
+        """Evict the sessions that have been idle for longer than the TTL, unless they are in use"""
+        deadline = self.clock() - self.ttl
+        for session_id in list(self.games):
+            if self.last_used[session_id] > deadline:
+                break
+            if not self.in_use(session_id):
+                self.evict(session_id)
+
+    def shrink(self):
+        """Evict the least recently used sessions beyond max_sessions, passing over those in use"""
+        for session_id in list(self.games):
+            if len(self.games) <= self.max_sessions:
+                break
+            if not self.in_use(session_id):
+                self.evict(session_id)
+
+    def evict(self, session_id):
+        """Drop a session from memory, compacting it to disk first when there's a journal"""
+        with self.lock:
+            game = self.games.pop(session_id)
+            del self.last_used[session_id]
+            self.evictions += 1
+            # Before compaction, so a revived game doesn't hold on to what was let go
+            if self.release is not None and not self.store.shared:
+                self.release(game)
+            if self.journal is not None and game.journal is not None:
+                game.journal.compact()
+            if self.on_evict is not None:
+                self.on_evict(session_id)
+
+    def revive(self, session_id):
+        """Bring an evicted session back from the journal, or raise KeyError. Call it with the session's lock only"""
+        if self.journal is None:
+            raise KeyError(session_id)
+        # The session may have been evicted moments ago, with its compaction still queued
+        self.journal.flush()
+        if not self.journal.has(session_id):
+            raise KeyError(session_id)
+        game = self.spawn(session_id)
+        if not self.journal.replay(session_id, game):
+            raise KeyError(session_id)
+        with self.lock:
+            self.games[session_id] = game
+            self.used(session_id, game)
+            self.revivals += 1
+            self.shrink()
+        return game
+
+    def stats(self, extra=None):
+        """Sizes and idle times of the sessions in memory. extra maps a session ID to more objects to count, like its logs"""
+        with self.lock:
+            self.expire()
+            now = self.clock()
+            sessions = {
+                session_id: {
+                    'bytes': sizeof(game, *(extra(session_id) if extra else ())),
+                    'idle': round(now - self.last_used[session_id], 1),
+                }
+                for session_id, game in self.games.items()
+            }
+        return {
+            'sessions': len(sessions),
+            'max_sessions': self.max_sessions,
+            'ttl': self.ttl,
+            'evictions': self.evictions,
+            'revivals': self.revivals,
+            'bytes': sum(session['bytes'] for session in sessions.values()),
+            'per_session': sessions,
+        }
+
+class FairLock:
+    """
+    A reentrant lock handed out in the order it was asked for, so the requests of a session run
+    one at a time and in the order they came in. Under gevent, threads are greenlets.
+    """
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.tickets = 0  # Next ticket to hand out
+        self.serving = 0  # Ticket of the holder, or of the next one in line
+        self.owner = None
+        self.depth = 0
+        self.abandoned = set()  # Tickets of waiters that gave up, skipped when their turn comes
+
+    def acquire(self):
+        me = threading.get_ident()
+        with self.condition:
+            if self.owner == me:
+                self.depth += 1
+                return True
+            ticket = self.tickets
+            self.tickets += 1
+            try:
+                self.condition.wait_for(lambda: self.serving == ticket)
+            except BaseException:
+                # Killed while waiting, by a gevent Timeout say: the ones behind mustn't wait for it
+                if self.serving == ticket:
+                    self.advance()
+                else:
+                    self.abandoned.add(ticket)
+                raise
+            self.owner = me
+            self.depth = 1
+            return True
+
+    def release(self):
+        with self.condition:
+            if self.owner != threading.get_ident():
+                raise RuntimeError("Can't release a lock held by someone else")
+            self.depth -= 1
+            if self.depth == 0:
+                self.owner = None
+                self.advance()
+
+    def busy(self):
+        """Whether anyone but the calling thread holds or waits for the lock"""
+        with self.condition:
+            holding = self.owner is not None
+            waiting = self.tickets - self.serving - len(self.abandoned) - holding
+            return waiting > 0 or (holding and self.owner != threading.get_ident())
+
+    def advance(self):
+        """Serve the next ticket still waited for. Call it with the condition held"""
+        self.serving += 1
+        while self.serving in self.abandoned:
+            self.abandoned.remove(self.serving)
+            self.serving += 1
+        self.condition.notify_all()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+def sizeof(game, *extra):
+    """
+    Approximate bytes held by a game: its entities with their attributes and links, the
+    player's inventory, the news and anything in extra. Shared objects, such as the parsed
+    world and compiled scripts, aren't counted.
+    """
+    size = 0
+    entities = list(game.world.linked.values())
+    if game.player.name not in game.world.linked:
+        entities.append(game.player)
+    for entity in entities:
+        size += sys.getsizeof(entity) + sys.getsizeof(vars(entity))
+        # Links, actions, inventories and the like are counted, but not the entities they hold
+        for value in vars(entity).values():
+            if not isinstance(value, Entity):
+                size += sys.getsizeof(value)
+    size += sys.getsizeof(game.news.bulletins) + sum(sys.getsizeof(bulletin) for bulletin in game.news.bulletins)
+    for obj in extra:
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (list, tuple)):
+            size += sum(sys.getsizeof(item) for item in obj)
+    return size
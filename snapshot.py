@@ -0,0 +1,136 @@
+"""
+Compact binary snapshots of a game's state.
+
+A snapshot only holds what differs from the world as it was right after loading: the
+baseline, captured once per world file. It is a header (magic, format version and the
+content hash of the world file) followed by the marshalled delta.
+"""
+from __future__ import annotations
+import marshal, struct
+from entities import Entity, World, Room, Item
+from items import Money, Wearable, Useable, Weapon, Eatable, Phone, Computer
+from characters import Character, NonPlayerCharacter, WalkerCharacter, AICharacter
+
+MAGIC = b"ADVS"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sB32s")
+
+# Attribute types that are stored; everything else is rebuilt from the world file
+PRIMITIVES = frozenset((str, int, float, bool, type(None)))
+
+# Classes of the entities a snapshot can create, when they were made during play
+CLASSES = {cls.__name__: cls for cls in (Item, Room, Money, Wearable, Useable, Weapon, Eatable, Phone, Computer,
+                                         Character, NonPlayerCharacter, WalkerCharacter, AICharacter)}
+
+# World file content hash -> state of a freshly loaded world
+baselines = {}
+
+class SnapshotException(Exception):
+    "Thrown when a game can't be saved, or a snapshot can't be read into it"
+
+def state(entity):
+    """Everything about an entity that play can change, as plain data"""
+    attributes = {name: value for name, value in vars(entity).items() if type(value) in PRIMITIVES}
+    del attributes['generation']
+    containers = tuple(sorted(container.name for container in entity.linked_from.values()
+                              if isinstance(container, Entity) and not isinstance(container, World)))
+    character = None
+    if isinstance(entity, Character):
+        character = (getattr(entity.current_room, 'name', None), tuple(entity.inv_items), tuple(entity.wearing), tuple(entity.watchers))
+    return (type(entity).__name__, containers, tuple(entity.actions), attributes, character)
+
+def capture(game):
+    """State of every entity in the game, by name"""
+    world = game.world
+    if world.regions is not None:
+        raise SnapshotException("Worlds streamed in by region can't be saved")
+    states = {name: state(entity) for name, entity in world.linked.items() if not isinstance(entity, World)}
+    states[game.player.name] = state(game.player)
+    return states
+
+def baseline(game):
+    """State of the game's world right after loading, captured the first time a world file is loaded"""
+    digest = game.world.digest
+    if digest is None:
+        raise SnapshotException("The world wasn't loaded from a file")
+    if digest not in baselines:
+        baselines[digest] = capture(game)
+    return baselines[digest]
+
+def save(game) -> bytes:
+    """Snapshot of how the game differs from its world file"""
+    base = baseline(game)
+    states = capture(game)
+    delta = {
+        'changed': {name: value for name, value in states.items() if base.get(name) != value},
+        'removed': [name for name in base if name not in states],
+        'news': list(game.news.bulletins),
+    }
+    return HEADER.pack(MAGIC, FORMAT_VERSION, bytes.fromhex(game.world.digest)) + marshal.dumps(delta)
+
+def load(game, data: bytes):
+    """Bring a freshly started game (see Adventure.new_game and spawn) to the state in a snapshot"""
+    restore(game, read(game, data))
+
+def read(game, data: bytes):
+    """The delta in a snapshot, checked against the game's world file without changing the game"""
+    try:
+        magic, version, digest = HEADER.unpack_from(data)
+        delta = marshal.loads(data[HEADER.size:]) if magic == MAGIC and version == FORMAT_VERSION else None
+    except (struct.error, EOFError, ValueError, TypeError) as exc:
+        raise SnapshotException(f"Not a snapshot: {exc}")
+    if delta is None:
+        raise SnapshotException("Not a snapshot, or one from another version")
+    if digest.hex() != game.world.digest:
+        raise SnapshotException("The snapshot is of a different world file")
+    if not isinstance(delta, dict) or not {'changed', 'removed', 'news'} <= delta.keys():
+        raise SnapshotException("Not a snapshot: the delta is damaged")
+    return delta
+
+def restore(game, delta):
+    """Bring a freshly started game to the state in a delta from read"""
+    apply(game, delta['changed'], delta['removed'])
+    game.news.bulletins.clear()
+    game.news.bulletins.extend(delta['news'])
+    game.news.version += len(delta['news'])
+
+def apply(game, changed, removed=()):
+    """Set entities to the states in changed (see state), creating them if needed, and purge the removed ones"""
+    world, player = game.world, game.player
+    def lookup(name):
+        return player if name == player.name else world.linked[name]
+
+    for name, (kind, _, _, attributes, _) in changed.items():
+        if name != player.name and name not in world.linked:
+            if kind not in CLASSES:
+                raise SnapshotException(f"Can't create {name!r}, a {kind}")
+            CLASSES[kind](name=name, description=attributes.get('description'), game=game, player=player, world=world)
+    for name in removed:
+        world.purge(name)
+
+    for name, (kind, containers, actions, attributes, character) in changed.items():
+        entity = lookup(name)
+        current = {container.name: container for container in list(entity.linked_from.values())
+                   if isinstance(container, Entity) and not isinstance(container, World)}
+        for container_name, container in current.items():
+            if container_name not in containers:
+                container.pop(name)
+        for container_name in containers:
+            if container_name not in current:
+                lookup(container_name).link(entity)
+
+        for attribute, value in attributes.items():
+            setattr(entity, attribute, value)
+        if tuple(entity.actions) != actions:
+            entity.actions = {action: entity.actions.get(action) or getattr(entity, action) for action in actions}
+
+        if character is not None:
+            room, inventory, wearing, watchers = character
+            entity.current_room = None if room is None else lookup(room)
+            entity.inv_items.clear()
+            entity.inv_items.update({item: lookup(item) for item in inventory})
+            entity.wearing = {item: lookup(item) for item in wearing}
+            entity.watchers = {watcher: lookup(watcher) for watcher in watchers}
+        entity.touch()
+
+    world.touch()
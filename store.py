@@ -0,0 +1,190 @@
+"""
+Where sessions live between requests.
+
+MemoryStore keeps them in the process only, which is all a single worker needs. SQLiteStore
+keeps every session as a snapshot (see snapshot.py) in one SQLite database, with a version
+that goes up with every change, so several gunicorn workers on a host can serve the same
+sessions: a worker whose copy of a game is older than the stored version loads the stored one.
+A session is locked across processes while a request uses it, and its log lines are kept in the
+database too, so they reach the client whichever worker it polls.
+"""
+from __future__ import annotations
+import os, sqlite3, threading, time, zlib
+from contextlib import contextmanager, nullcontext
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import snapshot
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DB = os.getenv("SESSION_DB", os.path.join(os.path.expanduser("~"), ".cache", "adventure", "sessions.db"))
+# Sessions share this many cross-process locks; two sessions on one just wait for each other
+LOCK_STRIPES = 4096
+
+class MemoryStore:
+    """Sessions only in this process's memory, for a single worker"""
+    shared = False
+
+    def lock(self, session_id):
+        return nullcontext()
+
+    def version(self, session_id):
+        return None
+
+    def load(self, session_id, game):
+        raise KeyError(session_id)
+
+    def save(self, session_id, game):
+        pass
+
+    def delete(self, session_id):
+        pass
+
+    def take_logs(self, session_id):
+        return []
+
+class Changes:
+    """Stands in for a game's journal (see Entity.record) to note that something changed since it was stored"""
+    def __init__(self):
+        self.dirty = False
+
+    def record(self, event, entities, removed=()):
+        self.dirty = True
+
+class SQLiteStore:
+    """Sessions as snapshots in a SQLite database shared by the workers on a host"""
+    shared = True
+
+    def __init__(self, path=SESSION_DB, ttl=None, poll=0.001):
+        if fcntl is None:
+            raise RuntimeError("SQLiteStore needs fcntl to lock sessions across processes")
+        self.path = path
+        self.ttl = ttl  # Seconds after which an untouched session is deleted, or None to keep them
+        self.poll = poll  # Seconds between tries for a session locked by another process
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, version INTEGER, data BLOB, updated REAL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS logs (seq INTEGER PRIMARY KEY AUTOINCREMENT, session TEXT, line TEXT)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS logs_session ON logs (session, seq)")
+        self.db_lock = threading.Lock()
+        # Locks are per process, so stripes already held by this process are counted instead of locked again
+        self.lock_file = open(f"{path}.lock", "a+b")
+        self.held = {}
+        self.held_lock = threading.Lock()
+        self.saves = 0
+
+    def execute(self, sql, *args):
+        with self.db_lock:
+            return self.connection.execute(sql, args).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        with self.db_lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    @contextmanager
+    def lock(self, session_id):
+        """Hold a session against other processes. Requests within a process are ordered by the caller"""
+        stripe = zlib.crc32(session_id.encode()) % LOCK_STRIPES
+        while True:
+            with self.held_lock:
+                if self.held.get(stripe):
+                    self.held[stripe] += 1
+                    break
+                try:
+                    fcntl.lockf(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, stripe)
+                    self.held[stripe] = 1
+                    break
+                except OSError:
+                    pass
+            # Sleep rather than block, so other greenlets run meanwhile under gevent
+            time.sleep(self.poll)
+        try:
+            yield
+        finally:
+            with self.held_lock:
+                self.held[stripe] -= 1
+                if not self.held[stripe]:
+                    del self.held[stripe]
+                    fcntl.lockf(self.lock_file, fcntl.LOCK_UN, 1, stripe)
+
+    def version(self, session_id):
+        """The stored version of a session, or None if it isn't stored"""
+        rows = self.execute("SELECT version FROM sessions WHERE id = ?", session_id)
+        return rows[0][0] if rows else None
+
+    def load(self, session_id, game):
+        """Bring a freshly started game to the stored state of a session, or raise KeyError"""
+        rows = self.execute("SELECT version, data FROM sessions WHERE id = ?", session_id)
+        if not rows:
+            raise KeyError(session_id)
+        version, data = rows[0]
+        snapshot.load(game, data)
+        self.stored(game, version, data)
+
+    def stored(self, game, version, data):
+        """Note the version a game was stored as, and start watching it for changes"""
+        game.stored = (version, data, game.news.version)
+        if game.journal is None or isinstance(game.journal, Changes):
+            game.journal = Changes()
+
+    def save(self, session_id, game):
+        """Store a game, if it changed since it was loaded or last saved"""
+        version, stored, news = getattr(game, 'stored', (0, None, None))
+        if isinstance(game.journal, Changes) and not game.journal.dirty and news == game.news.version:
+            return
+        data = snapshot.save(game)
+        if data != stored:
+            version += 1
+            self.execute("INSERT OR REPLACE INTO sessions (id, version, data, updated) VALUES (?, ?, ?, ?)", session_id, version, data, time.time())
+        self.stored(game, version, data)
+        self.saves += 1
+        if self.ttl is not None and self.saves % 1000 == 0:
+            self.expire()
+
+    def delete(self, session_id):
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            connection.execute("DELETE FROM logs WHERE session = ?", (session_id,))
+
+    def expire(self):
+        """Delete the sessions untouched for longer than the TTL"""
+        deadline = time.time() - self.ttl
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM logs WHERE session IN (SELECT id FROM sessions WHERE updated < ?)", (deadline,))
+            connection.execute("DELETE FROM sessions WHERE updated < ?", (deadline,))
+
+    def append_logs(self, session_id, lines, limit=None):
+        """Add log lines for a session, keeping at most its last limit lines"""
+        with self.transaction() as connection:
+            connection.executemany("INSERT INTO logs (session, line) VALUES (?, ?)", [(session_id, line) for line in lines])
+            if limit is not None:
+                connection.execute("DELETE FROM logs WHERE session = ? AND seq <= (SELECT seq FROM logs WHERE session = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                                   (session_id, session_id, limit))
+
+    def take_logs(self, session_id):
+        """Empty a session's log lines, returning them"""
+        with self.transaction() as connection:
+            rows = connection.execute("SELECT seq, line FROM logs WHERE session = ? ORDER BY seq", (session_id,)).fetchall()
+            if rows:
+                connection.execute("DELETE FROM logs WHERE session = ? AND seq <= ?", (session_id, rows[-1][0]))
+        return [line for _, line in rows]
+
+def open_store(kind=SESSION_STORE, **kwargs):
+    """The store named by SESSION_STORE: "memory" or "sqlite" """
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "sqlite":
+        return SQLiteStore(**kwargs)
+    raise ValueError(f"Unknown session store: {kind!r}")
@@ -1,4 +1,4 @@
-import string, random
+import os, string, random
 import pytest
 from adventure import *
 from entities import Entity, Room, Item, World, NoEntityLinkException
@@ -76,6 +76,77 @@ def create_entity_tree(cls, world, mock_game, depth=3, display=False, root=None)
 
     return root
 
+class CaptureOutput:
+    """Helper class to capture output from the Adventure class"""
+    def __init__(self):
+        self.captured = []
+
+    def __call__(self, *args, **kwargs):
+        message = " ".join(str(arg) for arg in args)
+        self.captured.append(message)
+        return message
+
+    def clear(self):
+        self.captured = []
+
+    def contains(self, text):
+        """Check if any captured output contains the given text"""
+        return any(text.lower() in msg.lower() for msg in self.captured)
+
+    def last_message(self):
+        """Get the last captured message"""
+        return self.captured[-1] if self.captured else ""
+
+class FakeOpenAIClient:
+    """
+    Stands in for OpenAIClient (characters.py) without reaching OpenAI.
+
+    Every call is recorded in `calls`: ("assistant", name), ("thread", ID), ("message", thread ID,
+    content, role), ("run", thread ID, assistant name), ("done", thread ID) once a reply has been
+    streamed, and ("release", *thread IDs). A reply streams `chunks`, strings for text and dicts
+    or lists of them for JSON.
+    """
+    def __init__(self, chunks=("Hello.",)):
+        self.chunks = list(chunks)
+        self.calls = []
+        self.threads = 0
+
+    def of(self, kind):
+        """The recorded calls of one kind"""
+        return [call for call in self.calls if call[0] == kind]
+
+    def connect(self, api_key=None):
+        return True
+
+    def get_or_create_assistant(self, name, instructions, model=None):
+        self.calls.append(("assistant", name))
+        return {"id": "mock_assistant_id", "name": name}
+
+    def create_thread(self):
+        self.threads += 1
+        thread_id = f"mock_thread_{self.threads}"
+        self.calls.append(("thread", thread_id))
+        return thread_id
+
+    def release_threads(self, thread_ids):
+        self.calls.append(("release", *thread_ids))
+
+    def add_message(self, thread_id, content, role="user"):
+        self.calls.append(("message", thread_id, content, role))
+        return True
+
+    def stream_assistant_response(self, thread_id, assistant_name, additional_instructions=""):
+        self.calls.append(("run", thread_id, assistant_name))
+        yield from self.chunks
+        self.calls.append(("done", thread_id))
+
+@pytest.fixture
+def openai_client(monkeypatch):
+    """Fixture to swap OpenAIClient for a FakeOpenAIClient, returned to set up and inspect"""
+    client = FakeOpenAIClient()
+    monkeypatch.setattr("characters.OpenAIClient", client)
+    return client
+
 # Legacy functions for backward compatibility
 # These should be removed once all tests are updated to use fixtures
 
@@ -114,3 +185,17 @@ def test_world_exists():
     # This function is now a no-op
     # It's kept for backward compatibility
     pass
+
+FIXTURE_WORLD = os.path.join(os.path.dirname(__file__), "fixtures", "test_world.yaml")
+
+@pytest.fixture
+def fixture_world_file():
+    """Fixture to provide the path of the bundled test world"""
+    return FIXTURE_WORLD
+
+@pytest.fixture(autouse=True)
+def world_cache_dir(tmp_path, monkeypatch):
+    """Keep the on-disk world cache out of the user's home directory"""
+    import world_cache
+    monkeypatch.setattr(world_cache, "CACHE_DIR", str(tmp_path / "world_cache"))
+    return world_cache.CACHE_DIR
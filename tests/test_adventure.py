@@ -4,7 +4,7 @@ import tempfile
 import yaml
 from adventure import Adventure
 from helpers import *
-from entities import Room, Item, World
+from entities import Room, Item, World, HiddenDoor
 from characters import Character
 
 @pytest.fixture
@@ -78,27 +78,6 @@ def test_world_file():
     # Clean up the temporary file
     os.unlink(path)
 
-class CaptureOutput:
-    """Helper class to capture output from the Adventure class"""
-    def __init__(self):
-        self.captured = []
-
-    def __call__(self, *args, **kwargs):
-        message = " ".join(str(arg) for arg in args)
-        self.captured.append(message)
-        return message
-
-    def clear(self):
-        self.captured = []
-
-    def contains(self, text):
-        """Check if any captured output contains the given text"""
-        return any(text.lower() in msg.lower() for msg in self.captured)
-
-    def last_message(self):
-        """Get the last captured message"""
-        return self.captured[-1] if self.captured else ""
-
 @pytest.fixture
 def output_capture():
     """Fixture to provide an output capture object"""
@@ -195,3 +174,123 @@ def test_adventure_default(test_world_file, output_capture):
     # This test is more complex and would require mocking the line.raw attribute
     # Skip for now
     pass
+
+def test_adventure_world_scripts(fixture_world_file, output_capture):
+    """Test that world-file funcs and conditions run from precompiled, shared code"""
+    from adventure import compile_script
+    adv = Adventure(file=fixture_world_file, output=output_capture)
+    portal = HiddenDoor.get("test_portal", world=adv.world)
+    mushroom = Item.get("test_mushroom", world=adv.world)
+
+    assert portal.condition() == False
+    mushroom.use()
+    assert adv.player.insight == True
+    assert portal.condition() == True
+
+    # A second game loading the same file reuses the compiled code objects
+    hits = compile_script.cache_info().hits
+    Adventure(file=fixture_world_file, output=output_capture)
+    assert compile_script.cache_info().hits == hits + 2
+
+def test_adventure_script_namespace(tmp_path, output_capture):
+    """Test that each run of a world-file script starts from a fresh namespace"""
+    path = tmp_path / "scripted.yaml"
+    path.write_text(
+        "rooms:\n"
+        "  - name: only room\n"
+        "    description: The only room\n"
+        "    items:\n"
+        "      - name: counter\n"
+        "        type: Useable\n"
+        "        description: Counts its uses\n"
+        "        func: |\n"
+        "          count = globals().get('count', 0) + 1\n"
+        "          setattr(player, 'count', count)\n")
+    adv = Adventure(file=str(path), output=output_capture)
+    counter = Item.get("counter", world=adv.world)
+    counter.func()
+    counter.func()
+    assert adv.player.count == 1
+
+def test_world_cache(fixture_world_file, world_cache_dir, output_capture, monkeypatch):
+    """Test that world files are parsed once and then served from memory or disk"""
+    import world_cache
+    monkeypatch.setattr(world_cache, "templates", {})
+    first = world_cache.load(fixture_world_file)
+    assert len(os.listdir(world_cache_dir)) == 1
+
+    # Every game shares the same read-only template
+    assert world_cache.load(fixture_world_file) is first
+    with pytest.raises(TypeError):
+        first['rooms'][0]['name'] = "renamed"
+
+    # With the in-memory cache gone, the disk cache is used instead of parsing again
+    monkeypatch.setattr(world_cache, "templates", {})
+    monkeypatch.setattr(world_cache.yaml, "load", lambda *args, **kwargs: pytest.fail("parsed again"))
+    adv = Adventure(file=fixture_world_file, output=output_capture)
+    assert adv.player.current_room.name == "test_room1"
+
+@pytest.mark.parametrize("damage", ["truncated", "garbage", "wrong shape"])
+def test_world_cache_corrupt(fixture_world_file, world_cache_dir, output_capture, monkeypatch, damage):
+    """Test that a damaged disk cache is thrown away and the world file parsed again"""
+    import marshal, world_cache
+    monkeypatch.setattr(world_cache, "templates", {})
+    template = world_cache.load(fixture_world_file)
+    path = world_cache.cache_path(template.digest)
+    with open(path, 'rb') as stream:
+        data = stream.read()
+    with open(path, 'wb') as stream:
+        stream.write({"truncated": data[:len(data) // 2], "garbage": b"not marshal",
+                      "wrong shape": marshal.dumps({"rooms": []})}[damage])
+
+    monkeypatch.setattr(world_cache, "templates", {})
+    adv = Adventure(file=fixture_world_file, output=output_capture)
+    assert adv.player.current_room.name == "test_room1"
+    # The cache is rewritten whole
+    with open(path, 'rb') as stream:
+        assert stream.read() == data
+    assert os.listdir(world_cache_dir) == [os.path.basename(path)]
+
+def test_world_cache_normalizes(tmp_path, output_capture):
+    """Test that missing sections and room keys get defaults"""
+    path = tmp_path / "tiny.yaml"
+    path.write_text("rooms:\n  - name: only room\n    description: The only room\n")
+    adv = Adventure(file=str(path), output=output_capture)
+    assert adv.player.current_room.name == "only room"
+
+def test_adventure_spawn(fixture_world_file, output_capture):
+    """Test that spawned games share the template's immutable data but not its state"""
+    template = Adventure(file=fixture_world_file, output=output_capture)
+    spawned = CaptureOutput()
+    game = template.spawn(output=spawned)
+
+    assert game.world is not template.world
+    assert game.player is not template.player
+    assert game.player.current_room.name == "test_room1"
+
+    # World text is shared with the template rather than copied
+    room = Room.get("test_room1", world=game.world)
+    assert room.description is Room.get("test_room1", world=template.world).description
+
+    # Playing the spawned game leaves the template untouched
+    Item.get("test_item1", world=game.world).take()
+    assert "test_item1" in game.player.inv_items
+    assert "test_item1" not in template.player.inv_items
+    assert "test_item1" in template.player.current_room.linked
+    assert spawned.contains("test_item1")
+    assert not output_capture.contains("test_item1")
+
+def test_adventure_spawn_interpreter(fixture_world_file, output_capture):
+    """Test that spawned games have their own command history, settings and macros"""
+    template = Adventure(file=fixture_world_file, output=output_capture)
+    game = template.spawn(output=CaptureOutput())
+    other = template.spawn(output=CaptureOutput())
+
+    game.onecmd_plus_hooks("set debug true")
+    game.macros["hi"] = object()
+    assert len(game.history) == 1
+    assert len(other.history) == 0 and len(template.history) == 0
+    assert game.debug and not other.debug and not template.debug
+    assert "hi" not in other.macros and "hi" not in template.macros
+    assert game.statement_parser is not template.statement_parser
+    assert other._settables["debug"].settable_obj is other
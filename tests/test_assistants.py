@@ -0,0 +1,87 @@
+import threading, time
+from types import SimpleNamespace
+import pytest
+from assistants import AssistantRegistry, provision
+
+class FakeClient:
+    """Stands in for openai.OpenAI: assistants listed a page at a time, and created slowly"""
+    def __init__(self, existing=(), page_size=2):
+        self.existing = {name: f"id_{name}" for name in existing}
+        self.page_size = page_size
+        self.pages = 0
+        self.created = []
+        self.running = 0
+        self.most_running = 0
+        self.lock = threading.Lock()
+        self.beta = SimpleNamespace(assistants=SimpleNamespace(list=self.list, create=self.create))
+
+    def list(self, limit=20):
+        names = list(self.existing)
+        for start in range(0, len(names), self.page_size):
+            self.pages += 1
+            for name in names[start:start + self.page_size]:
+                yield SimpleNamespace(name=name, id=self.existing[name])
+
+    def create(self, name, model, instructions):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+            self.created.append(name)
+            self.existing[name] = f"id_{name}"
+        return SimpleNamespace(name=name, id=f"id_{name}")
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def registry(tmp_path):
+    """Fixture to provide an assistant registry on a fake clock"""
+    return AssistantRegistry(str(tmp_path / "assistants.json"), ttl=60, clock=Clock())
+
+def test_provision_lists_every_page_and_creates_in_parallel(registry):
+    """Test that existing assistants are found past the first page, and missing ones are created at once"""
+    client = FakeClient(existing=["a", "b", "c", "d", "e"])
+    specs = {name: f"You are {name}" for name in ["e", "x", "y", "z"]}
+    ids = provision(client, specs, registry, workers=4)
+    assert ids == {name: f"id_{name}" for name in specs}
+    assert client.pages == 3
+    assert sorted(client.created) == ["x", "y", "z"]
+    assert client.most_running == 3
+
+def test_registry_shared_and_expires(registry):
+    """Test that a second process finds the assistants in the registry, until they expire"""
+    client = FakeClient(existing=["a"])
+    provision(client, {"a": "", "b": ""}, registry)
+
+    other = AssistantRegistry(registry.path, ttl=60, clock=registry.clock)
+    fresh = FakeClient(existing=["a", "b"])
+    assert provision(fresh, {"a": "", "b": ""}, other) == {"a": "id_a", "b": "id_b"}
+    assert fresh.pages == 0
+
+    registry.clock.now += 61
+    assert other.lookup(["a", "b"]) == {}
+    provision(fresh, {"a": "", "b": ""}, other)
+    assert fresh.pages == 1
+    assert fresh.created == []
+
+def test_concurrent_provisioning_creates_once(registry):
+    """Test that threads and workers provisioning the same assistants at once create each only once"""
+    client = FakeClient()
+    specs = {"a": "", "b": ""}
+    # The second registry stands in for another worker, with the file lock its only link to this one
+    registries = [registry, registry, AssistantRegistry(registry.path, ttl=60, clock=registry.clock)]
+    results = []
+    threads = [threading.Thread(target=lambda r=r: results.append(provision(client, specs, r))) for r in registries]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(client.created) == ["a", "b"]
+    assert results == [{"a": "id_a", "b": "id_b"}] * 3
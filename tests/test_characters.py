@@ -242,33 +242,8 @@ def test_npc_creation_and_use(world, mock_game):
     assert npc.use() == True
     assert result["called"] == True
 
-def test_ai_character(world, mock_game, monkeypatch):
+def test_ai_character(world, mock_game, openai_client):
     """Test AICharacter creation and basic functionality"""
-    # Mock the OpenAIClient methods to avoid actual API calls
-    class MockOpenAIClient:
-        @staticmethod
-        def connect(api_key=None):
-            return True
-
-        @staticmethod
-        def get_or_create_assistant(name, instructions, model=None):
-            return {"id": "mock_assistant_id", "name": name}
-
-        @staticmethod
-        def create_thread():
-            return "mock_thread_id"
-
-        @staticmethod
-        def add_message(thread_id, content, role="user"):
-            return True
-
-        @staticmethod
-        def stream_assistant_response(thread_id, assistant_name, additional_instructions=""):
-            yield "Hello, I am an AI character!"
-
-    # Apply the monkeypatch
-    monkeypatch.setattr("characters.OpenAIClient", MockOpenAIClient)
-
     # Create an AICharacter
     ai_char = AICharacter(
         name="test_ai",
@@ -302,7 +277,7 @@ def test_ai_character(world, mock_game, monkeypatch):
     assert hasattr(ai_char, "assistant_name")
     assert hasattr(ai_char, "thread_id")
     assert ai_char.assistant_name == "test_ai"
-    assert ai_char.thread_id == "mock_thread_id"
+    assert ai_char.thread_id == "mock_thread_1"
 
 def test_walker_character(world, mock_game):
     """Test WalkerCharacter creation and basic functionality"""
@@ -345,3 +320,91 @@ def test_walker_character(world, mock_game):
     # But we can't guarantee which one due to randomness
     # So we'll just check that it moved somewhere
     assert walker.current_room is not None
+
+def test_ai_character_reply(world, mock_game, openai_client):
+    """Test that reply streams text and JSON events as they come, then whether the talk is over"""
+    openai_client.chunks = ["Take ", "this.", {"give": "sword"}]
+    received = []
+    ai_char = AICharacter(name="test_ai", description="Test AI Character", func=received.append, game=mock_game, world=world, warn=False)
+
+    events = list(ai_char.reply("hello"))
+    assert events == [("text", "Take "), ("text", "this."), ("json", {"give": "sword"}), ("end", True)]
+    assert received == [{"give": "sword"}]
+    assert [call[2] for call in openai_client.of("message")] == ["hello"]
+
+def test_ai_character_lazy_provisioning(world, mock_game, openai_client):
+    """Test that an AICharacter makes no OpenAI calls until it is talked to, and queues prompt additions until then"""
+    ai_char = AICharacter(name="test_ai", description="Test AI Character", game=mock_game, world=world, warn=False)
+    ai_char.notify_news("The bridge is out")
+    ai_char.add_to_prompt("You are tired")
+    assert openai_client.calls == []
+    assert ai_char.queued_prompts == "NEWS BULLETIN: The bridge is out\nYou are tired"
+
+    openai_client.chunks = ["Bye."]
+    list(ai_char.reply("hello"))
+    assert openai_client.calls == [
+        ("assistant", "test_ai"),
+        ("thread", "mock_thread_1"),
+        ("message", "mock_thread_1", "NEWS BULLETIN: The bridge is out", "assistant"),
+        ("message", "mock_thread_1", "You are tired", "assistant"),
+        ("message", "mock_thread_1", "hello", "user"),
+        ("run", "mock_thread_1", "test_ai"),
+        ("done", "mock_thread_1"),
+    ]
+    assert ai_char.queued_prompts == ""
+
+    openai_client.calls.clear()
+    ai_char.add_to_prompt("You are awake")
+    list(ai_char.reply("again", phone=True))
+    assert ("assistant", "test_ai_phone") in openai_client.calls
+    assert ai_char.phone_thread not in (None, ai_char.thread)
+    assert ai_char.queued_prompts == "You are awake"
+
+def test_ai_character_told_before_reply(world, mock_game, openai_client):
+    """Test that hits and news make no OpenAI calls, even during a run, and reach the thread before the next reply"""
+    openai_client.chunks = ["Hmm."]
+    ai_char = AICharacter(name="test_ai", description="Test AI Character", game=mock_game, world=world, warn=False)
+    list(ai_char.reply("hello"))
+    openai_client.calls.clear()
+
+    events = ai_char.reply("what now")
+    next(events)
+    ai_char.notify_news("The bridge is out")
+    list(events)
+    ai_char.take_damage(1, attacker="troll")
+    assert [call for call in openai_client.calls if call[0] == "message"] == [("message", "mock_thread_1", "what now", "user")]
+    assert ai_char.queued_prompts.split("\n")[0] == "NEWS BULLETIN: The bridge is out"
+
+    openai_client.calls.clear()
+    list(ai_char.reply("ouch"))
+    messages = [call[2] for call in openai_client.calls if call[0] == "message"]
+    assert messages[0] == "NEWS BULLETIN: The bridge is out"
+    assert messages[1].startswith("You just got hit by the troll")
+    assert messages[2] == "ouch"
+    assert ai_char.queued_prompts == ""
+    # Three exchanges and the two messages sent before the last
+    assert ai_char.thread_length == 3 * 2 + 2
+
+def test_ai_character_bounded_context(world, mock_game, openai_client):
+    """Test that prompt additions stay within budget, and that a long thread is swapped for one that starts with a recap"""
+    openai_client.chunks = ["Grr."]
+    ai_char = AICharacter(name="test_ai", description="Test AI Character", prompt_budget=400, thread_messages=6,
+                          game=mock_game, world=world, warn=False)
+    for _ in range(3):
+        ai_char.notify_news("The bridge is out")
+    for i in range(50):
+        ai_char.add_to_prompt(f"You just got hit for the {i}th time.")
+    assert len(ai_char.additional_instructions) <= 400
+    assert ai_char.additional_instructions.count("The bridge is out") <= 1
+    assert len(ai_char.queued_prompts.split("\n")) == ai_char.context.window
+
+    list(ai_char.reply("hello"))
+    first = ai_char.thread
+    assert ai_char.thread_length == ai_char.context.window + 2
+    openai_client.calls.clear()
+    list(ai_char.reply("hello again"))
+    calls = [call for call in openai_client.calls if call[0] != "assistant"]
+    assert calls[:2] == [("release", first), ("thread", "mock_thread_2")]
+    assert ai_char.thread != first
+    assert calls[2][2].endswith("They said: hello You said: Grr.")
+    assert ai_char.thread_length == 3
@@ -0,0 +1,31 @@
+from helpers import *
+from context import PromptContext, SUMMARY
+
+def test_repeated_entries_dropped():
+    """Test that an entry already among the recent ones isn't added again"""
+    context = PromptContext(budget=1000, window=4)
+    text, added = context.add("", "NEWS BULLETIN: The bridge is out")
+    assert added
+    assert context.add(text, "NEWS BULLETIN:  The bridge\nis out") == (text, False)
+    text, added = context.add(text, "You are tired")
+    assert added and text == "NEWS BULLETIN: The bridge is out\nYou are tired"
+
+def test_older_entries_summarized():
+    """Test that entries past the window are folded into the summary line, and the oldest of those dropped"""
+    context = PromptContext(budget=200, window=3)
+    text = ""
+    for i in range(10):
+        text, _ = context.add(text, f"Entry {i}. With some more words after it.")
+    summary, entries = context.split(text)
+    assert entries == [f"Entry {i}. With some more words after it." for i in (7, 8, 9)]
+    assert summary and summary[-1] == "Entry 6." and "Entry 0." not in summary
+    assert text.startswith(SUMMARY) and len(text) <= 200
+
+def test_budget_holds():
+    """Test that the context stays within its budget however long the entries"""
+    context = PromptContext(budget=300, window=8)
+    text = ""
+    for i in range(100):
+        text, _ = context.add(text, f"Hit number {i}: " + "ouch " * 30)
+        assert len(text) <= 300
+    assert context.split(text)[1][-1].startswith("Hit number 99:")
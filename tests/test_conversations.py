@@ -0,0 +1,80 @@
+import threading
+import pytest
+from helpers import *
+from conversations import ConversationPool, ConversationLimitException
+
+class Threads:
+    """Create and delete functions for ConversationPool that count their threads, and can be held back"""
+    def __init__(self):
+        self.count = 0
+        self.deleted = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.lock = threading.Lock()
+
+    def create(self):
+        self.gate.wait()
+        with self.lock:
+            self.count += 1
+            return f"thread_{self.count}"
+
+    def delete(self, thread_id):
+        with self.lock:
+            self.deleted.append(thread_id)
+
+def test_pool_hands_out_ready_threads():
+    """Test that threads are created ahead of time, and the pool tops up after a take"""
+    threads = Threads()
+    pool = ConversationPool(threads.create, threads.delete, size=2, workers=2)
+    pool.fill()
+    pool.wait()
+    assert len(pool.ready) == 2
+
+    threads.gate.clear()
+    assert pool.take() in ("thread_1", "thread_2")
+    assert pool.hits == 1 and pool.misses == 0
+    threads.gate.set()
+    pool.wait()
+    assert len(pool.ready) == 2 and pool.in_use == 1
+
+def test_released_threads_are_deleted():
+    """Test that threads handed back are deleted, never handed out again"""
+    threads = Threads()
+    pool = ConversationPool(threads.create, threads.delete, size=1, workers=1)
+    taken = [pool.take(), pool.take()]
+    pool.wait()
+    pool.release(taken)
+    pool.wait()
+    assert sorted(threads.deleted) == sorted(taken)
+    assert pool.in_use == 0
+    assert pool.take() not in taken
+
+    pool.close()
+    assert len(pool.ready) == 0 and len(threads.deleted) == 3
+
+def test_pool_cap():
+    """Test that no more than the cap of threads are out at once, and that handing some back makes room"""
+    threads = Threads()
+    pool = ConversationPool(threads.create, threads.delete, size=2, cap=3, workers=1)
+    taken = [pool.take() for _ in range(3)]
+    pool.wait()
+    assert pool.live() == 3 and len(pool.ready) == 0
+    with pytest.raises(ConversationLimitException):
+        pool.take()
+
+    pool.release(taken[:1])
+    pool.wait()
+    assert len(pool.ready) == 1
+    assert pool.take() == "thread_4"
+
+def test_failed_creates_are_dropped():
+    """Test that a create that raises doesn't count against the cap"""
+    def create():
+        raise RuntimeError("no service")
+    pool = ConversationPool(create, lambda thread_id: None, size=2, cap=2, workers=1)
+    pool.fill()
+    pool.wait()
+    assert pool.live() == 0
+    with pytest.raises(RuntimeError):
+        pool.take()
+    assert pool.live() == 0
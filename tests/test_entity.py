@@ -148,3 +148,88 @@ def test_entity_purge(world, mock_game):
     # Test that the entity was removed from the world
     assert len(world.linked) < initial_entity_count
     assert entity_to_purge.name not in world.linked
+
+def test_world_type_index(world, mock_game):
+    """Test that get_all/get use the world's per-class index, including subclasses"""
+    room = Room("index_room", "Index Room", game=mock_game, world=world, warn=False)
+    door_room = Room("index_room2", "Index Room 2", game=mock_game, world=world, warn=False)
+    door = Door("index_door", room, door_room, game=mock_game, world=world, warn=False)
+    item = Item("index_item", "Index Item", game=mock_game, world=world, warn=False)
+
+    # Results match a full isinstance scan of the world, in the same order
+    for cls in [Entity, Room, Door, Item, World]:
+        expected = {name: e for name, e in world.linked.items() if isinstance(e, cls)}
+        assert list(cls.get_all(world=world).items()) == list(expected.items())
+
+    assert Room.get("index_door", world=world) == door
+    with pytest.raises(NoEntityLinkException):
+        Door.get("index_room", world=world)
+
+    # Popping from the world removes the entity from every class bucket
+    world.pop(item.name)
+    assert item.name not in Entity.get_all(world=world)
+    with pytest.raises(NoEntityLinkException):
+        Item.get(item.name, world=world)
+
+def test_world_type_index_override(world, mock_game):
+    """Test that overriding a world link re-indexes under the new entity's classes"""
+    item = Item("index_override", "An item", game=mock_game, world=world, warn=False)
+    room = Room("index_override", "A room", game=mock_game, player=None, world=None, warn=False)
+    world.link(room, override=True)
+
+    assert Room.get("index_override", world=world) == room
+    assert Entity.get("index_override", world=world) == room
+    assert "index_override" not in Item.get_all(world=world)
+
+def test_entity_walk_depths(world, mock_game):
+    """Test that walk yields each entity once, breadth-first, with its depth"""
+    e1 = create_entity(Entity, world, mock_game)
+    e2 = create_entity(Entity, world, mock_game)
+    e3 = create_entity(Entity, world, mock_game)
+    e1.link(e2)
+    e2.link(e3)
+    e3.link(e1)  # cycle back to the start
+
+    walked = list(e1.walk())
+    assert walked == [(e2.name, e2, 1), (e3.name, e3, 2), (e1.name, e1, 3)]
+    assert [name for name, _, _ in e1.walk(max_levels=2)] == [e2.name, e3.name]
+    assert list(e1.walk(max_levels=0)) == []
+    assert e1.traverse(max_levels=1) == {e2.name: e2}
+
+def test_entity_walk_deep_chain(world, mock_game):
+    """Test that walking a chain deeper than the recursion limit works"""
+    import sys
+    root = previous = create_entity(Entity, world, mock_game)
+    depth = sys.getrecursionlimit() + 100
+    for link in range(depth):
+        entity = Entity(f"chain_{link}", "Chain link", game=mock_game, world=world, warn=False)
+        previous.link(entity)
+        previous = entity
+
+    assert len(root.traverse()) == depth
+
+def test_entity_linked_from(world, mock_game):
+    """Test that link/pop keep the reverse-link index in sync"""
+    e1 = create_entity(Entity, world, mock_game)
+    e2 = create_entity(Entity, world, mock_game)
+
+    e1.link(e2)
+    assert e2.linked_from == {id(world): world, id(e1): e1}
+
+    e1.pop(e2.name)
+    assert e2.linked_from == {id(world): world}
+
+def test_entity_purge_only_touches_referrers(world, mock_game):
+    """Test that purge unlinks an entity from every container that references it"""
+    room1 = Room("purge_room1", "Room 1", game=mock_game, world=world, warn=False)
+    room2 = Room("purge_room2", "Room 2", game=mock_game, world=world, warn=False)
+    item = Item("purge_item", "Item", game=mock_game, world=world, warn=False)
+    room1.add_item(item)
+    room2.add_item(item)
+
+    assert world.purge(item.name) == True
+    assert item.name not in room1.linked
+    assert item.name not in room2.linked
+    assert item.name not in world.linked
+    assert item.linked_from == {}
+    assert world.purge(item.name) == False
@@ -1,7 +1,7 @@
 import pytest
 from adventure import *
 from helpers import *
-from entities import Entity, Room, Item, World, NoEntityLinkException, Door
+from entities import Entity, Room, Item, World, NoEntityLinkException, Door, HiddenDoor
 from items import Money, Wearable, Useable, Eatable, Computer, Phone, Weapon
 from characters import Character
 
@@ -443,3 +443,62 @@ def test_door_other_room(world, mock_game, player):
     rooms = door.get_rooms()
     assert room1.name in rooms
     assert room2.name in rooms
+
+def test_room_get_actions_cached(world, mock_game, player):
+    """Test that get_actions is cached until the room, its items or the inventory change"""
+    room = Room("test_room_cached", "Test Room", game=mock_game, world=world, player=player, warn=False)
+    player.go(room, check_link=False)
+    item = Item("test_item_cached", "Test Item", game=mock_game, world=world, player=player, warn=False)
+    room.add_item(item)
+
+    actions = room.get_actions()
+    assert room.get_actions() is actions
+    assert item in actions["take"]
+
+    # Changing the actions of an item in the room invalidates the cache
+    item.add_action("poke", lambda: True)
+    actions = room.get_actions()
+    assert item in actions["poke"]
+
+    # Taking the item moves it to the inventory; its new "drop" action shows up
+    item.take(look=False)
+    actions = room.get_actions()
+    assert "take" not in actions
+    assert item in actions["drop"]
+
+    # Purging the item reaches the inventory too
+    world.purge(item.name)
+    assert item.name not in player.inv_items
+    assert "drop" not in room.get_actions()
+
+def test_hidden_door_condition_memoized(world, mock_game, player):
+    """Test that a hidden door's condition is evaluated once until the state it reads changes"""
+    room1 = Room("test_hidden_room1", "Test Room 1", game=mock_game, world=world, player=player, warn=False)
+    room2 = Room("test_hidden_room2", "Test Room 2", game=mock_game, world=world, player=player, warn=False)
+    player.go(room1, check_link=False)
+    key = Item("test_hidden_key", "Test Key", game=mock_game, world=world, player=player, warn=False)
+    room1.add_item(key)
+
+    calls = []
+    def condition(var=None):
+        calls.append(var)
+        return "test_hidden_key" in player.inv_items
+
+    door = HiddenDoor("test_hidden_door", room1, room2, condition, locked=False, game=mock_game, world=world, player=player, warn=False)
+
+    assert door.name not in room1.get_rooms()
+    assert door.name not in room1.get_doors()
+    assert player.in_rooms(door) == False
+    assert len(calls) == 1
+
+    # Changing the inventory invalidates the memoized result
+    key.take(look=False)
+    assert door.name in room1.get_rooms()
+    assert door.name in room1.get_doors()
+    assert len(calls) == 2
+
+    # Volatile conditions are evaluated every time
+    door.volatile = True
+    door.condition()
+    door.condition()
+    assert len(calls) == 4
@@ -0,0 +1,97 @@
+import os
+import pytest
+from adventure import Adventure
+from helpers import *
+from entities import Room, Item, Door
+from journal import Journal
+
+@pytest.fixture
+def journal(tmp_path):
+    """Fixture to provide a journal in a temporary directory"""
+    return Journal(str(tmp_path / "journal"))
+
+@pytest.fixture
+def game(fixture_world_file, journal):
+    """Fixture to provide a journaled game on the bundled test world"""
+    game = Adventure(file=fixture_world_file, output=CaptureOutput())
+    journal.attach("session", game)
+    return game
+
+def play(game):
+    Item.get("test_item1", world=game.world).take()
+    Item.get("test_money", world=game.world).take()
+    game.player.spend(2.5)
+    door = Door.get("test_door", world=game.world)
+    door.unlock()
+    door.go()
+    game.player.take_damage(1)
+    Item.get("test_eatable", world=game.world).take()
+    Item.get("test_eatable", world=game.world).use()
+
+def revive(game, journal):
+    other = game.spawn(output=CaptureOutput())
+    assert journal.replay("session", other)
+    return other
+
+def assert_played(game):
+    assert list(game.player.inv_items) == ["test_item1"]
+    assert game.player.money == 7.5
+    assert game.player.health == 2
+    assert game.player.current_room is Room.get("test_room3", world=game.world)
+    assert Door.get("test_door", world=game.world).locked == False
+    assert "test_eatable" not in game.world.linked
+
+def test_replay(game, journal):
+    """Test that a journaled game comes back from its journal alone"""
+    play(game)
+    journal.flush()
+    assert not os.path.exists(journal.path("session", "snapshot"))
+    assert_played(revive(game, journal))
+
+def test_compaction(game, journal):
+    """Test that compacted journals come back too, and start over after the snapshot"""
+    journal.compact_every = 3
+    play(game)
+    journal.flush()
+    assert os.path.exists(journal.path("session", "snapshot"))
+    assert len(list(journal.read("session"))) < 3
+    other = revive(game, journal)
+    assert_played(other)
+
+    # The revived game keeps journaling where the first left off
+    Item.get("test_item1", world=other.world).drop()
+    journal.flush()
+    assert "test_item1" not in revive(other, journal).player.inv_items
+
+def test_torn_record_ignored(game, journal):
+    """Test that a record cut short by a crash is skipped"""
+    play(game)
+    journal.flush()
+    with open(journal.path("session", "journal"), "ab") as stream:
+        stream.write(b"\xff\x00\x00\x00partial")
+    assert_played(revive(game, journal))
+
+def test_replay_on_changed_world(game, journal, tmp_path):
+    """Test that a journal of another world file is discarded"""
+    play(game)
+    game.journal.compact()
+    journal.flush()
+    other_file = tmp_path / "other.yaml"
+    other_file.write_text(open(game.file).read() + "\n# changed\n")
+    other = Adventure(file=str(other_file), output=CaptureOutput())
+    assert not journal.replay("session", other)
+    journal.flush()
+    assert journal.sessions() == []
+
+def test_compaction_off_the_request_path(game, journal, monkeypatch):
+    """Test that a script's compaction is snapshotted by the writer, not by the caller"""
+    import snapshot, threading
+    callers = []
+    save = snapshot.save
+    monkeypatch.setattr(snapshot, "save", lambda game: callers.append(threading.get_ident()) or save(game))
+    Item.get("test_item1", world=game.world).take()
+    game.player.record('script')
+    assert journal.flush(timeout=10)
+    assert callers and threading.get_ident() not in callers
+    assert os.path.exists(journal.path("session", "snapshot"))
+    assert "test_item1" in revive(game, journal).player.inv_items
@@ -0,0 +1,91 @@
+import threading, time
+from helpers import *
+from news import News
+
+class Subscriber:
+    """A subscriber that records its notifications, and can be held back"""
+    def __init__(self, name):
+        self.name = name
+        self.heard = []
+        self.entered = threading.Event()  # Set once a delivery to it is under way
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def notify_news(self, news):
+        self.entered.set()
+        self.gate.wait(10)
+        self.heard.append(news)
+        return True
+
+def test_publish_doesnt_wait_for_subscribers():
+    """Test that publish returns while a subscriber is still busy, and that flush waits for it"""
+    news = News()
+    slow = Subscriber("slow")
+    slow.gate.clear()
+    news.subscribe(slow)
+    start = time.monotonic()
+    news.publish("The bridge is out")
+    assert time.monotonic() - start < 0.5
+    assert not news.flush(timeout=0.05)
+    slow.gate.set()
+    assert news.flush(timeout=10)
+    assert slow.heard == ["The bridge is out"]
+
+def test_bulletins_coalesced_per_subscriber():
+    """Test that bulletins published while a subscriber is busy reach it as one notification, in order"""
+    news = News()
+    first, second = Subscriber("first"), Subscriber("second")
+    news.subscribe(first)
+    news.subscribe(second)
+    first.gate.clear()
+    news.publish("one")
+    # Wait until the first delivery is under way
+    assert first.entered.wait(10)
+    news.publish("two")
+    news.publish("three")
+    first.gate.set()
+    assert news.flush(timeout=10)
+    assert first.heard == ["one", "two\nthree"]
+    assert "\n".join(second.heard).split("\n") == ["one", "two", "three"]
+
+def test_history_bounded():
+    """Test that only the last bulletins are kept, while the version counts them all"""
+    news = News(history=3, background=False)
+    subscriber = Subscriber("subscriber")
+    news.subscribe(subscriber)
+    for i in range(5):
+        news.publish(f"bulletin {i}")
+    assert list(news.bulletins) == ["bulletin 2", "bulletin 3", "bulletin 4"]
+    assert news.version == 5
+    assert len(subscriber.heard) == 5
+
+def test_unsubscribed_gets_nothing_more():
+    """Test that bulletins waiting for a subscriber are dropped when it unsubscribes"""
+    news = News()
+    busy, gone = Subscriber("busy"), Subscriber("gone")
+    busy.gate.clear()
+    news.subscribe(busy)
+    news.publish("one")
+    assert busy.entered.wait(10)
+    news.subscribe(gone)
+    news.publish("two")
+    news.unsubscribe(gone)
+    busy.gate.set()
+    assert news.flush(timeout=10)
+    assert gone.heard == []
+    assert busy.heard == ["one", "two"]
+
+def test_slow_game_doesnt_hold_up_another():
+    """Test that a subscriber busy with one game's news doesn't hold up another game's"""
+    stuck, quick = News(), News()
+    slow, other = Subscriber("slow"), Subscriber("other")
+    slow.gate.clear()
+    stuck.subscribe(slow)
+    quick.subscribe(other)
+    stuck.publish("The bridge is out")
+    assert slow.entered.wait(10)
+    quick.publish("The mine is open")
+    assert quick.flush(timeout=10)
+    assert other.heard == ["The mine is open"]
+    slow.gate.set()
+    assert stuck.flush(timeout=10)
@@ -0,0 +1,64 @@
+import pytest
+from adventure import Adventure
+from helpers import *
+from entities import Room, Item, Door, HiddenDoor
+from pathfinding import RoomGraph
+
+@pytest.fixture
+def game(fixture_world_file):
+    """Fixture to provide a game on the bundled test world"""
+    return Adventure(file=fixture_world_file, output=CaptureOutput())
+
+def room(game, name):
+    return Room.get(name, world=game.world)
+
+def test_path_around_locked_door(game):
+    """Test that locked doors are routed around, and used once unlocked"""
+    graph = RoomGraph(game.world)
+    start = room(game, "test_room1")
+
+    assert graph.path(start, room(game, "test_room3")) == [room(game, "test_room2"), room(game, "test_room3")]
+
+    Door.get("test_door", world=game.world).locked = False
+    assert graph.path(start, room(game, "test_room3")) == [room(game, "test_room3")]
+    assert graph.distance(start, room(game, "test_room2")) == 1
+
+def test_path_hidden_door(game):
+    """Test that hidden doors are only passable while their condition holds"""
+    graph = RoomGraph(game.world)
+    start, hidden = room(game, "test_room1"), room(game, "test_room4")
+
+    assert graph.path(start, hidden) is None
+    Item.get("test_mushroom", world=game.world).use()
+    assert [r.name for r in graph.path(start, hidden)] == ["test_room2", "test_room3", "test_room4"]
+
+def test_path_to_self(game):
+    """Test that a room is zero moves away from itself"""
+    graph = RoomGraph(game.world)
+    assert graph.path(room(game, "test_room1"), room(game, "test_room1")) == []
+
+def test_graph_picks_up_new_rooms(game):
+    """Test that rooms added after the first query are routed to"""
+    graph = RoomGraph(game.world)
+    assert graph.distance(room(game, "test_room1"), room(game, "test_room3")) == 2
+
+    Room("test_room5", "A test room 5", game=game, world=game.world, player=game.player, links=["test_room3"])
+    assert graph.distance(room(game, "test_room1"), room(game, "test_room5")) == 3
+
+def test_adventure_travel(game):
+    """Test that travel moves the player along the whole route in one call"""
+    path = game.travel("test_room3")
+    assert [r.name for r in path] == ["test_room2", "test_room3"]
+    assert game.player.current_room.name == "test_room3"
+    assert game.player.name in room(game, "test_room3").linked
+    assert game.player.name not in room(game, "test_room1").linked
+    assert game.player.name not in room(game, "test_room2").linked
+    assert game.output.contains("A test room 3")
+
+def test_adventure_travel_no_route(game):
+    """Test travelling to unreachable or unknown rooms"""
+    assert game.travel("test_room4") is None
+    assert game.output.contains("can't get to test_room4")
+    assert game.travel("nowhere") is None
+    assert game.output.contains("no such place")
+    assert game.player.current_room.name == "test_room1"
@@ -0,0 +1,53 @@
+import threading
+import pytest
+from helpers import *
+from pool import GamePool
+
+class Builds:
+    """A build function for GamePool that counts its games, and can be held back"""
+    def __init__(self):
+        self.count = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self):
+        self.gate.wait()
+        self.count += 1
+        return self.count
+
+def test_pool_fills_and_refills():
+    """Test that the pool builds its games ahead of time and tops up after a take"""
+    build = Builds()
+    pool = GamePool(build, size=3, workers=2)
+    pool.fill()
+    pool.wait()
+    assert len(pool.ready) == 3
+
+    game = pool.take()
+    assert game in (1, 2, 3)
+    assert pool.hits == 1
+    pool.wait()
+    assert len(pool.ready) == 3
+    assert build.count == 4
+
+def test_empty_pool_builds_inline():
+    """Test that a take with nothing ready builds a game on the spot"""
+    build = Builds()
+    build.gate.clear()
+    pool = GamePool(build, size=2, workers=1)
+    pool.fill()
+    build.gate.set()
+    assert pool.take() in (1, 2, 3)
+
+    unpooled = GamePool(build, size=0)
+    assert unpooled.take() > 0
+    assert unpooled.misses == 1 and len(unpooled.ready) == 0
+
+def test_failed_builds_are_dropped():
+    """Test that a build that raises doesn't leave the pool stuck"""
+    def build():
+        raise RuntimeError("no service")
+    pool = GamePool(build, size=2, workers=1)
+    pool.fill()
+    pool.wait()
+    assert len(pool.ready) == 0 and pool.building == 0
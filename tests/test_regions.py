@@ -0,0 +1,138 @@
+import pytest
+import yaml
+from adventure import Adventure
+from helpers import *
+from entities import Room, Item, Door
+
+def region(name, neighbors, doors=(), items=()):
+    """Spec of a region with two rooms, name_a and name_b, whose b room links on to the next region"""
+    rooms = [
+        {'name': f"{name}_a", 'description': f"Room a of {name}", 'links': [f"{name}_b"] + [f"{n}_b" for n in neighbors if n < name], 'items': list(items)},
+        {'name': f"{name}_b", 'description': f"Room b of {name}", 'links': [f"{name}_a"] + [f"{n}_a" for n in neighbors if n > name]},
+    ]
+    return {'neighbors': list(neighbors), 'rooms': rooms, 'doors': list(doors)}
+
+def regions():
+    """Specs of four regions in a line, r1 - r2 - r3 - r4"""
+    return {
+        'r1': region('r1', ['r2'], items=[{'name': 'lamp', 'type': 'Item', 'description': 'A lamp', 'takeable': True}]),
+        'r2': region('r2', ['r1', 'r3'], doors=[{'name': 'gate', 'room1': 'r2_b', 'room2': 'r3_a', 'locked': True}]),
+        'r3': region('r3', ['r2', 'r4']),
+        'r4': region('r4', ['r3']),
+    }
+
+def write_world(tmp_path, specs):
+    (tmp_path / "regions").mkdir()
+    for name, spec in specs.items():
+        (tmp_path / "regions" / f"{name}.yaml").write_text(yaml.safe_dump(spec))
+    main = {'regions': {name: f"regions/{name}.yaml" for name in specs}, 'start_region': 'r1'}
+    (tmp_path / "world.yaml").write_text(yaml.safe_dump(main))
+    return str(tmp_path / "world.yaml")
+
+@pytest.fixture
+def region_world(tmp_path):
+    return write_world(tmp_path, regions())
+
+@pytest.fixture
+def game(region_world):
+    return Adventure(file=region_world, output=CaptureOutput())
+
+def rooms(game):
+    return sorted(Room.get_all(world=game.world))
+
+def walk(game, *names):
+    for name in names:
+        Room.get(name, world=game.world).go()
+
+def test_start_region_and_neighbors_loaded(game):
+    """Test that only the start region and its neighbours are built"""
+    assert game.player.current_room.name == "r1_a"
+    assert set(game.world.regions.loaded) == {'r1', 'r2'}
+    assert "r3_a" not in game.world.linked
+    assert [door['name'] for door in game.world.regions.pending] == ["gate"]
+
+def test_regions_stream_in_and_out(game):
+    """Test that walking on loads regions ahead and evicts the ones left behind"""
+    walk(game, "r1_b", "r2_a")
+    assert set(game.world.regions.loaded) == {'r1', 'r2', 'r3'}
+    assert Door.get("gate", world=game.world).locked
+
+    Door.get("gate", world=game.world).locked = False
+    walk(game, "r2_b")
+    Door.get("gate", world=game.world).go()
+    assert game.player.current_room.name == "r3_a"
+    assert set(game.world.regions.loaded) == {'r2', 'r3', 'r4'}
+    assert "r1_a" not in game.world.linked and "lamp" not in game.world.linked
+
+def test_evicted_state_survives_reload(game):
+    """Test that changes to an evicted region are there when it is built again"""
+    lamp = Item.get("lamp", world=game.world)
+    lamp.description = "A dented lamp"
+    walk(game, "r1_b", "r2_a", "r2_b")
+    Door.get("gate", world=game.world).locked = False
+    Door.get("gate", world=game.world).go()
+    walk(game, "r3_b", "r4_a")
+    assert set(game.world.regions.loaded) == {'r3', 'r4'}
+    assert "gate" not in game.world.linked
+
+    walk(game, "r3_b", "r3_a")
+    assert Door.get("gate", world=game.world).locked == False
+    Door.get("gate", world=game.world).go()
+    walk(game, "r2_a", "r1_b")
+    assert Item.get("lamp", world=game.world).description == "A dented lamp"
+    assert "lamp" in Room.get("r1_a", world=game.world).linked
+
+def test_evicted_room_state_survives_reload(game):
+    """Test that changes to a room are there when its region is built again"""
+    Room.get("r1_a", world=game.world).description = "A scorched room"
+    walk(game, "r1_b", "r2_a", "r2_b")
+    Door.get("gate", world=game.world).locked = False
+    Door.get("gate", world=game.world).go()
+    assert 'r1' not in game.world.regions.loaded
+
+    Door.get("gate", world=game.world).go()
+    walk(game, "r2_a")
+    assert Room.get("r1_a", world=game.world).description == "A scorched room"
+    assert "r1_b" in Room.get("r1_a", world=game.world).linked
+
+def test_links_declared_on_one_side(tmp_path):
+    """Test that a link between regions declared by only one of its rooms is made both ways, and again after a reload"""
+    specs = regions()
+    specs['r2']['rooms'][0]['links'].remove("r1_b")  # only r1_b, loaded first, declares r1_b - r2_a
+    specs['r2']['rooms'][1]['links'].remove("r3_a")  # only r3_a, loaded last, declares r2_b - r3_a
+    specs['r2']['doors'] = []
+    game = Adventure(file=write_world(tmp_path, specs), output=CaptureOutput())
+
+    def linked(room, other):
+        return other in Room.get(room, world=game.world).linked and room in Room.get(other, world=game.world).linked
+
+    walk(game, "r1_b", "r2_a")
+    assert linked("r1_b", "r2_a") and linked("r2_b", "r3_a")
+    walk(game, "r2_b", "r3_a", "r3_b")
+    assert set(game.world.regions.loaded) == {'r2', 'r3', 'r4'}
+    walk(game, "r4_a", "r4_b")
+    assert set(game.world.regions.loaded) == {'r3', 'r4'}
+
+    walk(game, "r3_b", "r3_a", "r2_b", "r2_a")
+    assert set(game.world.regions.loaded) == {'r1', 'r2', 'r3'}
+    assert linked("r1_b", "r2_a") and linked("r2_b", "r3_a")
+
+def test_region_with_watcher_is_kept(game):
+    """Test that a region isn't evicted while something following the player is in it"""
+    follower = NonPlayerCharacter("follower", "Follows you", game=game, world=game.world, player=game.player)
+    follower.go(Room.get("r1_a", world=game.world))
+    game.player.register_watcher(follower)
+    walk(game, "r1_b", "r2_a", "r2_b")
+    Door.get("gate", world=game.world).locked = False
+    Door.get("gate", world=game.world).go()
+    assert 'r1' in game.world.regions.loaded
+
+def test_travel_into_swapped_region(game):
+    """Test that travel finds rooms of a region loaded in place of an evicted one of the same size"""
+    walk(game, "r1_b", "r2_a")
+    Door.get("gate", world=game.world).locked = False
+    game.travel("r2_b")
+    Door.get("gate", world=game.world).go()
+    assert set(game.world.regions.loaded) == {'r2', 'r3', 'r4'}
+    assert [room.name for room in game.travel("r4_b")] == ["r3_b", "r4_a", "r4_b"]
+    assert game.player.current_room.name == "r4_b"
@@ -0,0 +1,279 @@
+import json, os, random, sys, tempfile, threading
+import pytest
+from helpers import *
+
+# The server reads its settings when it is imported
+os.environ["WORLD_FILE"] = FIXTURE_WORLD
+os.environ["JOURNAL_DIR"] = tempfile.mkdtemp()
+import server
+import gamestate
+from sessions import SessionManager
+from characters import AICharacter
+from store import SQLiteStore
+
+class Clock:
+    """A clock for SessionManager that only moves when told to"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fixture to swap the server's sessions for ones on a fake clock, capped at 3"""
+    clock = Clock()
+    monkeypatch.setattr(server, "games", SessionManager(server.session_game, ttl=60, max_sessions=3, journal=server.journal,
+                                                        on_evict=server.drop_logs, clock=clock, release=server.release_threads))
+    return clock
+
+@pytest.fixture
+def client(clock):
+    """Fixture to provide a test client with its own session"""
+    return server.app.test_client()
+
+def test_state(client):
+    """Test that a new session gets a game in the first room"""
+    state = client.get("/state").get_json()
+    assert state["location"] == "test_room1"
+    assert "test_item1" in state["items"]
+
+def test_state_etag(client):
+    """Test that /state is tagged with its version, and that an unchanged state is a 304"""
+    response = client.get("/state")
+    version = response.get_json()["version"]
+    assert response.headers["ETag"] == f'"{version}"'
+    assert client.get("/state", headers={"If-None-Match": f'"{version}"'}).status_code == 304
+
+    client.post("/action", json={"action": "take", "item": "test_item1"})
+    response = client.get("/state", headers={"If-None-Match": f'"{version}"'})
+    assert response.status_code == 200
+    assert gamestate.number(response.get_json()["version"]) > gamestate.number(version)
+
+def test_state_since(client):
+    """Test that ?since= returns only the fields that changed, and the full state for unknown versions"""
+    version = client.get("/state").get_json()["version"]
+    assert client.get(f"/state?since={version}").get_json() == {"version": version, "since": version}
+
+    client.post("/action", json={"action": "take", "item": "test_item1"})
+    delta = client.get(f"/state?since={version}").get_json()
+    assert delta["since"] == version and gamestate.number(delta["version"]) > gamestate.number(version)
+    assert "test_item1" in delta["inventory"]
+    assert "location" not in delta
+
+    state = client.get("/state?since=1").get_json()
+    assert "since" not in state
+    assert state["location"] == "test_room1"
+
+def test_state_versions_per_process(client, monkeypatch):
+    """Test that a version handed out by another worker, even with the same number, is unknown here"""
+    version = client.get("/state").get_json()["version"]
+    foreign = f"{gamestate.number(version)}-{'0' * 16}"
+    assert client.get("/state", headers={"If-None-Match": f'"{foreign}"'}).status_code == 200
+    assert "since" not in client.get(f"/state?since={foreign}").get_json()
+    # A worker forked from this one tags its versions differently
+    monkeypatch.setattr(gamestate, "process", gamestate.process)
+    gamestate.tag_process()
+    assert gamestate.number(version) is None
+
+def test_move_state_version(client):
+    """Test that /move returns the versioned state it moved to"""
+    version = client.get("/state").get_json()["version"]
+    new_state = client.post("/move", json={"room": "test_room2"}).get_json()["new_state"]
+    assert new_state["location"] == "test_room2"
+    assert gamestate.number(new_state["version"]) > gamestate.number(version)
+    assert client.get("/state").get_json() == new_state
+
+def test_batch(client):
+    """Test that /batch runs its operations in order and returns their results, the logs and the final state"""
+    response = client.post("/batch", json={"operations": [
+        {"op": "action", "action": "take", "item": "test_item1"},
+        {"op": "move", "room": "test_room2"},
+        {"op": "fly", "room": "test_room3"},
+        {"op": "move", "room": "test_room3"},
+    ]}).get_json()
+    assert [result["status"] for result in response["results"]] == [200, 200, 400, 200]
+    assert response["results"][0]["message"] == "You took test_item1."
+    assert "You took test_item1.\n\n" in response["logs"]
+    assert response["state"]["location"] == "test_room3"
+    assert "test_item1" in response["state"]["inventory"]
+    assert client.get("/logs").get_json()["logs"] == []
+
+def test_batch_stop_on_error(client):
+    """Test that a batch stops at its first failed operation when asked to, and rejects malformed batches"""
+    response = client.post("/batch", json={"stop_on_error": True, "operations": [
+        {"op": "move", "room": "nowhere"},
+        {"op": "move", "room": "test_room2"},
+    ]}).get_json()
+    assert len(response["results"]) == 1
+    assert response["results"][0]["error"] == "No such room: nowhere"
+    assert response["state"]["location"] == "test_room1"
+
+    assert client.post("/batch", json={"operations": "move"}).status_code == 400
+    assert client.post("/batch", json={"operations": [{"op": "move"}] * (server.BATCH_LIMIT + 1)}).status_code == 400
+
+def test_concurrent_requests(client):
+    """Test that thousands of interleaved requests of one session leave its world consistent"""
+    client.get("/state")
+    cookie = client.get_cookie("session").value
+    operations = [
+        ("post", "/move", {"room": "test_room1"}),
+        ("post", "/move", {"room": "test_room2"}),
+        ("post", "/move", {"room": "test_room3"}),
+        ("post", "/action", {"action": "take", "item": "test_item1"}),
+        ("post", "/action", {"action": "take", "item": "test_item2"}),
+        ("post", "/action", {"action": "drop", "item": "test_item1"}),
+        ("post", "/action", {"action": "drop", "item": "test_item2"}),
+        ("post", "/batch", {"operations": [{"op": "move", "room": "test_room2"}, {"op": "action", "action": "take", "item": "test_item2"}]}),
+        ("get", "/state", None),
+        ("get", "/logs", None),
+    ]
+    failures = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        worker_client = server.app.test_client()
+        worker_client.set_cookie("session", cookie)
+        for _ in range(250):
+            method, path, body = rng.choice(operations)
+            response = getattr(worker_client, method)(path, json=body)
+            if response.status_code >= 500:
+                failures.append((path, body, response.status_code))
+
+    # Switch threads as often as possible, the way gevent switches greenlets at every wait
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert failures == []
+
+    with client.session_transaction() as session:
+        game = server.games[session["game_id"]]
+    player = game.player
+    rooms = [room for room in game.world.linked.values() if isinstance(room, server.Room) and not isinstance(room, server.HiddenDoor)]
+    assert [room for room in rooms if player.name in room.linked] == [player.current_room]
+    for name in ("test_item1", "test_item2"):
+        holders = [room for room in rooms if name in room.linked] + ([player.inv_items] if name in player.inv_items else [])
+        assert len(holders) == 1
+        item = game.world.linked[name]
+        assert ("drop" in item.actions) == (name in player.inv_items)
+    for entity in game.world.linked.values():
+        for linked in entity.linked.values():
+            assert linked.linked_from.get(id(entity)) is entity
+        for container in entity.linked_from.values():
+            assert container is player.inv_items or container.linked.get(entity.name) is entity
+
+def test_shared_store(client, monkeypatch, tmp_path):
+    """Test that with a shared store, requests of a session can go to any worker"""
+    store = SQLiteStore(str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(server, "store", store)
+    workers = [SessionManager(server.session_game, on_evict=server.drop_logs, store=store) for _ in range(2)]
+
+    monkeypatch.setattr(server, "games", workers[0])
+    client.post("/action", json={"action": "take", "item": "test_item1"})
+    monkeypatch.setattr(server, "games", workers[1])
+    state = client.post("/move", json={"room": "test_room2"}).get_json()["new_state"]
+    assert "test_item1" in state["inventory"]
+    monkeypatch.setattr(server, "games", workers[0])
+    assert client.get("/state").get_json()["location"] == "test_room2"
+    assert "You took test_item1.\n\n" in client.get("/logs").get_json()["logs"]
+
+def test_lru_cap(clock):
+    """Test that sessions beyond the cap are evicted, least recently used first"""
+    clients = [server.app.test_client() for _ in range(4)]
+    for client in clients:
+        client.get("/state")
+        clock.now += 1
+    assert len(server.games) == 3
+
+def test_idle_session_revived(client, clock):
+    """Test that a session evicted for being idle comes back from the journal on its next request"""
+    client.post("/action", json={"action": "take", "item": "test_item1"})
+    clock.now += 61
+    server.games.expire()
+    assert len(server.games) == 0
+    assert server.games.evictions == 1
+
+    state = client.get("/state").get_json()
+    assert "test_item1" in state["inventory"]
+    assert server.games.revivals == 1
+
+def test_session_stats(client, monkeypatch):
+    """Test the admin report, and that it needs the token, and is off without one"""
+    client.get("/state")
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+    stats = client.get("/admin/sessions", headers={"X-Admin-Token": "secret"}).get_json()
+    assert stats["sessions"] == 1
+    assert stats["bytes"] > 0
+    assert len(stats["per_session"]) == 1
+    assert client.get("/admin/sessions").status_code == 403
+    assert client.get("/admin/sessions", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+    monkeypatch.setattr(server, "ADMIN_TOKEN", None)
+    assert client.get("/admin/sessions").status_code == 403
+
+def test_log_limit(client, monkeypatch):
+    """Test that log buffers are capped"""
+    monkeypatch.setattr(server, "LOG_LIMIT", 5)
+    client.get("/state")
+    for _ in range(10):
+        client.post("/action", json={"action": "look", "item": "test_item1"})
+    assert len(client.get("/logs").get_json()["logs"]) == 5
+
+def test_events_stream(client, monkeypatch):
+    """Test that /events pushes log lines as they are written, with keepalives in between"""
+    monkeypatch.setattr(server, "EVENTS_KEEPALIVE", 0.01)
+    assert client.post("/action", json={"action": "look", "item": "test_item1"}).status_code == 200
+    response = client.get("/events")
+    assert response.mimetype == "text/event-stream"
+    stream = iter(response.response)
+    assert next(stream).startswith(b"retry: ")
+    first = next(stream).decode()
+    assert first.startswith("data: ") and "TEST_ITEM1" in first
+    assert next(stream) == b": keepalive\n\n"
+    assert client.get("/logs").get_json()["logs"] == []
+    response.close()
+
+def test_events_end_with_session(client):
+    """Test that a session's streams end when it is evicted"""
+    response = client.get("/events")
+    stream = iter(response.response)
+    next(stream)
+    server.games.evict(next(iter(server.games)))
+    assert list(stream) == []
+
+def test_talk_stream(client, openai_client):
+    """Test that /talk/stream sends each part of the reply as its own typed event"""
+    openai_client.chunks = ["Hello ", "there.", [{"mood": "happy"}]]
+    client.get("/state")
+    game = next(iter(server.games.games.values()))
+    AICharacter("test_ai", "A test AI", game=game, world=game.world, player=game.player, func=lambda obj: None)
+
+    response = client.post("/talk/stream", json={"talking_to": "test_ai", "message": "hi"})
+    assert response.mimetype == "application/x-ndjson"
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert events == [
+        {"type": "text", "text": "Hello "},
+        {"type": "text", "text": "there."},
+        {"type": "json", "data": {"mood": "happy"}},
+        {"type": "end", "bye": True},
+    ]
+    assert client.post("/talk/stream", json={"talking_to": "nobody", "message": "hi"}).status_code == 404
+
+def test_evicted_session_releases_threads(client, clock, openai_client):
+    """Test that the conversation threads of an evicted session are handed back, and a revived session starts new ones"""
+    client.get("/state")
+    game = next(iter(server.games.games.values()))
+    character = AICharacter("test_ai", "A test AI", game=game, world=game.world, player=game.player, func=lambda obj: None)
+    assert character.thread_id == "mock_thread_1"
+
+    clock.now += 61
+    client.get("/state")
+    assert openai_client.of("release") == [("release", "mock_thread_1")]
+    assert character.thread is None
@@ -0,0 +1,150 @@
+import threading, time
+from sessions import FairLock, SessionManager
+
+def test_fair_lock_order():
+    """Test that a FairLock is handed out in the order it was asked for"""
+    lock = FairLock()
+    order = []
+
+    def worker(i):
+        with lock:
+            order.append(i)
+
+    lock.acquire()
+    threads = []
+    for i in range(5):
+        thread = threading.Thread(target=worker, args=(i,))
+        thread.start()
+        threads.append(thread)
+        # Wait until the thread is in line before starting the next one
+        while lock.tickets < i + 2:
+            time.sleep(0.001)
+    lock.release()
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2, 3, 4]
+
+def test_fair_lock_waiter_killed():
+    """Test that a waiter killed in line, or just as its turn comes, doesn't hold up the ones after it"""
+    class Killed(Exception):
+        pass
+
+    lock = FairLock()
+    doomed = threading.local()
+    wait_for = lock.condition.wait_for
+    def wait_or_die(predicate, timeout=None):
+        if getattr(doomed, "waiter", False):
+            # A while in line, then killed, the way a gevent Timeout would
+            wait_for(predicate, 0.05)
+            raise Killed()
+        return wait_for(predicate, timeout)
+    lock.condition.wait_for = wait_or_die
+
+    def run(target):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(target()), daemon=True)
+        thread.start()
+        thread.join(10)
+        assert not thread.is_alive()
+        return results
+
+    def doomed_waiter():
+        doomed.waiter = True
+        try:
+            lock.acquire()
+        except Killed:
+            return "killed"
+
+    def waiter():
+        with lock:
+            return "served"
+
+    # Killed while someone holds the lock
+    lock.acquire()
+    assert run(doomed_waiter) == ["killed"]
+    lock.release()
+    assert run(waiter) == ["served"]
+    # Killed just as its turn came
+    assert run(doomed_waiter) == ["killed"]
+    assert run(waiter) == ["served"]
+    assert lock.abandoned == set()
+
+def test_fair_lock_reentrant():
+    """Test that the holder of a FairLock can take it again, and that only the holder can release it"""
+    lock = FairLock()
+    with lock:
+        with lock:
+            assert lock.depth == 2
+        errors = []
+        def release():
+            try:
+                lock.release()
+            except RuntimeError as exc:
+                errors.append(exc)
+        thread = threading.Thread(target=release)
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+    assert lock.owner is None
+    assert lock.acquire(), lock.release() is None
+
+def test_revival_doesnt_hold_up_other_sessions():
+    """Test that a session waiting on the journal to be revived doesn't keep other sessions waiting"""
+    class SlowJournal:
+        """A journal whose flush waits until released, with no sessions on disk"""
+        def __init__(self):
+            self.flushing = threading.Event()
+            self.release = threading.Event()
+
+        def flush(self):
+            self.flushing.set()
+            self.release.wait(10)
+
+        def has(self, session_id):
+            return False
+
+    journal = SlowJournal()
+    games = SessionManager(lambda session_id: object(), journal=journal)
+    games["here"] = game = object()
+    errors = []
+    def lookup():
+        try:
+            games["gone"]
+        except KeyError as exc:
+            errors.append(exc)
+    thread = threading.Thread(target=lookup)
+    thread.start()
+    try:
+        assert journal.flushing.wait(10)
+        assert games["here"] is game
+    finally:
+        journal.release.set()
+        thread.join()
+    assert len(errors) == 1
+
+def test_sessions_in_use_not_evicted():
+    """Test that a session checked out by a request is passed over for eviction, past the cap or the TTL"""
+    now = [0.0]
+    games = SessionManager(lambda session_id: object(), ttl=60, max_sessions=2, clock=lambda: now[0])
+    games["a"] = a = object()
+    checked_out, done = threading.Event(), threading.Event()
+    def request():
+        with games.checkout("a"):
+            checked_out.set()
+            done.wait(10)
+    thread = threading.Thread(target=request, daemon=True)
+    thread.start()
+    try:
+        assert checked_out.wait(10)
+        games["b"] = object()
+        games["c"] = object()
+        assert list(games) == ["a", "c"]
+        now[0] += 61
+        games.expire()
+        assert list(games) == ["a"]
+    finally:
+        done.set()
+        thread.join(10)
+    now[0] += 61
+    games.expire()
+    assert "a" not in games
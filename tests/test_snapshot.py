@@ -0,0 +1,85 @@
+import marshal
+import pytest
+import snapshot
+from adventure import Adventure
+from helpers import *
+from entities import Room, Item, Door
+
+@pytest.fixture
+def game(fixture_world_file):
+    """Fixture to provide a game on the bundled test world"""
+    return Adventure(file=fixture_world_file, output=CaptureOutput())
+
+def test_fresh_game_snapshot_is_small(game):
+    """Test that an unchanged game only stores the header and an empty delta"""
+    data = snapshot.save(game)
+    assert data.startswith(snapshot.MAGIC)
+    assert len(data) < 100
+
+def test_snapshot_round_trip(game):
+    """Test that inventory, money, locks, eaten items and the player's state come back"""
+    Item.get("test_item1", world=game.world).take()
+    Item.get("test_money", world=game.world).take()
+    door = Door.get("test_door", world=game.world)
+    door.unlock()
+    door.go()
+    Item.get("test_mushroom", world=game.world).use()
+    game.player.take_damage(1)
+    data = snapshot.save(game)
+
+    other = game.spawn(output=CaptureOutput())
+    snapshot.load(other, data)
+    assert list(other.player.inv_items) == ["test_item1"]
+    assert other.player.inv_items["test_item1"] is Item.get("test_item1", world=other.world)
+    assert other.player.money == 10.0
+    assert other.player.health == 2
+    assert other.player.insight
+    assert other.player.current_room is Room.get("test_room3", world=other.world)
+    assert "test_mushroom" not in other.world.linked
+    assert "test_item1" not in Room.get("test_room1", world=other.world).linked
+    assert Door.get("test_door", world=other.world).locked == False
+    assert "lock" in Door.get("test_door", world=other.world).actions
+    assert "drop" in other.player.inv_items["test_item1"].actions
+    assert "test_portal" in other.player.current_room.get_rooms()
+    delta = lambda data: marshal.loads(data[snapshot.HEADER.size:])
+    assert delta(snapshot.save(other)) == delta(data)
+
+def test_snapshot_of_other_world_rejected(game, tmp_path):
+    """Test that a snapshot is only read into a game on the same world file"""
+    data = snapshot.save(game)
+    other_file = tmp_path / "other.yaml"
+    other_file.write_text(open(game.file).read() + "\n# changed\n")
+    other = Adventure(file=str(other_file), output=CaptureOutput())
+    with pytest.raises(snapshot.SnapshotException):
+        snapshot.load(other, data)
+    with pytest.raises(snapshot.SnapshotException):
+        snapshot.load(game, b"not a snapshot")
+
+def test_save_and_load_commands(game, tmp_path):
+    """Test the save and load commands"""
+    path = str(tmp_path / "game.save")
+    Item.get("test_item1", world=game.world).take()
+    game.do_save(path)
+    game.do_load(path)
+    assert list(game.player.inv_items) == ["test_item1"]
+    assert game.output.contains("Game loaded")
+
+def test_failed_load_keeps_game(game, tmp_path):
+    """Test that a save that can't be loaded leaves the current game as it was"""
+    Item.get("test_item1", world=game.world).take()
+    door = Door.get("test_door", world=game.world)
+    door.unlock()
+    door.go()
+    header = snapshot.HEADER.pack(snapshot.MAGIC, snapshot.FORMAT_VERSION, bytes.fromhex(game.world.digest))
+    unknown = {'changed': {"stranger": ("Dragon", (), (), {}, None)}, 'removed': [], 'news': []}
+    other = snapshot.save(game)[:snapshot.HEADER.size - 1] + b"\0" + snapshot.save(game)[snapshot.HEADER.size:]
+    for name, data in [("garbage", b"not a snapshot"), ("truncated", snapshot.save(game)[:-3]),
+                       ("other world", other), ("unknown entity", header + marshal.dumps(unknown))]:
+        path = tmp_path / name
+        path.write_bytes(data)
+        game.output.clear()
+        game.do_load(str(path))
+        assert game.output.contains("Couldn't load the game")
+        assert game.player.current_room is Room.get("test_room3", world=game.world)
+        assert list(game.player.inv_items) == ["test_item1"]
+        assert Door.get("test_door", world=game.world).locked == False
@@ -0,0 +1,114 @@
+import multiprocessing, threading, time
+import pytest
+from adventure import Adventure
+from helpers import *
+from entities import Room, Item
+from sessions import SessionManager
+from store import SQLiteStore
+from characters import AICharacter
+
+@pytest.fixture
+def template(fixture_world_file):
+    """Fixture to provide a game on the bundled test world to spawn sessions from"""
+    return Adventure(file=fixture_world_file, output=CaptureOutput())
+
+@pytest.fixture
+def db(tmp_path):
+    """Fixture to provide the path of a session database"""
+    return str(tmp_path / "sessions.db")
+
+def worker(template, db):
+    """A SessionManager as one gunicorn worker would have it"""
+    return SessionManager(lambda session_id: template.spawn(output=CaptureOutput()), store=SQLiteStore(db))
+
+def test_store_versions(template, db):
+    """Test that a stored game comes back, and that the version only goes up when it changed"""
+    store = SQLiteStore(db)
+    game = template.spawn(output=CaptureOutput())
+    store.save("a", game)
+    assert store.version("a") == 1
+    store.save("a", game)
+    assert store.version("a") == 1
+
+    Item.get("test_item1", world=game.world).take()
+    store.save("a", game)
+    assert store.version("a") == 2
+
+    other = template.spawn(output=CaptureOutput())
+    store.load("a", other)
+    assert "test_item1" in other.player.inv_items
+    store.delete("a")
+    assert store.version("a") is None
+    with pytest.raises(KeyError):
+        store.load("a", template.spawn(output=CaptureOutput()))
+
+def test_sessions_shared_between_workers(template, db):
+    """Test that a change made through one worker is seen by the next request on another"""
+    first, second = worker(template, db), worker(template, db)
+    first["a"] = template.spawn(output=CaptureOutput())
+
+    with second.checkout("a") as game:
+        Room.get("test_room2", world=game.world).go()
+    with first.checkout("a") as game:
+        assert game.player.current_room.name == "test_room2"
+        Item.get("test_item2", world=game.world).take()
+    with second.checkout("a") as game:
+        assert "test_item2" in game.player.inv_items
+
+    del first["a"]
+    with pytest.raises(KeyError):
+        second["a"]
+
+def test_ai_state_shared_between_workers(template, db, openai_client):
+    """Test that an AI character's thread and prompt context reach the other worker"""
+    first, second = worker(template, db), worker(template, db)
+    first["a"] = template.spawn(output=CaptureOutput())
+
+    with first.checkout("a") as game:
+        character = AICharacter("test_ai", "A test AI", game=game, world=game.world, player=game.player, func=lambda obj: None)
+        character.add_to_prompt("You are tired")
+        list(character.reply("hello"))
+    with second.checkout("a") as game:
+        character = AICharacter.get("test_ai", world=game.world)
+        assert character.thread == "mock_thread_1"
+        assert character.thread_length == 3
+        assert "They said: hello" in character.recap
+        character.add_to_prompt("You are awake")
+    with first.checkout("a") as game:
+        character = AICharacter.get("test_ai", world=game.world)
+        assert character.additional_instructions == "You are tired\nYou are awake"
+    assert openai_client.of("thread") == [("thread", "mock_thread_1")]
+
+def test_store_logs(db):
+    """Test that log lines are taken in order, and capped"""
+    store = SQLiteStore(db)
+    store.append_logs("a", ["line 0", "line 1"], limit=3)
+    store.append_logs("a", ["line 2", "line 3", "line 4"], limit=3)
+    store.append_logs("b", ["other"])
+    assert store.take_logs("a") == ["line 2", "line 3", "line 4"]
+    assert store.take_logs("a") == []
+    assert store.take_logs("b") == ["other"]
+
+def hold_lock(db, held, release):
+    with SQLiteStore(db).lock("a"):
+        held.set()
+        release.wait(10)
+
+def test_store_lock_across_processes(db):
+    """Test that a session held by one process waits for it in another, but other sessions don't"""
+    store = SQLiteStore(db)
+    context = multiprocessing.get_context("spawn")
+    held, release = context.Event(), context.Event()
+    process = context.Process(target=hold_lock, args=(db, held, release))
+    process.start()
+    try:
+        assert held.wait(10)
+        with store.lock("b"):
+            pass
+        threading.Timer(0.2, release.set).start()
+        start = time.monotonic()
+        with store.lock("a"):
+            assert time.monotonic() - start >= 0.1
+    finally:
+        release.set()
+        process.join()
@@ -0,0 +1,117 @@
+"""
+Parsed world files, cached in memory and on disk by the hash of their contents.
+
+Parsing world.yaml with the pure-Python YAML loader dominates building a new game, so each world
+file is parsed once, normalized, and kept on disk as marshalled bytes. In memory it becomes a
+read-only WorldTemplate shared by every game built from that file.
+"""
+import hashlib, marshal, os, sys, tempfile, yaml
+from types import MappingProxyType
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+CACHE_DIR = os.getenv("WORLD_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "adventure"))
+FORMAT_VERSION = 1
+
+class WorldTemplate:
+    """
+    A parsed world file, built once and shared read-only by every game loaded from it.
+
+    Games only make shallow copies of the small per-entity specs they pass to constructors, so
+    descriptions, prompts, scripts and link lists are the same objects in every session.
+    """
+    def __init__(self, digest, world):
+        self.digest = digest
+        self.sections = freeze(world)
+        self.rooms = self.sections['rooms']
+        self.doors = self.sections['doors']
+        self.characters = self.sections['characters']
+        self.help = self.sections['help']
+
+    def __getitem__(self, section):
+        return self.sections[section]
+
+    def get(self, section, default=None):
+        return self.sections.get(section, default)
+
+# Content hash -> WorldTemplate
+templates = {}
+
+def load(filename):
+    """Return the shared WorldTemplate for filename, parsing it only if no cache has it"""
+    with open(filename, 'rb') as stream:
+        source = stream.read()
+    digest = hashlib.sha256(source).hexdigest()
+
+    template = templates.get(digest)
+    if template is None:
+        data = read_cache(digest)
+        if data is not None:
+            try:
+                template = WorldTemplate(digest, marshal.loads(data))
+            except (ValueError, EOFError, TypeError, KeyError):
+                # A truncated or corrupt cache: drop it and parse the file again
+                remove_cache(digest)
+        if template is None:
+            data = marshal.dumps(normalize(yaml.load(source, Loader=SafeLoader)))
+            write_cache(digest, data)
+            template = WorldTemplate(digest, marshal.loads(data))
+        templates[digest] = template
+    return template
+
+def freeze(value):
+    """Recursively turn dicts into read-only mappings and lists into tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def normalize(world):
+    """Fill in the sections and keys load_world expects, so it never has to check for them"""
+    if not isinstance(world, dict):
+        raise yaml.YAMLError("A world file must be a mapping with rooms, doors, characters and help")
+    for section, default in [('rooms', []), ('doors', []), ('characters', []), ('help', {})]:
+        if world.get(section) is None:
+            world[section] = default
+    for room in world['rooms']:
+        room['items'] = room.get('items') or []
+        room['links'] = room.get('links') or []
+    return world
+
+def cache_path(digest):
+    version = f"{FORMAT_VERSION}-py{sys.version_info[0]}{sys.version_info[1]}"
+    return os.path.join(CACHE_DIR, f"{digest}.{version}.world")
+
+def read_cache(digest):
+    try:
+        with open(cache_path(digest), 'rb') as stream:
+            return stream.read()
+    except OSError:
+        return None
+
+def write_cache(digest, data):
+    """Write atomically; a read-only or missing cache directory just means no disk cache"""
+    path = cache_path(digest)
+    temp = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(data)
+        os.replace(temp, path)
+    except OSError:
+        if temp is not None:
+            remove(temp)
+
+def remove_cache(digest):
+    remove(cache_path(digest))
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass